@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+'''
+benchmarks.py - time the crawling and network functions against a local fake API
+
+    Usage: python benchmarks.py -s small,medium,large -c <case>,<case> -n <repeats> -o <results.jsonl>
+           python benchmarks.py --startup -n <repeats> -o <results.jsonl>
+
+Every case runs in a forked child process against a fake_mediawiki server in the parent, and
+reports the wall-clock time of the call, the number of API requests it issued, and the peak
+resident memory of the child.
+
+With --startup, the import of each entry point is timed in a fresh interpreter instead, and the
+run fails if an import takes longer than its budget or loads a dependency it should load lazily.
+'''
+
+import sys, os, time, json, resource, tempfile, shutil, datetime, warnings, argparse, multiprocessing, subprocess
+import fake_mediawiki
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def case_editing_dynamics(ws,wiki):
+    return lambda: ws.get_editing_dynamics(u'Page 1',datetime.datetime(2005,1,1),datetime.datetime(2010,1,1),'en')
+
+def case_two_step_outlinks(ws,wiki):
+    return lambda: ws.two_step_outlinks(u'Page 1')
+
+def case_category_members(ws,wiki):
+    depth = len(bin(wiki.n_categories)) - 2
+    return lambda: ws.get_category_members(u'Category:Root',depth)
+
+def case_hyperlink_network(ws,wiki):
+    hyperlink_dict,templates = ws.two_step_outlinks(u'Page 1')
+    return lambda: ws.make_hyperlink_network(hyperlink_dict)
+
+def case_shared_editing_networks(ws,wiki):
+    revisions,alter_revisions = ws.editors_other_activity(u'Page 1',datetime.datetime(2001,1,1),
+                                                          datetime.datetime(2020,1,1),[],'en')
+    def run():
+        ws.make_shared_user_editing_network(alter_revisions,2)
+        ws.make_shared_page_editing_network(alter_revisions,2)
+    return run
+
+def case_category_network(ws,wiki):
+    pages = ws.get_category_members(u'Category:Root',len(bin(wiki.n_categories)) - 2)
+    categories_dict = dict((page,ws.get_page_categories(page)) for page in pages)
+    return lambda: ws.make_category_network(categories_dict)
+
+cases = [('get_editing_dynamics',case_editing_dynamics),
+         ('two_step_outlinks',case_two_step_outlinks),
+         ('get_category_members',case_category_members),
+         ('make_hyperlink_network',case_hyperlink_network),
+         ('make_shared_editing_networks',case_shared_editing_networks),
+         ('make_category_network',case_category_network)]
+
+def run_case(name,make_case,wiki,url,counter,queue):
+    # Runs in the child process: set up, then time only the call being measured
+    workdir = tempfile.mkdtemp()
+    stdout = sys.stdout
+    try:
+        os.chdir(workdir)
+        warnings.simplefilter('ignore')
+        sys.stdout = open(os.devnull,'w')
+        import wikipedia_scraping as ws
+        # Load the lazily imported dependencies first, so that cases time the code, not imports
+        for module in (ws.np,ws.pd,ws.nx):
+            module.__version__
+        ws.api_url = url
+        # The fake server needs no politeness limit; time the code, not the token bucket
+        ws.rate_limiter.set_rate(url.split('/')[2],1e6)
+        call = make_case(ws,wiki)
+        rss_before = peak_rss_mb()
+        requests_before = counter.value
+        start = time.time()
+        call()
+        elapsed = time.time() - start
+        queue.put({'case':name,'seconds':elapsed,'requests':counter.value - requests_before,
+                   'peak_rss_mb':peak_rss_mb(),'rss_growth_mb':peak_rss_mb() - rss_before})
+    except Exception as e:
+        queue.put({'case':name,'error':u'{0}: {1}'.format(type(e).__name__,e)})
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(workdir,ignore_errors=True)
+
+class CountingAPI(fake_mediawiki.FakeAPI):
+    # Shares its request count with forked children through a multiprocessing.Value
+    def __init__(self,wiki,counter):
+        fake_mediawiki.FakeAPI.__init__(self,wiki)
+        self.counter = counter
+
+    def handle(self,params):
+        with self.counter.get_lock():
+            self.counter.value += 1
+        return fake_mediawiki.FakeAPI.handle(self,params)
+
+# Entry points timed by --startup: the module, the most seconds its import may take, and which
+# of wikipedia_lazy.lazy_modules it may load. Crawl-only entry points may load none of them.
+startup_cases = [('wikipedia_crawl',0.25,[]),
+                 ('wikipedia_io',0.25,[]),
+                 ('wikipedia_scraping',0.4,[]),
+                 ('pageview-scraper',0.25,[]),
+                 ('wikipedia_pagecounts',1.0,['numpy','pandas','dateutil'])]
+
+# Run in a fresh interpreter: import one module, or load a script without running its main
+startup_script = '''
+import sys, time, json, imp
+start = time.time()
+if sys.argv[1].endswith('.py'):
+    imp.load_source('__startup__',sys.argv[1])
+else:
+    __import__(sys.argv[1])
+seconds = time.time() - start
+import wikipedia_lazy
+print json.dumps({'seconds':seconds,'loaded':wikipedia_lazy.loaded_modules()})
+'''
+
+def time_startup(name,repeats=1):
+    '''
+    Input:
+    name - a module name, or the name of a script in this directory without .py
+    repeats - how many fresh interpreters to time, keeping the fastest
+
+    Output:
+    result - a dictionary with the seconds of the import alone, the seconds of the whole
+        interpreter run (what a cron job pays), and the lazy modules the import loaded
+    '''
+    directory = os.path.dirname(os.path.abspath(__file__))
+    target = os.path.join(directory,name + '.py') if '-' in name else name
+    env = dict(os.environ,PYTHONPATH=os.pathsep.join([directory] + filter(None,[os.environ.get('PYTHONPATH')])))
+    best = None
+    for i in range(repeats):
+        start = time.time()
+        output = subprocess.check_output([sys.executable,'-c',startup_script,target],env=env,cwd=tempfile.gettempdir())
+        result = json.loads(output.strip().splitlines()[-1])
+        result['process_seconds'] = time.time() - start
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    best['case'] = name
+    return best
+
+def run_startup(repeats=3):
+    '''
+    Output:
+    results - a list of dictionaries, one per startup_cases entry, from time_startup with the
+        budget and whether the entry point kept within it
+    '''
+    results = list()
+    for name,budget,allowed in startup_cases:
+        result = time_startup(name,repeats)
+        result['budget'] = budget
+        result['unexpected'] = [module for module in result['loaded'] if module not in allowed]
+        result['ok'] = result['seconds'] <= budget and not result['unexpected']
+        results.append(result)
+        print u"{case:<24} {seconds:>7.3f}s import {process_seconds:>7.3f}s process {budget:>6.2f}s budget  {status}".format(
+            status='ok' if result['ok'] else 'FAILED' + (' loads ' + ','.join(result['unexpected']) if result['unexpected'] else ''),**result)
+    return results
+
+def run_benchmarks(size_names,case_names,repeats=1):
+    '''
+    Input:
+    size_names - a list of keys of fake_mediawiki.sizes
+    case_names - a list of case names from cases
+    repeats - how many times to run each case, keeping the fastest
+
+    Output:
+    results - a list of dictionaries, one per (size,case), with seconds, requests, and memory
+    '''
+    results = list()
+    for size_name in size_names:
+        wiki = fake_mediawiki.SyntheticWiki(**fake_mediawiki.sizes[size_name])
+        counter = multiprocessing.Value('l',0)
+        server = fake_mediawiki.start_server(CountingAPI(wiki,counter))
+        url = u'http://127.0.0.1:{0}/{{0}}/api.php'.format(server.server_address[1])
+        try:
+            for name,make_case in cases:
+                if name not in case_names:
+                    continue
+                best = None
+                for i in range(repeats):
+                    queue = multiprocessing.Queue()
+                    child = multiprocessing.Process(target=run_case,args=(name,make_case,wiki,url,counter,queue))
+                    child.start()
+                    result = queue.get()
+                    child.join()
+                    if best is None or 'error' in best or result.get('seconds',0) < best['seconds']:
+                        best = result
+                best['size'] = size_name
+                results.append(best)
+                print_result(best)
+        finally:
+            server.shutdown()
+    return results
+
+def print_result(result):
+    if 'error' in result:
+        print u"{0:<8} {1:<30} failed: {2}".format(result['size'],result['case'],result['error'])
+    else:
+        print u"{size:<8} {case:<30} {seconds:>9.3f}s {requests:>8d} requests {peak_rss_mb:>8.1f} MB peak {rss_growth_mb:>8.1f} MB growth".format(**result)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark wikipedia_scraping against a local fake API')
+    parser.add_argument('-s','--sizes',default='small,medium',help='comma-separated sizes from fake_mediawiki.sizes')
+    parser.add_argument('-c','--cases',default=','.join(name for name,case in cases),help='comma-separated case names')
+    parser.add_argument('-n','--repeats',type=int,default=1)
+    parser.add_argument('-o','--output',help='append results to this JSON lines file')
+    parser.add_argument('--startup',action='store_true',help='time the imports of the entry points instead')
+    args = parser.parse_args(argv)
+    if args.startup:
+        results = run_startup(max(args.repeats,3))
+    else:
+        results = run_benchmarks(args.sizes.split(','),args.cases.split(','),args.repeats)
+    if args.output:
+        with open(args.output,'a') as f:
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+    if not all(result.get('ok',True) for result in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+# pytest configuration: this file puts the repository root, and so its flat modules, on sys.path
+# for the tests in tests/. Run them with
+#
+#     python -m pytest -q
@@ -0,0 +1,737 @@
+# -*- coding: utf-8 -*-
+'''
+fake_mediawiki.py - a local stand-in for the MediaWiki api.php endpoint
+
+Serves deterministic synthetic JSON (or recorded responses) for the queries made by
+wikipedia_scraping.py, including query-continue pagination for revisions, usercontribs,
+backlinks, categorymembers, links, templates and categories, and stats.grok.se style daily
+pageviews under /json/. This lets the crawling functions be timed and their requests counted
+without hitting live Wikipedia.
+
+    Usage: python fake_mediawiki.py -p <port> -s <small|medium|large> -r <recordings.jsonl>
+           python fake_mediawiki.py -s <size> -d <dump.xml.gz> [--stub]
+           python fake_mediawiki.py -s <size> --sql <directory>
+
+Point wikipedia_scraping at it with:
+
+    wikipedia_scraping.api_url = u'http://127.0.0.1:<port>/{0}/api.php'
+    wikipedia_scraping.pageviews_url = u'http://127.0.0.1:<port>/json/{0}/{1}/{2}'
+'''
+
+import os, sys, time, json, bz2, gzip, random, datetime, threading, urllib, urlparse, argparse
+from xml.sax.saxutils import escape
+import BaseHTTPServer, SocketServer
+
+# Synthetic wiki sizes used by the benchmarks
+sizes = {'small': {'pages':50,'revisions':100,'users':60,'links':10,'categories':15},
+         'medium': {'pages':200,'revisions':500,'users':250,'links':25,'categories':63},
+         'large': {'pages':800,'revisions':2000,'users':1000,'links':50,'categories':255}}
+
+namespaces = {0:u'',1:u'Talk',2:u'User',3:u'User talk',10:u'Template',14:u'Category'}
+
+base_timestamp = datetime.datetime(2005,1,1)
+
+def parse_api_timestamp(string):
+    # The scrapers send '%Y%m%d%H%M%S', the API itself returns '%Y-%m-%dT%H:%M:%SZ'
+    string = string.replace(u'-',u'').replace(u'T',u'').replace(u':',u'').replace(u'Z',u'')
+    return datetime.datetime.strptime(string,'%Y%m%d%H%M%S')
+
+def format_api_timestamp(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def request_key(params):
+    # Recordings are matched on every parameter except the ones wikitools adds itself
+    return tuple(sorted((k,v) for k,v in params.iteritems() if k not in ('format','maxlag')))
+
+def load_recordings(path):
+    '''
+    Input:
+    path - a JSON lines file where each line is {"params": {...}, "response": {...}}
+
+    Output:
+    recordings - a dictionary keyed by request_key(params) returning the recorded response
+    '''
+    recordings = dict()
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                recordings[request_key(record['params'])] = record['response']
+    return recordings
+
+class SyntheticWiki(object):
+    '''
+    A deterministic wiki of articles "Page 0".."Page n", their talk pages, users "User 0".."User m",
+    a binary tree of categories under "Category:Root", and navigation templates. Nothing is stored
+    per revision; every revision is computed from its page and position when it is requested.
+    '''
+    def __init__(self,pages=50,revisions=100,users=60,links=10,categories=15,seed=0):
+        self.n_pages = pages
+        self.n_revisions = revisions
+        self.n_users = users
+        self.n_links = links
+        self.n_categories = categories
+        rng = random.Random(seed)
+        self.words = [u''.join(rng.choice(u'abcdefghijklmnopqrstuvwxyz') for i in range(rng.randint(2,9)))
+                      for j in range(500)]
+        self.outlinks = [sorted(set((p + k * k + 1) % pages for k in range(links))) for p in range(pages)]
+        self.inlinks = [list() for p in range(pages)]
+        for p,targets in enumerate(self.outlinks):
+            for q in targets:
+                self.inlinks[q].append(p)
+        self.contributions = dict()
+
+    # Pages 0..n-1 are articles and n..2n-1 their talk pages
+    def page_from_title(self,title):
+        title = title.replace(u'_',u' ')
+        if title.startswith(u'Talk:Page '):
+            number,talk = title[10:],True
+        elif title.startswith(u'Page '):
+            number,talk = title[5:],False
+        else:
+            return None
+        if not number.isdigit() or int(number) >= self.n_pages:
+            return None
+        return int(number) + (self.n_pages if talk else 0)
+
+    def page_title(self,page):
+        if page >= self.n_pages:
+            return u'Talk:Page {0}'.format(page - self.n_pages)
+        return u'Page {0}'.format(page)
+
+    def page_ns(self,page):
+        return 1 if page >= self.n_pages else 0
+
+    def revision_count(self,page):
+        return self.n_revisions / 4 if page >= self.n_pages else self.n_revisions
+
+    def revision_user(self,page,num):
+        return (page * 7919 + num * 104729) % self.n_users
+
+    def revision_timestamp(self,page,num):
+        return base_timestamp + datetime.timedelta(hours=6 * num,minutes=17 * page)
+
+    def revision_content(self,page,num):
+        article = page % self.n_pages
+        rng = random.Random(page * 100003 + num)
+        words = [rng.choice(self.words) for i in range(40 + num % 60)]
+        links = self.outlinks[article][:1 + num % self.n_links]
+        return u' '.join(words) + u'\n' + u' '.join(u'[[Page {0}]]'.format(q) for q in links)
+
+    def revision(self,page,num,content=False):
+        user = self.revision_user(page,num)
+        rev = {'revid': page * 1000000 + num + 1,
+               'parentid': page * 1000000 + num if num > 0 else 0,
+               'user': u'User {0}'.format(user),
+               'userid': user + 1,
+               'timestamp': format_api_timestamp(self.revision_timestamp(page,num)),
+               'size': 500 + 37 * num + page % 100}
+        if content:
+            rev['*'] = self.revision_content(page,num)
+        return rev
+
+    def user_contributions(self,user):
+        # Every (timestamp,page,num) edited by a user, newest first as the API returns them
+        if user not in self.contributions:
+            contribs = list()
+            for page in range(2 * self.n_pages):
+                for num in range(self.revision_count(page)):
+                    if self.revision_user(page,num) == user:
+                        contribs.append((self.revision_timestamp(page,num),page,num))
+            contribs.sort(reverse=True)
+            self.contributions[user] = contribs
+        return self.contributions[user]
+
+    def category_title(self,cat):
+        return u'Category:Root' if cat == 0 else u'Category:C{0}'.format(cat)
+
+    def category_from_title(self,title):
+        title = title.replace(u'_',u' ')
+        if title == u'Category:Root':
+            return 0
+        if title.startswith(u'Category:C') and title[10:].isdigit() and 0 < int(title[10:]) < self.n_categories:
+            return int(title[10:])
+        return None
+
+    def page_categories(self,article):
+        return [article % self.n_categories]
+
+    def page_templates(self,article):
+        return [u'Template:Nav {0}'.format(article % 10),u'Template:Cite web']
+
+    # Every article has two redirects to it, "Page k (redirect)" and "Pk"
+    def redirect_titles(self,article):
+        return [u'P{0}'.format(article),u'Page {0} (redirect)'.format(article)]
+
+    # Every fourth article is semi-protected for two weeks; every eighth is raised to full
+    # protection after five days and unprotected twenty days later; every twelfth is protected
+    # again indefinitely after sixty days, in the oldest "[edit=...:move=...]" form
+    def protection_events(self):
+        events = list()
+        for article in range(0,self.n_pages,4):
+            start = base_timestamp + datetime.timedelta(days=3 * article + 10,hours=12)
+            expiry = start + datetime.timedelta(days=14)
+            events.append((start,article,u'protect',protection_description([(u'edit',u'autoconfirmed',expiry),
+                                                                             (u'move',u'autoconfirmed',expiry)])))
+            if article % 8 == 0:
+                events.append((start + datetime.timedelta(days=5),article,u'modify',
+                               protection_description([(u'edit',u'sysop',None),(u'move',u'sysop',None)])))
+                events.append((start + datetime.timedelta(days=25),article,u'unprotect',u''))
+            if article % 12 == 0:
+                events.append((start + datetime.timedelta(days=60),article,u'protect',u'[edit=autoconfirmed:move=autoconfirmed]'))
+        events.sort()
+        return [{'logid':num + 1,'pageid':article + 1,'ns':0,'title':self.page_title(article),'type':u'protect',
+                 'action':action,'user':u'User 0','timestamp':format_api_timestamp(when),
+                 'comment':u'Persistent vandalism','0':description,'1':u''}
+                for num,(when,article,action,description) in enumerate(events)]
+
+    def redirect_target(self,title):
+        title = title.replace(u'_',u' ')
+        if title.startswith(u'Page ') and title.endswith(u' (redirect)'):
+            number = title[5:-11]
+        elif title.startswith(u'P') and not title.startswith(u'Page'):
+            number = title[1:]
+        else:
+            return None
+        if not number.isdigit() or int(number) >= self.n_pages:
+            return None
+        return int(number)
+
+def protection_description(protections):
+    # The "[edit=autoconfirmed] (expires 12:00, 15 January 2005 (UTC))" form of log events before 1.25
+    parts = list()
+    for kind,level,expiry in protections:
+        if expiry is None:
+            parts.append(u'[{0}={1}] (indefinite)'.format(kind,level))
+        else:
+            parts.append(u'[{0}={1}] (expires {2}, {3} {4} (UTC))'.format(kind,level,expiry.strftime('%H:%M'),
+                                                                           expiry.day,expiry.strftime('%B %Y')))
+    return u''.join(parts)
+
+def write_dump(wiki,path,content=True):
+    '''
+    Input:
+    wiki - a SyntheticWiki
+    path - the file to write, compressed if it ends in .gz or .bz2
+    content - write pages-meta-history style text; otherwise a stub dump with only text sizes
+
+    Output:
+    count - the number of revisions written, in the MediaWiki export-0.10 XML format
+    '''
+    if path.endswith('.gz'):
+        f = gzip.open(path,'wb')
+    elif path.endswith('.bz2'):
+        f = bz2.BZ2File(path,'wb')
+    else:
+        f = open(path,'wb')
+    write = lambda string: f.write(string.encode('utf-8'))
+    count = 0
+    with f:
+        write(u'<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">\n')
+        write(u'  <siteinfo>\n    <sitename>Fakepedia</sitename>\n    <namespaces>\n')
+        for nsid,name in sorted(namespaces.items()):
+            write(u'      <namespace key="{0}" case="first-letter">{1}</namespace>\n'.format(nsid,escape(name)))
+        write(u'    </namespaces>\n  </siteinfo>\n')
+        for page in range(2 * wiki.n_pages):
+            write(u'  <page>\n    <title>{0}</title>\n    <ns>{1}</ns>\n    <id>{2}</id>\n'.format(
+                escape(wiki.page_title(page)),wiki.page_ns(page),page + 1))
+            for num in range(wiki.revision_count(page)):
+                rev = wiki.revision(page,num,content)
+                write(u'    <revision>\n      <id>{0}</id>\n'.format(rev['revid']))
+                if rev['parentid']:
+                    write(u'      <parentid>{0}</parentid>\n'.format(rev['parentid']))
+                write(u'      <timestamp>{0}</timestamp>\n'.format(rev['timestamp']))
+                write(u'      <contributor>\n        <username>{0}</username>\n        <id>{1}</id>\n      </contributor>\n'.format(
+                    escape(rev['user']),rev['userid']))
+                if content:
+                    write(u'      <text xml:space="preserve" bytes="{0}">{1}</text>\n'.format(rev['size'],escape(rev['*'])))
+                else:
+                    write(u'      <text id="{0}" bytes="{1}" />\n'.format(rev['revid'],rev['size']))
+                write(u'    </revision>\n')
+                count += 1
+            write(u'  </page>\n')
+        write(u'</mediawiki>\n')
+    return count
+
+sql_tables = {'page':['page_id','page_namespace','page_title','page_restrictions','page_is_redirect',
+                      'page_is_new','page_random','page_touched','page_latest','page_len'],
+              'pagelinks':['pl_from','pl_namespace','pl_title','pl_from_namespace'],
+              'templatelinks':['tl_from','tl_namespace','tl_title','tl_from_namespace'],
+              'redirect':['rd_from','rd_namespace','rd_title','rd_interwiki','rd_fragment'],
+              'categorylinks':['cl_from','cl_to','cl_sortkey','cl_timestamp','cl_sortkey_prefix',
+                               'cl_collation','cl_type']}
+
+def sql_literal(value):
+    if isinstance(value,basestring):
+        if isinstance(value,unicode):
+            value = value.encode('utf-8')
+        return "'" + value.replace('\\','\\\\').replace("'","\\'") + "'"
+    return str(value)
+
+def write_sql_table(path,table,rows,rows_per_insert=100):
+    # A mysqldump-style file of one table, as the page and *links dumps are distributed
+    f = gzip.open(path,'wb') if path.endswith('.gz') else open(path,'wb')
+    with f:
+        f.write('DROP TABLE IF EXISTS `{0}`;\nCREATE TABLE `{0}` (\n'.format(table))
+        f.write(',\n'.join('  `{0}` varbinary(255) NOT NULL'.format(c) for c in sql_tables[table]))
+        f.write('\n) ENGINE=InnoDB DEFAULT CHARSET=binary;\n')
+        for start in range(0,len(rows),rows_per_insert):
+            values = ','.join('(' + ','.join(sql_literal(v) for v in row) + ')'
+                              for row in rows[start:start + rows_per_insert])
+            f.write('INSERT INTO `{0}` VALUES {1};\n'.format(table,values))
+
+def write_sql_dumps(wiki,directory):
+    '''
+    Input:
+    wiki - a SyntheticWiki
+    directory - the directory to write fakewiki-page.sql.gz, -pagelinks, -templatelinks,
+        -categorylinks and -redirect.sql.gz to
+
+    Output:
+    paths - a dictionary keyed by table of the files written
+    '''
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    dbkey = lambda title: title.split(u':',1)[-1].replace(u' ',u'_')
+    # Articles and talk pages keep their ids from the API; category pages come after them
+    category_id = lambda cat: 2 * wiki.n_pages + cat + 1
+    pages = [(page + 1,wiki.page_ns(page),dbkey(wiki.page_title(page)),'',0,0,0.5,'20150101000000',
+              page * 1000000 + wiki.revision_count(page),0) for page in range(2 * wiki.n_pages)]
+    pages += [(category_id(cat),14,dbkey(wiki.category_title(cat)),'',0,0,0.5,'20150101000000',0,0)
+              for cat in range(wiki.n_categories)]
+    # Redirect pages come last, each linking to its target as MediaWiki records them
+    redirect_pages = [(category_id(wiki.n_categories) + 2 * article + k,title,article)
+                      for article in range(wiki.n_pages) for k,title in enumerate(wiki.redirect_titles(article))]
+    pages += [(page_id,0,dbkey(title),'',1,0,0.5,'20150101000000',0,0) for page_id,title,article in redirect_pages]
+    redirect = [(page_id,0,dbkey(wiki.page_title(article)),'','') for page_id,title,article in redirect_pages]
+    pagelinks = [(page + 1,0,dbkey(wiki.page_title(q)),0) for page in range(wiki.n_pages) for q in wiki.outlinks[page]]
+    pagelinks += [(page_id,0,dbkey(wiki.page_title(article)),0) for page_id,title,article in redirect_pages]
+    templatelinks = [(page + 1,10,dbkey(t),0) for page in range(wiki.n_pages) for t in wiki.page_templates(page)]
+    categorylinks = [(page + 1,dbkey(wiki.category_title(c)),'','2015-01-01 00:00:00','','uppercase','page')
+                     for page in range(wiki.n_pages) for c in wiki.page_categories(page)]
+    categorylinks += [(category_id(cat),dbkey(wiki.category_title((cat - 1) // 2)),'','2015-01-01 00:00:00','',
+                       'uppercase','subcat') for cat in range(1,wiki.n_categories)]
+    paths = dict()
+    for table,rows in (('page',pages),('pagelinks',pagelinks),('templatelinks',templatelinks),
+                       ('categorylinks',categorylinks),('redirect',redirect)):
+        paths[table] = os.path.join(directory,'fakewiki-{0}.sql.gz'.format(table))
+        write_sql_table(paths[table],table,rows)
+    return paths
+
+def pagecount_lines(wiki,hour):
+    # The "project title count bytes" lines of one hour: each article under its title, a lower-case
+    # and a percent-encoded spelling, and both of its redirects, plus another project's lines
+    lines = list()
+    for article in range(wiki.n_pages):
+        title = wiki.page_title(article).replace(u' ',u'_')
+        views = (article * 31 + hour * 7) % 50 + 1
+        lines.append((u'de',title,views % 7 + 1))
+        lines.append((u'en',title,views))
+        lines.append((u'en',u'page_{0}'.format(article),hour % 3))
+        lines.append((u'en',u'Page%20{0}'.format(article),1))
+        for k,redirect in enumerate(wiki.redirect_titles(article)):
+            lines.append((u'en',redirect.replace(u' ',u'_'),(article + hour + k) % 5))
+    return [line for line in sorted(lines) if line[2] > 0]
+
+def write_pagecounts(wiki,datapath,start,hours):
+    '''
+    Input:
+    wiki - a SyntheticWiki
+    datapath - the directory to write to, in the year/month/ layout of pageview-scraper.py
+    start - the datetime of the first hour
+    hours - the number of hourly pagecounts-raw files to write
+
+    Output:
+    paths - the files written
+    '''
+    paths = list()
+    for hour in range(hours):
+        dt = start + datetime.timedelta(hours=hour)
+        directory = os.path.join(datapath,dt.strftime('%Y'),dt.strftime('%m'))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory,dt.strftime('pagecounts-%Y%m%d-%H0000.gz'))
+        with gzip.open(path,'wb') as f:
+            for project,title,views in pagecount_lines(wiki,hour):
+                f.write(u'{0} {1} {2} {3}\n'.format(project,title,views,views * 20000).encode('utf-8'))
+        paths.append(path)
+    return paths
+
+def paginate(items,params,prefix,limit_cap=500):
+    # Offset-based continuation: returns the slice for this request and the query-continue block
+    limit = params.get(prefix+'limit','10')
+    limit = limit_cap if limit == 'max' else min(int(limit),limit_cap)
+    offset = int(params.get(prefix+'continue','0'))
+    chunk = items[offset:offset+limit]
+    if offset + limit < len(items):
+        return chunk,{prefix+'continue':str(offset+limit)}
+    return chunk,None
+
+class FakeAPI(object):
+    '''
+    Answers api.php parameter dictionaries with the JSON the MediaWiki API would return,
+    from recordings when a matching request was recorded and from a SyntheticWiki otherwise.
+    '''
+    def __init__(self,wiki,recordings=None,lag=0,error_rate=0.,seed=0,latency=0.):
+        self.wiki = wiki
+        self.recordings = recordings or dict()
+        self.lock = threading.Lock()
+        self.counts = dict()
+        # Simulated replication lag in seconds and fraction of requests answered with a 503
+        self.lag = lag
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        # Seconds every response is delayed by, to stand in for the network round trip
+        self.latency = latency
+
+    def request_count(self):
+        with self.lock:
+            return sum(self.counts.values())
+
+    def http_response(self,params):
+        '''
+        Input:
+        params - a dictionary of api.php parameters
+
+        Output:
+        status - the HTTP status code
+        headers - a dictionary of extra HTTP headers
+        result - the JSON-serializable response body
+        '''
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            failed = self.error_rate > 0 and self.random.random() < self.error_rate
+        if failed:
+            return 503,{'Retry-After':'1'},{'error':{'code':'unavailable','info':'Simulated outage'}}
+        if self.lag > float(params.get('maxlag',self.lag)):
+            # The API answers maxlag with HTTP 200, an error body, and these two headers
+            info = 'Waiting for 127.0.0.1: {0} seconds lagged'.format(self.lag)
+            return 200,{'X-Database-Lag':str(self.lag),'Retry-After':'1'},{'error':{'code':'maxlag','info':info}}
+        return 200,{},self.handle(params)
+
+    def pageview_response(self,path):
+        '''
+        Input:
+        path - a stats.grok.se path, /json/<lang>/<YYYYMM>/<title>
+
+        Output:
+        status, headers, result - as for http_response. Every day 01-31 of the month is returned,
+            including invalid ones like 02-30, as stats.grok.se did.
+        '''
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.counts['pageviews'] = self.counts.get('pageviews',0) + 1
+            failed = self.error_rate > 0 and self.random.random() < self.error_rate
+        if failed:
+            return 503,{'Retry-After':'1'},{'error':'Simulated outage'}
+        parts = path.split('/',4)
+        if len(parts) < 5 or len(parts[3]) != 6 or not parts[3].isdigit():
+            return 404,{},{'error':'Not found'}
+        month,title = parts[3],parts[4].decode('utf-8')
+        rng = random.Random(u'{0}/{1}'.format(month,title))
+        views = dict(('{0}-{1}-{2:02d}'.format(month[:4],month[4:],day),rng.randint(0,5000)) for day in range(1,32))
+        return 200,{},{'title':title,'month':month,'daily_views':views}
+
+    def handle(self,params):
+        module = params.get('list') or params.get('prop') or params.get('meta') or params.get('action')
+        with self.lock:
+            self.counts[module] = self.counts.get(module,0) + 1
+        key = request_key(params)
+        if key in self.recordings:
+            return self.recordings[key]
+        if params.get('action') != 'query':
+            return {'error':{'code':'unsupported','info':'Only action=query is supported'}}
+        if 'siteinfo' in params.get('meta',''):
+            return self.siteinfo(params)
+        handler = {'revisions':self.revisions,'info':self.info,'links':self.links,'templates':self.templates,
+                   'categories':self.categories,'usercontribs':self.usercontribs,'backlinks':self.backlinks,
+                   'categorymembers':self.categorymembers,'redirects':self.redirects,'users':self.users,'langlinks':self.langlinks,
+                   'logevents':self.logevents}.get(module)
+        if handler is None:
+            return {'error':{'code':'unsupported','info':'Unsupported module {0}'.format(module)}}
+        return handler(params)
+
+    def siteinfo(self,params):
+        ns = dict()
+        for nsid,name in namespaces.iteritems():
+            ns[str(nsid)] = {'id':nsid,'*':name,'canonical':name}
+        return {'query':{'general':{'sitename':'Fakepedia','generator':'MediaWiki 1.22wmf22','writeapi':''},
+                         'namespaces':ns,'namespacealiases':[]}}
+
+    def pages(self,params,build):
+        # Shared handling of titles= for prop modules; build returns (page entry, query-continue)
+        pages = dict()
+        continues = None
+        for title in params.get('titles',u'').split(u'|'):
+            page = self.wiki.page_from_title(title)
+            if page is None:
+                pages[str(-1 - len(pages))] = {'ns':0,'title':title,'missing':''}
+                continue
+            entry = {'pageid':page + 1,'ns':self.wiki.page_ns(page),'title':self.wiki.page_title(page)}
+            extra,more = build(page)
+            entry.update(extra)
+            pages[str(page + 1)] = entry
+            continues = continues or more
+        return pages,continues
+
+    def respond(self,query,module,continues):
+        result = {'query':query}
+        if continues:
+            result['query-continue'] = {module:continues}
+        return result
+
+    def resolve_redirects(self,params):
+        # With redirects=, titles that are redirects are replaced by their targets and listed
+        if 'redirects' not in params:
+            return params,list()
+        titles,redirects = list(),list()
+        for title in params.get('titles',u'').split(u'|'):
+            target = self.wiki.redirect_target(title)
+            if target is not None:
+                redirects.append({'from':title.replace(u'_',u' '),'to':self.wiki.page_title(target)})
+                title = self.wiki.page_title(target)
+            titles.append(title)
+        params = dict(params)
+        params['titles'] = u'|'.join(titles)
+        return params,redirects
+
+    def info(self,params):
+        params,redirects = self.resolve_redirects(params)
+        pages,continues = self.pages(params,lambda page: ({},None))
+        query = {'pages':pages}
+        if redirects:
+            query['redirects'] = redirects
+        return self.respond(query,'info',None)
+
+    def redirects(self,params):
+        params,redirects = self.resolve_redirects(params)
+        def build(page):
+            if page >= self.wiki.n_pages:
+                return {},None
+            chunk,more = paginate(self.wiki.redirect_titles(page),params,'rd')
+            return {'redirects':[{'pageid':0,'ns':0,'title':t} for t in chunk]},more
+        pages,continues = self.pages(params,build)
+        query = {'pages':pages}
+        if redirects:
+            query['redirects'] = redirects
+        return self.respond(query,'redirects',continues)
+
+    def revisions(self,params):
+        content = 'content' in params.get('rvprop','')
+        newer = params.get('rvdir','older') == 'newer'
+        def build(page):
+            nums = range(self.wiki.revision_count(page))
+            if 'rvstart' in params or 'rvend' in params:
+                low = params.get('rvstart' if newer else 'rvend')
+                high = params.get('rvend' if newer else 'rvstart')
+                low = parse_api_timestamp(low) if low else None
+                high = parse_api_timestamp(high) if high else None
+                nums = [n for n in nums if (low is None or self.wiki.revision_timestamp(page,n) >= low)
+                                       and (high is None or self.wiki.revision_timestamp(page,n) <= high)]
+            if not newer:
+                nums = nums[::-1]
+            # The API caps revisions with content at 50 per request
+            chunk,more = paginate(nums,params,'rv',50 if content else 500)
+            return {'revisions':[self.wiki.revision(page,n,content) for n in chunk]},more
+        pages,continues = self.pages(params,build)
+        return self.respond({'pages':pages},'revisions',continues)
+
+    def langlinks(self,params):
+        # Every synthetic page exists under the same title in a handful of other editions
+        def build(page):
+            return {'langlinks':[{'lang':lang,'*':self.wiki.page_title(page)} for lang in ('de','fr','pt')]},None
+        pages,continues = self.pages(params,build)
+        return self.respond({'pages':pages},'langlinks',continues)
+
+    def links(self,params):
+        def build(page):
+            targets = self.wiki.outlinks[page % self.wiki.n_pages]
+            chunk,more = paginate(targets,params,'pl')
+            return {'links':[{'ns':0,'title':self.wiki.page_title(q)} for q in chunk]},more
+        pages,continues = self.pages(params,build)
+        return self.respond({'pages':pages},'links',continues)
+
+    def templates(self,params):
+        def build(page):
+            chunk,more = paginate(self.wiki.page_templates(page % self.wiki.n_pages),params,'tl')
+            return {'templates':[{'ns':10,'title':t} for t in chunk]},more
+        pages,continues = self.pages(params,build)
+        return self.respond({'pages':pages},'templates',continues)
+
+    def categories(self,params):
+        def build(page):
+            cats = self.wiki.page_categories(page % self.wiki.n_pages)
+            chunk,more = paginate(cats,params,'cl')
+            return {'categories':[{'ns':14,'title':self.wiki.category_title(c)} for c in chunk]},more
+        pages,continues = self.pages(params,build)
+        return self.respond({'pages':pages},'categories',continues)
+
+    def usercontribs(self,params):
+        user = params.get('ucuser',u'')
+        if user.startswith(u'User:'):
+            user = user[5:]
+        if not user.startswith(u'User ') or not user[5:].isdigit():
+            return self.respond({'usercontribs':[]},'usercontribs',None)
+        contribs = self.wiki.user_contributions(int(user[5:]))
+        if 'ucnamespace' in params:
+            allowed = set(int(ns) for ns in params['ucnamespace'].split(u'|'))
+            contribs = [c for c in contribs if self.wiki.page_ns(c[1]) in allowed]
+        if 'ucend' in params:
+            end = parse_api_timestamp(params['ucend'])
+            contribs = [c for c in contribs if c[0] >= end]
+        chunk,more = paginate(contribs,params,'uc')
+        results = list()
+        for timestamp,page,num in chunk:
+            rev = self.wiki.revision(page,num)
+            results.append({'user':user,'userid':rev['userid'],'pageid':page + 1,'revid':rev['revid'],
+                            'parentid':rev['parentid'],'ns':self.wiki.page_ns(page),
+                            'title':self.wiki.page_title(page),'timestamp':rev['timestamp'],
+                            'size':rev['size'],'sizediff':rev['size'] - (self.wiki.revision(page,num - 1)['size'] if num else 0)})
+        return self.respond({'usercontribs':results},'usercontribs',more)
+
+    def backlinks(self,params):
+        page = self.wiki.page_from_title(params.get('bltitle',u''))
+        sources = self.wiki.inlinks[page] if page is not None and page < self.wiki.n_pages else list()
+        chunk,more = paginate(sources,params,'bl')
+        results = [{'pageid':q + 1,'ns':0,'title':self.wiki.page_title(q)} for q in chunk]
+        return self.respond({'backlinks':results},'backlinks',more)
+
+    def categorymembers(self,params):
+        cat = self.wiki.category_from_title(params.get('cmtitle',u''))
+        members = list()
+        if cat is not None:
+            if params.get('cmtype','page|subcat|file') == 'subcat':
+                members = [{'ns':14,'title':self.wiki.category_title(c),'pageid':0}
+                           for c in (2 * cat + 1,2 * cat + 2) if c < self.wiki.n_categories]
+            else:
+                members = [{'ns':0,'title':self.wiki.page_title(p),'pageid':p + 1}
+                           for p in range(self.wiki.n_pages) if cat in self.wiki.page_categories(p)]
+        chunk,more = paginate(members,params,'cm')
+        return self.respond({'categorymembers':chunk},'categorymembers',more)
+
+    def logevents(self,params):
+        events = self.wiki.protection_events()
+        if params.get('letype',u'protect') != u'protect':
+            events = list()
+        if 'letitle' in params:
+            events = [e for e in events if e['title'] == params['letitle'].replace(u'_',u' ')]
+        newer = params.get('ledir','older') == 'newer'
+        # lestart is where the listing starts, the earliest event when listing newer ones
+        low,high = (params.get('lestart'),params.get('leend')) if newer else (params.get('leend'),params.get('lestart'))
+        if low is not None:
+            events = [e for e in events if parse_api_timestamp(e['timestamp']) >= parse_api_timestamp(low)]
+        if high is not None:
+            events = [e for e in events if parse_api_timestamp(e['timestamp']) <= parse_api_timestamp(high)]
+        if not newer:
+            events = events[::-1]
+        chunk,more = paginate(events,params,'le')
+        return self.respond({'logevents':chunk},'logevents',more)
+
+    def users(self,params):
+        results = list()
+        normalized = list()
+        for name in params.get('ususers',u'').split(u'|'):
+            # Like MediaWiki, answer under the canonical name and list the names it changed
+            if u' '.join(name.split()) != name:
+                normalized.append({'from':name,'to':u' '.join(name.split())})
+                name = u' '.join(name.split())
+            if name.startswith(u'User ') and name[5:].isdigit() and int(name[5:]) < self.wiki.n_users:
+                number = int(name[5:])
+                results.append({'userid':number + 1,'name':name,'editcount':self.wiki.n_revisions,
+                                'registration':format_api_timestamp(base_timestamp),'groups':[u'*',u'user'],
+                                'gender':u'unknown'})
+            else:
+                results.append({'name':name,'missing':''})
+        if normalized:
+            return {'query':{'normalized':normalized,'users':results}}
+        return {'query':{'users':results}}
+
+class FakeAPIHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # HTTP/1.1 so that clients can keep connections alive between requests, with the response
+    # buffered and sent in one write so that Nagle's algorithm does not delay kept-alive replies
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def do_GET(self):
+        path = urlparse.urlsplit(self.path).path
+        if path.startswith('/json/'):
+            self.respond(*self.server.api.pageview_response(urllib.unquote(path)))
+        else:
+            self.answer(urlparse.urlsplit(self.path).query)
+
+    def do_POST(self):
+        self.answer(self.rfile.read(int(self.headers.getheader('content-length',0))))
+
+    def answer(self,query_string):
+        params = dict((k.decode('utf-8'),v.decode('utf-8'))
+                      for k,v in urlparse.parse_qsl(query_string,keep_blank_values=True))
+        self.respond(*self.server.api.http_response(params))
+
+    def respond(self,status,headers,result):
+        body = json.dumps(result)
+        self.send_response(status)
+        for header,value in headers.iteritems():
+            self.send_header(header,value)
+        self.send_header('Content-Type','application/json; charset=utf-8')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        pass
+
+class FakeMediaWikiServer(SocketServer.ThreadingMixIn,BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def start_server(api,port=0):
+    '''
+    Input:
+    api - a FakeAPI
+    port - the local port to listen on, 0 picks a free one
+
+    Output:
+    server - a running FakeMediaWikiServer; server.server_address[1] is its port
+        and server.shutdown() stops it
+    '''
+    server = FakeMediaWikiServer(('127.0.0.1',port),FakeAPIHandler)
+    server.api = api
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Serve a local stand-in for the MediaWiki API')
+    parser.add_argument('-p','--port',type=int,default=8080)
+    parser.add_argument('-s','--size',choices=sorted(sizes.keys()),default='small')
+    parser.add_argument('-r','--recordings',help='JSON lines file of recorded responses')
+    parser.add_argument('--lag',type=float,default=0,help='simulated replication lag in seconds')
+    parser.add_argument('--error-rate',type=float,default=0.,help='fraction of requests answered with a 503')
+    parser.add_argument('--latency',type=float,default=0.,help='seconds to delay every response by')
+    parser.add_argument('-d','--dump',help='write the synthetic wiki to this XML dump file and exit')
+    parser.add_argument('--stub',action='store_true',help='write the dump without revision text')
+    parser.add_argument('--sql',help='write the page and link tables as SQL dumps to this directory and exit')
+    args = parser.parse_args(argv)
+    if args.sql:
+        paths = write_sql_dumps(SyntheticWiki(**sizes[args.size]),args.sql)
+        print "Wrote {0}".format(u', '.join(sorted(paths.values())))
+        return
+    if args.dump:
+        count = write_dump(SyntheticWiki(**sizes[args.size]),args.dump,not args.stub)
+        print "Wrote {0} revisions to {1}".format(count,args.dump)
+        return
+    recordings = load_recordings(args.recordings) if args.recordings else None
+    api = FakeAPI(SyntheticWiki(**sizes[args.size]),recordings,args.lag,args.error_rate,latency=args.latency)
+    server = start_server(api,args.port)
+    print "Serving {0} synthetic wiki at http://127.0.0.1:{1}/<lang>/api.php".format(args.size,server.server_address[1])
+    try:
+        while True:
+            threading.Event().wait(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
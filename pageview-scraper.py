@@ -4,9 +4,16 @@
 
 '''
 pageview-scraper.py - batch download wiki pageview history
-    Usage: python pageview-scraper.py -s <yyyymmdd> -e <yyyymmdd> -d <datapath>
+    Usage: python pageview-scraper.py -s <yyyymmdd> -e <yyyymmdd> -d <datapath> [--stats <statspath>]
+                                      [-a <articles.txt> -o <output> [-l <lang>] [-r <redirects.npz>] [--hourly <storepath>]]
     E.g.   python pageview-scraper.py -s 20130410 -e 20130417 -d /Data/
     The parameters will be set as default if not given.
+    With --stats, per-endpoint request counts, bytes and latencies are written to statspath as JSON lines.
+    With -a, the daily views of the articles listed one per line in articles.txt, including the views
+    of their redirects, are totalled from the downloaded files and written to output (see write_frame).
+    The redirects are read from redirects.npz, or looked up through the API and saved there if it
+    does not exist yet. With --hourly, the hourly views are also kept in an HourlyStore at storepath,
+    which is created for the articles and dates on the first run and filled with any hours it lacks.
     
 @author: Brian Keegan and Yu-Ru Lin 
 @contact: bkeegan@gmail.com and yuruliny@gmail.com 
@@ -14,10 +21,9 @@ pageview-scraper.py - batch download wiki pageview history
 
 '''
 
-import sys,os,urllib2,hashlib
-from bs4 import BeautifulSoup
-from dateutil.relativedelta import relativedelta
+import sys,os,re,json,bisect,urllib2,hashlib
 from datetime import datetime, timedelta
+from wikipedia_crawl import request_stats, retry_call
 
 #datapath = os.getcwd()+'/Data/'
 
@@ -26,11 +32,12 @@ def get_file(url,filepath,md5_dict):
     # Open the url
     if len(md5_dict.keys()) > 0: #sometimes there's no hash file (eg, December 2008)
         try:
-            f = urllib2.urlopen(url)
+            with request_stats.timed('pagecounts') as event:
+                read_file = retry_call(lambda: urllib2.urlopen(url).read(),'dumps.wikimedia.org',event=event)
+                event['bytes'] = len(read_file)
 
             # Open our local file for writing
             with open(filepath+os.path.basename(url), "wb") as local_file:
-                read_file = f.read()
                 file_md5 = hashlib.md5(read_file).hexdigest()
                 if file_md5 == md5_dict[os.path.basename(url)]:
                     local_file.write(read_file)
@@ -45,11 +52,12 @@ def get_file(url,filepath,md5_dict):
     else:
         print "No hashes found, proceeding without checking hashes!"
         try:
-            f = urllib2.urlopen(url)
+            with request_stats.timed('pagecounts') as event:
+                read_file = retry_call(lambda: urllib2.urlopen(url).read(),'dumps.wikimedia.org',event=event)
+                event['bytes'] = len(read_file)
 
             # Open our local file for writing
             with open(filepath+os.path.basename(url), "wb") as local_file:
-                read_file = f.read()
                 local_file.write(read_file)
 
         #handle errors
@@ -58,10 +66,99 @@ def get_file(url,filepath,md5_dict):
         except urllib2.URLError, e:
             print "URL Error:", e.reason, url
 
+url_base = 'http://dumps.wikimedia.org/other/pagecounts-raw/'
+pagecount_name_re = re.compile(r'pagecounts-(\d{8}-\d{6})\.gz')
+
+# Manifests already read in this process, keyed by (datapath, year, month)
+manifests = dict()
+
+def next_month(year,month):
+    # The datetime starting the month after year, month
+    return datetime(year + month // 12,month % 12 + 1,1)
+
+def fetch_manifest(year,month):
+    # The pagecount files of one month with their times and MD5s, from md5sums.txt and the listing
+    month_url = url_base + '{0}/{0}-{1:02d}/'.format(year,month)
+    md5_url = month_url + 'md5sums.txt'
+    try:
+        with request_stats.timed('pagecounts:md5sums') as event:
+            md5s = retry_call(lambda: urllib2.urlopen(md5_url).readlines(),'dumps.wikimedia.org',event=event)
+            event['bytes'] = sum(len(i) for i in md5s)
+    except urllib2.HTTPError, e:
+        if e.code != 404:
+            raise
+        md5s = [] #sometimes there's no hash file (eg, December 2008)
+    md5_dict = dict([i.strip().split('  ') for i in md5s if 'pagecounts' in i])
+    md5_dict = {v:k for k,v in md5_dict.iteritems()}
+    
+    # Can't pass clean filenames since seconds field varies, scrape filenames instead
+    with request_stats.timed('pagecounts:listing') as event:
+        listing = retry_call(lambda: urllib2.urlopen(month_url).read(),'dumps.wikimedia.org',event=event)
+        event['bytes'] = len(listing)
+    names = sorted(set(m.group(0) for m in pagecount_name_re.finditer(listing)))
+    files = [[name,pagecount_name_re.match(name).group(1).replace('-',''),md5_dict.get(name)] for name in names]
+    return {'year':year,'month':month,'fetched':datetime.utcnow().strftime('%Y%m%d%H%M%S'),'files':files}
+
+def get_manifest(year,month,datapath=os.getcwd()+'/Data/'):
+    '''
+    Input:
+    year, month - integers naming the month
+    datapath - the directory the month's files and its manifest.json are kept in
+
+    Output:
+    manifest - a dictionary with 'files', a list of [name, YYYYmmddHHMMSS, md5] sorted by time
+        (md5 is None when the month has no md5sums.txt), and 'fetched', when it was listed
+
+    Notes:
+    A month's listing only changes while the month's files are still being published, so the
+    manifest is fetched again only if it was fetched before a day after the month ended; past
+    months are listed once and then read from disk.
+    '''
+    key = (datapath,year,month)
+    path = datapath + '{0}/{1:02d}/manifest.json'.format(year,month)
+    settled = next_month(year,month) + timedelta(days=1)
+    # Within one run every month is listed at most once
+    if key in manifests:
+        return manifests[key]
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest = json.load(f)
+        if datetime.strptime(manifest['fetched'],'%Y%m%d%H%M%S') >= settled:
+            manifests[key] = manifest
+            return manifest
+    manifest = fetch_manifest(year,month)
+    if not os.path.exists(os.path.dirname(path)):
+        os.system('mkdir -p {0}'.format(os.path.dirname(path)))
+    with open(path + '.tmp','w') as f:
+        json.dump(manifest,f)
+    os.rename(path + '.tmp',path)
+    manifests[key] = manifest
+    return manifest
+
+def plan_dumps(start_dt,end_dt,datapath=os.getcwd()+'/Data/'):
+    '''
+    Input:
+    start_dt, end_dt - datetimes; files strictly between them are returned
+    datapath - the directory of the files and manifests
+
+    Output:
+    files - a list of (year, month, name, md5) of every pagecount file in the range, in time order,
+        found by bisecting each month's manifest
+    '''
+    files = list()
+    start_key,end_key = start_dt.strftime('%Y%m%d%H%M%S'),end_dt.strftime('%Y%m%d%H%M%S')
+    index = datetime(start_dt.year,start_dt.month,1)
+    while index < end_dt:
+        manifest = get_manifest(index.year,index.month,datapath)
+        times = [f[1] for f in manifest['files']]
+        first,last = bisect.bisect_right(times,start_key),bisect.bisect_left(times,end_key)
+        files.extend((index.year,index.month,name,md5) for name,time,md5 in manifest['files'][first:last])
+        index = next_month(index.year,index.month)
+    return files
+
 def get_dumps(start,end,datapath=os.getcwd()+'/Data/'):
     start_dt = datetime.strptime(start,'%Y%m%d')
     end_dt = datetime.strptime(end,'%Y%m%d')
-    url_base = 'http://dumps.wikimedia.org/other/pagecounts-raw/'
     
     if not os.path.exists(datapath): 
         os.system('mkdir -p {0}'.format(datapath))
@@ -72,55 +169,61 @@ def get_dumps(start,end,datapath=os.getcwd()+'/Data/'):
     elif end_dt > datetime.today():
         raise ValueError('Time range must end before today') 
     
-    index = start_dt
-    while index < end_dt:
-        year = datetime.strftime(index,'%Y')
-        month = datetime.strftime(index,'%m')
-        
-        # Make md5 checksum dictionary that can be checked after downloading files below
-        md5_url = url_base + '{0}/{0}-{1}/'.format(year,month) + 'md5sums.txt'
-        md5s = urllib2.urlopen(md5_url).readlines()
-        md5_dict = dict([i.strip().split('  ') for i in md5s if 'pagecounts' in i])
-        md5_dict = {v:k for k,v in md5_dict.iteritems()}
-        
-        # Can't pass clean filenames since seconds field varies, scrape filenames instead
-        url = url_base + '{0}/{0}-{1}/'.format(year,month)
-        soup = BeautifulSoup(urllib2.urlopen(url))
-        pagecount_links = [link.get('href') for link in soup.findAll('a') if 'pagecounts' in link.get('href')]
-        
-        # Return list of links in valid timespan
-        valid_links = [datetime.strptime(i,'pagecounts-%Y%m%d-%H%M%S.gz') for i in pagecount_links]
-        valid_links = [i for i in valid_links if i > start_dt and i < end_dt]
-        valid_links = [datetime.strftime(i,'pagecounts-%Y%m%d-%H%M%S.gz') for i in valid_links]
-        
+    for year,month,link,md5 in plan_dumps(start_dt,end_dt,datapath):
         # If the directory doesn't exist, create it
-        filepath = datapath+'{0}/{1}/'.format(year,month)
+        filepath = datapath+'{0}/{1:02d}/'.format(year,month)
         
         if not os.path.exists(filepath): 
             os.system('mkdir -p {0}'.format(filepath))
         
-        # Get the data
-        for link in valid_links:
-            url = url_base + '{0}/{0}-{1}/'.format(year,month) + link
-            # Check if file already exists and has non-zero length
-            if os.path.exists(filepath+link) and os.path.getsize(filepath+link) > 0: 
-                print link + ' already exists!'
-                continue
-            
-            try:
-                print "Retrieving pageviews for " + link
-                get_file(url,filepath,md5_dict) # Don't forget the md5_dict too
-            except (KeyboardInterrupt, SystemExit):
-                sys.exit(0)
-                break
+        url = url_base + '{0}/{0}-{1:02d}/'.format(year,month) + link
+        # Check if file already exists and has non-zero length
+        if os.path.exists(filepath+link) and os.path.getsize(filepath+link) > 0: 
+            print link + ' already exists!'
+            continue
         
-        index += relativedelta(months=1)
+        try:
+            print "Retrieving pageviews for " + link
+            get_file(url,filepath,{link:md5} if md5 else {}) # Don't forget the md5 too
+        except (KeyboardInterrupt, SystemExit):
+            sys.exit(0)
+            break
+
+def aggregate_views(start,end,datapath,articlespath,outputpath,lang='en',redirectspath=None,hourlypath=None):
+    # Total the downloaded hours into daily views per article, counting redirects toward their targets.
+    # Imported here so that downloading alone loads no NumPy, pandas or API client
+    from wikipedia_pagecounts import RedirectIndex, HourlyStore, pagecount_paths, get_pagecount_views
+    from wikipedia_scraping import get_redirects
+    from wikipedia_io import write_frame
+    with open(articlespath) as f:
+        articles = [line.strip().decode('utf-8') for line in f if line.strip()]
+    if redirectspath and os.path.exists(redirectspath):
+        redirects = RedirectIndex.load(redirectspath)
+    else:
+        redirects = RedirectIndex(get_redirects(articles,lang),articles=articles)
+        if redirectspath:
+            redirects.save(redirectspath)
+    start_dt,end_dt = datetime.strptime(start,'%Y%m%d'),datetime.strptime(end,'%Y%m%d')
+    paths = pagecount_paths(datapath,start_dt,end_dt)
+    print "Totalling {0} hours of pageviews for {1} articles".format(len(paths),len(articles))
+    if hourlypath:
+        if os.path.exists(hourlypath):
+            store = HourlyStore(hourlypath,'r+')
+        else:
+            store = HourlyStore.create(hourlypath,articles,start_dt,end_dt,lang)
+        print "Added {0} hours to {1}".format(store.add(paths,redirects),hourlypath)
+    df = get_pagecount_views(paths,articles,lang,redirects)
+    if outputpath:
+        write_frame(df,outputpath)
+    return df
 
 def main(argv):
     args = [a.lower() for a in argv]
+    statspath = None
+    articlespath,outputpath,redirectspath,hourlypath,lang = None,None,None,None,'en'
     for i,arg in enumerate(args):
         if arg in ['-h','--help']: 
-            print 'Usage: python pageview_scraper.py -s <yyyymmdd> -e <yyyymmdd> -d <datapath>'
+            print 'Usage: python pageview_scraper.py -s <yyyymmdd> -e <yyyymmdd> -d <datapath> [--stats <statspath>] [-a <articles.txt> -o <output> [-l <lang>] [-r <redirects.npz>] [--hourly <storepath>]]'
         elif arg in ['-s','--start']:
             try: 
                 start = argv[i+1]
@@ -136,11 +239,29 @@ def main(argv):
                 datapath = argv[i+1]
             except: 
                 datapath = os.getcwd()+'/Data/'
+        elif arg in ['--stats']:
+            statspath = argv[i+1]
+        elif arg in ['-a','--articles']:
+            articlespath = argv[i+1]
+        elif arg in ['-o','--output']:
+            outputpath = argv[i+1]
+        elif arg in ['-l','--lang']:
+            lang = argv[i+1]
+        elif arg in ['-r','--redirects']:
+            redirectspath = argv[i+1]
+        elif arg in ['--hourly']:
+            hourlypath = argv[i+1]
 
     if not os.path.exists(datapath):
 	    os.system('mkdir -p {0}'.format(datapath))    
 
-    get_dumps(start,end,datapath)
+    try:
+        get_dumps(start,end,datapath)
+        if articlespath:
+            aggregate_views(start,end,datapath,articlespath,outputpath,lang,redirectspath,hourlypath)
+    finally:
+        if statspath:
+            request_stats.to_jsonl(statspath)
 
 if __name__ == '__main__': 
     main(sys.argv[1:])
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+'''
+API crawling functions against the local fake_mediawiki server.
+'''
+
+import pytest
+import fake_mediawiki
+import wikipedia_crawl
+import wikipedia_scraping as ws
+
+@pytest.fixture(scope='module')
+def api(request):
+    server = fake_mediawiki.start_server(fake_mediawiki.FakeAPI(fake_mediawiki.SyntheticWiki(**fake_mediawiki.sizes['small'])))
+    host = '127.0.0.1:{0}'.format(server.server_address[1])
+    saved = ws.api_url
+    ws.api_url = u'http://' + host + u'/{0}/api.php'
+    wikipedia_crawl.rate_limiter.set_rate(host,1e6)
+    request.addfinalizer(server.shutdown)
+    request.addfinalizer(lambda: setattr(ws,'api_url',saved))
+    return server
+
+def test_users_properties_normalized(api):
+    # "User  3" comes back from the API as "User 3", listed under normalized
+    cache = dict()
+    df = ws.get_users_properties([u'User  3',u'User_4',u'user 4',u'Nobody',u'User  3'],cache=cache)
+    assert df.index.tolist() == [u'User  3',u'User 4',u'Nobody']
+    assert df['missing'].tolist() == [False,False,True]
+    assert df.loc[u'User  3','userid'] == 4
+    assert cache[('en',u'User 3')]['userid'] == 4
+    requests = sum(row['requests'] for row in wikipedia_crawl.request_stats.summary() if row['endpoint'] == 'api:users')
+    ws.get_users_properties([u'User 3',u'Nobody'],cache=cache)
+    assert sum(row['requests'] for row in wikipedia_crawl.request_stats.summary() if row['endpoint'] == 'api:users') == requests
+
+def test_lag_is_waited_out():
+    lagged = wikipedia_crawl.ServerLagged(3.,None,maxlag=1)
+    assert wikipedia_crawl.is_retryable_error(lagged) == (True,3.)
+    assert lagged.maxlag == 1
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+'''
+iter_dump and DumpIndex on a hand-written XML dump of three pages.
+'''
+
+import datetime
+import pytest
+from wikipedia_dumps import iter_dump, DumpIndex
+
+dump = u'''<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">
+  <siteinfo>
+    <sitename>Wikipedia</sitename>
+    <namespaces>
+      <namespace key="0" case="first-letter" />
+      <namespace key="1" case="first-letter">Talk</namespace>
+    </namespaces>
+  </siteinfo>
+  <page>
+    <title>Zürich</title>
+    <ns>0</ns>
+    <id>10</id>
+    <revision>
+      <id>101</id>
+      <timestamp>2014-01-01T00:00:00Z</timestamp>
+      <contributor><username>Alice</username><id>1</id></contributor>
+      <text xml:space="preserve" bytes="20">A city, see [[Switzerland]].</text>
+    </revision>
+    <revision>
+      <id>102</id>
+      <parentid>101</parentid>
+      <timestamp>2014-01-02T12:30:00Z</timestamp>
+      <contributor><ip>127.0.0.1</ip></contributor>
+      <text xml:space="preserve" bytes="35">A city in [[Switzerland]] on a [[lake]].</text>
+    </revision>
+    <revision>
+      <id>103</id>
+      <parentid>102</parentid>
+      <timestamp>2014-01-03T08:00:00Z</timestamp>
+      <contributor deleted="deleted" />
+      <text xml:space="preserve" bytes="30">A city in [[Switzerland]].</text>
+    </revision>
+  </page>
+  <page>
+    <title>Zurich</title>
+    <ns>0</ns>
+    <id>11</id>
+    <redirect title="Zürich" />
+    <revision>
+      <id>104</id>
+      <timestamp>2014-01-02T00:00:00Z</timestamp>
+      <contributor><username>Bob</username><id>2</id></contributor>
+      <text xml:space="preserve" bytes="19">#REDIRECT [[Zürich]]</text>
+    </revision>
+  </page>
+  <page>
+    <title>Zuerich</title>
+    <ns>0</ns>
+    <id>12</id>
+    <redirect />
+    <revision>
+      <id>105</id>
+      <timestamp>2014-01-04T00:00:00Z</timestamp>
+      <contributor><username>Alice</username><id>1</id></contributor>
+      <text xml:space="preserve" bytes="19">#REDIRECT [[Zürich]]</text>
+    </revision>
+  </page>
+</mediawiki>
+'''
+
+@pytest.fixture
+def path(tmpdir):
+    path = tmpdir.join('dump.xml')
+    path.write(dump.encode('utf-8'),mode='wb')
+    return str(path)
+
+def test_iter_dump(path):
+    siteinfo = dict()
+    revisions = list(iter_dump(path,siteinfo=siteinfo,batch=2))
+    assert [r['revid'] for r in revisions] == [101,102,103,104,105]
+    first = revisions[0]
+    assert first['title'] == u'Zürich' and first['pageid'] == 10 and first['ns'] == 0
+    assert first['user'] == first['username'] == u'Alice' and first['userid'] == 1
+    assert first['timestamp'] == datetime.datetime(2014,1,1)
+    assert first['size'] == 20
+    assert revisions[1]['user'] == u'127.0.0.1' and revisions[1]['parentid'] == 101
+    assert revisions[2]['user'] == u''
+    assert siteinfo['namespaces'][1] == u'Talk'
+    # A bare <redirect /> names no target and is not recorded
+    assert siteinfo['redirects'] == {u'Zurich':u'Zürich'}
+
+def test_iter_dump_titles_and_content(path):
+    revisions = list(iter_dump(path,content=True,titles=set([u'Zürich'])))
+    assert [r['revid'] for r in revisions] == [101,102,103]
+    assert revisions[1]['content'] == u'A city in [[Switzerland]] on a [[lake]].'
+
+def test_dump_index(path):
+    index = DumpIndex(path,batch=2)
+    assert len(index) == 5
+    start,end = datetime.datetime(2014,1,1),datetime.datetime(2014,1,5)
+    assert [r['revid'] for r in index.get_page_revisions(u'Zürich',start,end)] == [101,102,103]
+    assert [r['revid'] for r in index.get_page_revisions(u'Zürich',datetime.datetime(2014,1,2),end)] == [102,103]
+    # Redirects are followed, and a redirect without a target resolves to itself
+    assert [r['revid'] for r in index.get_page_revisions(u'Zurich',start,end)] == [101,102,103]
+    assert index.resolve(u'Zuerich') == u'Zuerich'
+    assert [r['revid'] for r in index.get_page_revisions(u'Zuerich',start,end)] == [105]
+    contributions = index.get_user_revisions(u'Alice',start)
+    assert [(r['revid'],r['sizediff']) for r in contributions] == [(101,20),(105,19)]
+    assert index.talk_page_title(u'Zürich') == u'Talk:Zürich'
+    with pytest.raises(ValueError):
+        index.get_page_content(u'Zürich',start,end)
+
+def test_dump_index_content(path):
+    index = DumpIndex(path,content=True,titles=[u'Zürich'])
+    content = index.get_page_content(u'Zürich',datetime.datetime(2014,1,1),datetime.datetime(2014,1,5))
+    assert sorted(content) == [101,102,103]
+    assert content[102]['username'] == u'127.0.0.1'
+    assert sorted(content[102]['links']) == [u'Switzerland',u'lake']
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+'''
+Round trips of write_frame and read_frame through every format. Formats whose library is not
+installed are skipped.
+'''
+
+import datetime
+import pytest
+import pandas as pd
+from wikipedia_io import write_frame, read_frame
+
+libraries = {'parquet':'pyarrow','feather':'pyarrow','hdf5':'tables','csv':'pandas'}
+extensions = {'parquet':'.parquet','feather':'.feather','hdf5':'.h5','csv':'.csv'}
+
+def panel(articles,start=0):
+    return pd.DataFrame({'article':articles,
+                         'date':[datetime.datetime(2014,1,1) + datetime.timedelta(days=start + n) for n in range(len(articles))],
+                         'revisions':range(start,start + len(articles))},
+                        columns=['article','date','revisions'])
+
+@pytest.fixture(params=sorted(libraries))
+def format(request):
+    pytest.importorskip(libraries[request.param])
+    return request.param
+
+def test_round_trip(tmpdir,format):
+    path = str(tmpdir.join('panel' + extensions[format]))
+    df = panel([u'AC/DC',u'Zürich',u'Barack Obama'])
+    write_frame(df,path)
+    pd.testing.assert_frame_equal(read_frame(path),df)
+
+def test_append(tmpdir,format):
+    path = str(tmpdir.join('panel' + extensions[format]))
+    first,second = panel([u'A',u'B']),panel([u'C',u'D'],start=2)
+    write_frame(first,path)
+    write_frame(second,path,append=True)
+    pd.testing.assert_frame_equal(read_frame(path),pd.concat([first,second],ignore_index=True))
+
+def test_append_longer_strings(tmpdir,format):
+    # HDF5 tables fix the width of string columns at the first write
+    path = str(tmpdir.join('panel' + extensions[format]))
+    first,second = panel([u'A']),panel([u'Ä' * 300],start=1)
+    write_frame(first,path)
+    write_frame(second,path,append=True)
+    pd.testing.assert_frame_equal(read_frame(path),pd.concat([first,second],ignore_index=True))
+
+def test_csv_append_reorders_columns(tmpdir):
+    path = str(tmpdir.join('panel.csv'))
+    first,second = panel([u'A']),panel([u'B'],start=1)
+    write_frame(first,path)
+    write_frame(second[['revisions','date','article']],path,append=True)
+    pd.testing.assert_frame_equal(read_frame(path),pd.concat([first,second],ignore_index=True))
+
+def test_csv_append_new_column(tmpdir):
+    path = str(tmpdir.join('panel.csv'))
+    first,second = panel([u'A']),panel([u'B'],start=1)
+    second['views'] = [10]
+    write_frame(first,path)
+    write_frame(second,path,append=True)
+    df = read_frame(path)
+    assert list(df.columns) == ['article','date','revisions','views']
+    assert df['article'].tolist() == [u'A',u'B']
+    assert pd.isnull(df['views'][0]) and df['views'][1] == 10
+
+def test_partitions(tmpdir,format):
+    path = str(tmpdir.join('panel'))
+    df = panel([u'AC/DC',u'AC/DC',u'Zurich'])
+    paths = write_frame(df,path,format=format,partition_cols=['article'])
+    assert len(paths) == 2
+    result = read_frame(path).sort_values('date').reset_index(drop=True)
+    # Partition columns come back as str names, the others as the reader gives them
+    pd.testing.assert_frame_equal(result,df,check_column_type=False)
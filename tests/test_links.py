@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+'''
+build_link_index and LinkIndex on hand-written SQL dumps of a few pages, in both the layout
+with target titles in the link tables and the one with ids into linktarget.
+'''
+
+import gzip
+import pytest
+from wikipedia_links import iter_sql_rows, build_link_index, LinkIndex
+
+pages = [(1,0,'Zürich',0),(2,0,'Switzerland',0),(3,0,'Zurich',1),(4,14,'Cities',0),
+         (5,10,'Infobox_city',0),(6,1,'Zürich',0),(7,14,'Hidden_categories',0),(8,14,'Stubs',0)]
+links = [(1,0,'Switzerland'),(1,0,'Lake_Zürich'),(1,1,'Zürich'),(3,0,'Zürich'),(2,0,'Zürich'),
+         (6,0,'Zürich'),(99,0,'Switzerland')]
+templates = [(1,10,'Infobox_city'),(2,10,'Infobox_city')]
+categories = [(1,'Cities'),(2,'Countries'),(1,'Stubs'),(8,'Hidden_categories')]
+
+def sql_value(value):
+    if isinstance(value,int):
+        return str(value)
+    return "'" + value.replace('\\','\\\\').replace("'","\\'") + "'"
+
+def write_table(path,table,columns,rows):
+    with gzip.open(path,'wb') as f:
+        f.write('DROP TABLE IF EXISTS `{0}`;\nCREATE TABLE `{0}` (\n'.format(table))
+        f.write(',\n'.join('  `{0}` varbinary(255) NOT NULL'.format(column) for column in columns))
+        f.write('\n) ENGINE=InnoDB DEFAULT CHARSET=binary;\n')
+        # Two INSERT statements, as mysqldump splits long tables
+        for chunk in (rows[:len(rows) // 2],rows[len(rows) // 2:]):
+            if chunk:
+                f.write('INSERT INTO `{0}` VALUES {1};\n'.format(table,','.join(
+                    '(' + ','.join(sql_value(v) for v in row) + ')' for row in chunk)))
+    return path
+
+@pytest.fixture
+def title_dumps(tmpdir):
+    directory = str(tmpdir)
+    return {'page':write_table(directory + '/page.sql.gz','page',['page_id','page_namespace','page_title','page_is_redirect'],pages),
+            'pagelinks':write_table(directory + '/pagelinks.sql.gz','pagelinks',['pl_from','pl_namespace','pl_title'],links),
+            'templatelinks':write_table(directory + '/templatelinks.sql.gz','templatelinks',['tl_from','tl_namespace','tl_title'],templates),
+            'categorylinks':write_table(directory + '/categorylinks.sql.gz','categorylinks',['cl_from','cl_to'],categories)}
+
+@pytest.fixture
+def target_dumps(tmpdir,title_dumps):
+    # The same links with targets as linktarget ids, plus a target nothing links to
+    directory = str(tmpdir)
+    targets = dict()
+    target = lambda ns,title: targets.setdefault((ns,title),len(targets) + 1)
+    pagelinks = [(source,target(ns,title)) for source,ns,title in links]
+    templatelinks = [(source,target(ns,title)) for source,ns,title in templates]
+    categorylinks = [(source,target(14,title)) for source,title in categories]
+    target(0,'Orphan')
+    return {'page':title_dumps['page'],
+            'pagelinks':write_table(directory + '/pl.sql.gz','pagelinks',['pl_from','pl_target_id'],pagelinks),
+            'templatelinks':write_table(directory + '/tl.sql.gz','templatelinks',['tl_from','tl_target_id'],templatelinks),
+            'categorylinks':write_table(directory + '/cl.sql.gz','categorylinks',['cl_from','cl_target_id'],categorylinks),
+            'linktarget':write_table(directory + '/lt.sql.gz','linktarget',['lt_id','lt_namespace','lt_title'],
+                                     [(num,ns,title) for (ns,title),num in sorted(targets.items(),key=lambda item: item[1])])}
+
+def test_iter_sql_rows(title_dumps):
+    assert list(iter_sql_rows(title_dumps['page'],['page_title','page_id']))[:2] == [('Zürich',1),('Switzerland',2)]
+    with pytest.raises(ValueError):
+        list(iter_sql_rows(title_dumps['page'],['page_len']))
+
+def check_index(index):
+    titles = [index.title(node) for node in range(len(index))]
+    assert titles == sorted(titles,key=lambda title: title.encode('utf-8'))
+    assert index.get_page_outlinks(u'Zürich') == [u'Lake Zürich',u'Switzerland']
+    # Through the redirect, and only articles that are not redirects link in
+    assert index.get_page_outlinks(u'Zurich') == index.get_page_outlinks(u'Zürich')
+    assert index.get_page_inlinks(u'Zürich') == [u'Switzerland']
+    assert index.get_page_templates(u'Switzerland') == [u'Template:Infobox city']
+    # Stubs is hidden, so only Cities is left
+    assert index.get_page_categories(u'Zürich') == [u'Category:Cities']
+    assert index.get_page_categories(u'Switzerland') == [u'Category:Countries']
+    # Red links and categories without a page have a title but no page id
+    red = index.node(u'Lake Zürich')
+    assert red is not None and index.page_id[red] == 0
+    assert index.page_id[index.node(u'Category:Countries')] == 0
+    assert index.node(u'Orphan') is None
+    assert index.node(u'Talk:Zürich') is not None
+    with pytest.raises(KeyError):
+        index.get_page_outlinks(u'Lake Zürich')
+
+def test_link_index(tmpdir,title_dumps):
+    dumps = dict(title_dumps)
+    index = build_link_index(str(tmpdir.join('index')),dumps.pop('page'),**dumps)
+    check_index(index)
+    check_index(LinkIndex(str(tmpdir.join('index'))))
+
+def test_link_index_batches(tmpdir,monkeypatch,title_dumps,target_dumps):
+    # Lookups in batches smaller than a table, and both layouts, give the same index
+    import wikipedia_links
+    monkeypatch.setattr(wikipedia_links,'batch_size',2)
+    dumps = dict(title_dumps)
+    by_title = build_link_index(str(tmpdir.join('titles')),dumps.pop('page'),**dumps)
+    dumps = dict(target_dumps)
+    by_target = build_link_index(str(tmpdir.join('targets')),dumps.pop('page'),**dumps)
+    check_index(by_target)
+    assert len(by_title) == len(by_target)
+    for node in range(len(by_title)):
+        assert by_title.title(node) == by_target.title(node)
+        for relation in ('links','templates','categories'):
+            assert by_title.neighbors(relation,node).tolist() == by_target.neighbors(relation,node).tolist()
+
+def test_linktarget_required(tmpdir,target_dumps):
+    with pytest.raises(ValueError):
+        build_link_index(str(tmpdir.join('index')),target_dumps['page'],pagelinks=target_dumps['pagelinks'])
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+'''
+Protection log parsing, protection_intervals and ProtectionIndex on hand-built events.
+'''
+
+import datetime
+import numpy as np
+import pytest
+from wikipedia_scraping import parse_expiry, parse_log_event
+from wikipedia_protection import protection_intervals, to_seconds, never, ProtectionIndex
+
+def day(d,hour=0):
+    return datetime.datetime(2014,1,d,hour)
+
+def event(logid,title,when,action,*protections,**extra):
+    record = {'logid':logid,'title':title,'type':u'protect','action':action,'timestamp':when,
+              'protections':[{'type':kind,'level':level,'expiry':expiry} for kind,level,expiry in protections]}
+    record.update(extra)
+    return record
+
+events = [
+    # Semi-protected for two days, then fully protected until an unprotect
+    event(1,u'A',day(1),u'protect',(u'edit',u'autoconfirmed',day(3)),(u'move',u'sysop',None)),
+    event(2,u'A',day(5),u'protect',(u'edit',u'sysop',None)),
+    event(3,u'A',day(7,12),u'unprotect'),
+    # Protected indefinitely, then renamed, which moves the protection
+    event(4,u'B',day(2),u'protect',(u'edit',u'autoconfirmed',None)),
+    event(5,u'C',day(4),u'move_prot',oldtitle=u'B'),
+    # Shortened by a modify before its expiry
+    event(6,u'D',day(1),u'protect',(u'edit',u'sysop',day(10))),
+    event(7,u'D',day(2),u'modify',(u'edit',u'sysop',day(3))),
+    # Other log types are ignored
+    dict(event(8,u'A',day(20),u'protect',(u'edit',u'sysop',None)),type=u'delete'),
+]
+
+def test_parse_expiry():
+    assert parse_expiry(u'infinity') is None and parse_expiry(u'indefinite') is None
+    assert parse_expiry(u'') is None
+    assert parse_expiry(u'2014-01-03T00:00:00Z') == day(3)
+    assert parse_expiry(u'03:45, 1 May 2013') == datetime.datetime(2013,5,1,3,45)
+    with pytest.raises(ValueError):
+        parse_expiry(u'03:45, 1 Mai 2013')
+
+def test_parse_log_event():
+    details = parse_log_event({'logid':1,'title':u'A','type':u'protect','action':u'protect',
+                               'timestamp':u'2014-01-01T00:00:00Z',
+                               'params':{'details':[{'type':u'edit','level':u'sysop','expiry':u'2014-01-03T00:00:00Z'},
+                                                    {'type':u'move','level':u'sysop','expiry':u'infinite'}]}})
+    assert details['timestamp'] == day(1)
+    assert details['protections'] == [{'type':u'edit','level':u'sysop','expiry':day(3)},
+                                      {'type':u'move','level':u'sysop','expiry':None}]
+    # Before MediaWiki 1.25 the protections are only in the description
+    old = parse_log_event({'logid':2,'title':u'A','type':u'protect','action':u'modify','timestamp':u'2012-01-01T00:00:00Z',
+                           '0':u'[edit=autoconfirmed] (expires 03:45, 1 May 2013 (UTC))[move=sysop] (indefinite)'})
+    assert old['protections'] == [{'type':u'edit','level':u'autoconfirmed','expiry':datetime.datetime(2013,5,1,3,45)},
+                                  {'type':u'move','level':u'sysop','expiry':None}]
+
+def test_protection_intervals():
+    intervals = sorted(protection_intervals(events))
+    assert intervals == [(u'A',to_seconds(day(1)),to_seconds(day(3)),u'autoconfirmed'),
+                         (u'A',to_seconds(day(5)),to_seconds(day(7,12)),u'sysop'),
+                         (u'B',to_seconds(day(2)),to_seconds(day(4)),u'autoconfirmed'),
+                         (u'C',to_seconds(day(4)),never,u'autoconfirmed'),
+                         (u'D',to_seconds(day(1)),to_seconds(day(2)),u'sysop'),
+                         (u'D',to_seconds(day(2)),to_seconds(day(3)),u'sysop')]
+    assert protection_intervals(events,'move') == [(u'A',to_seconds(day(1)),to_seconds(day(5)),u'sysop')]
+
+def test_unreadable_expiry():
+    # An expiry that cannot be read ends the earlier protection and is not taken to be indefinite
+    unreadable = parse_log_event({'logid':9,'title':u'A','type':u'protect','action':u'modify','timestamp':u'2014-01-02T00:00:00Z',
+                                  '0':u'[edit=sysop] (expires 03:45, 1 Mai 2014 (UTC))'})
+    assert unreadable['protections'][0]['invalid_expiry'] == u'03:45, 1 Mai 2014'
+    intervals = protection_intervals([events[0],unreadable])
+    assert intervals == [(u'A',to_seconds(day(1)),to_seconds(day(2)),u'autoconfirmed')]
+
+def test_protection_index(tmpdir):
+    index = ProtectionIndex(events)
+    assert len(index) == 4 and u'C' in index and u'E' not in index
+    assert index.level_at(u'A',day(2)) == u'autoconfirmed'
+    assert index.level_at(u'A',day(4)) is None
+    assert index.level_at(u'A',day(7,11)) == u'sysop'
+    assert index.level_at(u'A',day(7,12)) is None
+    assert index.level_at(u'C',datetime.datetime(2030,1,1)) == u'autoconfirmed'
+    assert index.level_at(u'E',day(2)) is None
+    assert index.periods(u'C') == [(day(4),None,u'autoconfirmed')]
+    assert index.protected_at(u'A',[day(1),day(4),day(6)]).tolist() == [True,False,True]
+    assert index.protected_at(u'A',[day(1),day(4),day(6)],level=u'sysop').tolist() == [False,False,True]
+    path = str(tmpdir.join('protection.npz'))
+    index.save(path)
+    loaded = ProtectionIndex.load(path)
+    assert loaded.kind == u'edit' and loaded.titles == index.titles and loaded.levels == index.levels
+    assert loaded.periods(u'A') == index.periods(u'A')
+
+def test_protected_days():
+    index = ProtectionIndex(events)
+    daily = index.protected_days(u'A',day(1),day(9))
+    assert daily.tolist() == [1,1,0,0,1,1,0.5,0,0]
+    assert daily.index[0] == day(1) and daily.index.name == 'date'
+    # Buckets sum the days of the intervals clipped to them
+    monthly = index.protected_days(u'A',datetime.datetime(2013,12,1),datetime.datetime(2014,2,1),freq='M')
+    assert monthly.tolist() == [0,4.5,0]
+    assert index.protected_days(u'C',day(30),day(31)).tolist() == [1,1]
+    assert (index.protected_days(u'E',day(1),day(3)) == 0).all()
+    panel = index.protection_panel([u'A',u'E'],day(1),day(3))
+    assert panel['protected'].tolist() == [1,1,0,0,0,0]
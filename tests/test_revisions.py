@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+'''
+RevisionTable and the timestamp parsing behind it, checked against the lists of revision
+dictionaries and the strptime they replace.
+'''
+
+import random
+import datetime
+import numpy as np
+import pytest
+import wikipedia_scraping as ws
+
+def api_timestamp(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def test_convert_to_datetime64_matches_strptime():
+    rng = random.Random(0)
+    times = [datetime.datetime(2000,2,29,12,0,0),datetime.datetime(1999,12,31,23,59,59),
+             datetime.datetime(2100,3,1),datetime.datetime(1970,1,1),datetime.datetime(1969,12,31,23,59,59)]
+    times += [datetime.datetime(1901,1,1) + datetime.timedelta(seconds=rng.randint(0,200 * 365 * 86400))
+              for i in range(2000)]
+    strings = [api_timestamp(t) for t in times]
+    parsed = ws.convert_to_datetime64(strings).astype(datetime.datetime).tolist()
+    assert parsed == [ws.convert_to_datetime(s) for s in strings]
+
+def test_convert_to_datetime64_rejects_other_formats():
+    assert len(ws.convert_to_datetime64([])) == 0
+    with pytest.raises(ValueError):
+        ws.convert_to_datetime64([u'2014-01-01 00:00:00'])
+
+def page_revisions():
+    # The shape get_page_revisions gives: 'user' and 'username', datetimes, one page
+    start = datetime.datetime(2014,1,1)
+    users = [u'Alice',u'Bob',u'Alice',u'127.0.0.1',u'Carol',u'Bob']
+    return [{'revid':100 + num,'pageid':7,'ns':0,'title':u'Zürich','user':user,'username':user,
+             'userid':num % 3,'size':1000 + 10 * num,'timestamp':start + datetime.timedelta(hours=5 * num)}
+            for num,user in enumerate(users)]
+
+def test_round_trip():
+    revisions = page_revisions()
+    table = ws.RevisionTable.from_revisions(revisions)
+    assert len(table) == len(revisions)
+    assert table.revid.tolist() == [r['revid'] for r in revisions]
+    assert table.users == [u'Alice',u'Bob',u'127.0.0.1',u'Carol']
+    for original,revision in zip(revisions,table.to_revisions()):
+        for key in ('revid','pageid','ns','title','user','username','size','timestamp'):
+            assert revision[key] == original[key]
+
+def test_api_timestamps():
+    revisions = page_revisions()
+    strings = [dict(r,timestamp=api_timestamp(r['timestamp'])) for r in revisions]
+    assert (ws.RevisionTable.from_revisions(strings).timestamp == ws.RevisionTable.from_revisions(revisions).timestamp).all()
+
+def test_alters_match_list_path():
+    revisions = page_revisions()
+    table = ws.RevisionTable.from_revisions(revisions)
+    assert ws.make_page_alters(revisions) == ws.make_page_alters(table)
+    alters = ws.make_page_alters(revisions)
+    assert alters[u'Alice']['count'] == 2
+    assert alters[u'Bob']['min_timestamp'] == revisions[1]['timestamp']
+    assert alters[u'Bob']['max_timestamp'] == revisions[5]['timestamp']
+
+def test_username_key():
+    # get_page_content gives 'username' without 'user'
+    revisions = [dict((k,v) for k,v in r.iteritems() if k != 'user') for r in page_revisions()]
+    assert ws.make_page_alters(revisions) == ws.make_page_alters(page_revisions())
+
+def test_missing_user():
+    revision = dict((k,v) for k,v in page_revisions()[0].iteritems() if k not in ('user','username'))
+    with pytest.raises(ValueError):
+        ws.RevisionTable.from_revisions([revision])
+    assert ws.RevisionTable.from_revisions([revision],user=u'Dave').users == [u'Dave']
+    assert ws.RevisionTable.from_revisions([dict(revision,userhidden=u'')]).users == [u'']
+
+def test_take_and_concat():
+    table = ws.RevisionTable.from_revisions(page_revisions())
+    first,second = table.take(np.arange(3)),table.take(np.arange(3,6))
+    joined = ws.RevisionTable.concat([first,second])
+    assert (joined.values == table.values).all()
+    assert [r['user'] for r in joined.to_revisions()] == [r['user'] for r in page_revisions()]
+
+def test_dataframe_round_trip():
+    table = ws.RevisionTable.from_revisions(page_revisions())
+    restored = ws.RevisionTable.from_dataframe(table.to_dataframe())
+    assert (restored.values == table.values).all()
+    assert [r['user'] for r in restored.to_revisions()] == [r['user'] for r in table.to_revisions()]
+
+def test_revisions_state_without_revisions():
+    # A page with no revisions, such as a missing talk page, has no last day
+    state = ws.revisions_state([],[u'Bob',u'Alice'])
+    assert state == {'day':None,'users':[u'Alice',u'Bob'],'revid':0,'timestamp':None}
+    state = ws.revisions_state(page_revisions())
+    assert state['day'] == '2014-01-02' and state['revid'] == 105
+    assert state['users'] == [u'127.0.0.1',u'Alice',u'Bob',u'Carol']
@@ -0,0 +1,542 @@
+# -*- coding: utf-8 -*-
+'''
+Crawl infrastructure shared by wikipedia_scraping.py and pageview-scraper.py
+
+This module only depends on the standard library so that download jobs can use it without
+loading the analysis stack. It provides:
+
+* Per-endpoint request statistics: counts, bytes, latency histograms, retries and cache hits,
+  grouped by the crawl phase they happened in.
+* A token-bucket rate limiter per host that backs off on errors and server lag, and a retry
+  helper with exponential backoff, jitter, and support for Retry-After.
+* Keep-alive HTTP connections pooled per thread and host, for crawls that make many small
+  requests to one server from a thread pool.
+* An append-only JSON lines journal of finished crawl units, so that an interrupted crawl
+  resumes where it stopped and crawls split across machines can be merged.
+'''
+
+import os, time, json, datetime, threading, bisect, random, socket, httplib, urllib2, urlparse, email.utils
+from contextlib import contextmanager
+
+class RequestStats(object):
+    '''
+    Request counters keyed by (phase, endpoint). Endpoints are short names such as
+    'api:revisions' or 'pagecounts'; phases are set with the phase() context manager, and
+    apply to the requests of the thread that entered it.
+    Every request is also passed to any registered hooks as a dictionary, and can be
+    written to a JSON lines event log with log_to().
+    '''
+    # Upper bounds in seconds of the latency histogram buckets; the last bucket is unbounded
+    latency_buckets = [0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0,60.0]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Each thread has its own current phase, so concurrent phases do not mix their requests
+        self.local = threading.local()
+        self.hooks = list()
+        self.event_log = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = dict()
+            self.phases = dict()
+
+    def add_hook(self,hook):
+        # hook is called with the event dictionary of every request
+        self.hooks.append(hook)
+
+    def log_to(self,path):
+        # Append one JSON line per request to path, or stop logging if path is None
+        if self.event_log is not None:
+            self.event_log.close()
+        self.event_log = open(path,'a') if path else None
+
+    @property
+    def current_phase(self):
+        return getattr(self.local,'phase',None)
+
+    def counters(self,endpoint):
+        key = (self.current_phase,endpoint)
+        if key not in self.endpoints:
+            self.endpoints[key] = {'requests':0,'errors':0,'bytes':0,'seconds':0.,'retries':0,'cache_hits':0,
+                                   'latency_histogram':[0] * (len(self.latency_buckets) + 1)}
+        return self.endpoints[key]
+
+    def record(self,endpoint,seconds,nbytes=0,retries=0,error=None):
+        '''
+        Input:
+        endpoint - the name of the endpoint, e.g. 'api:revisions'
+        seconds - the latency of the request including any retries
+        nbytes - the number of bytes read from the response
+        retries - how many times the request had to be retried
+        error - the exception that ended the request, if it failed
+        '''
+        with self.lock:
+            counters = self.counters(endpoint)
+            counters['requests'] += 1
+            counters['bytes'] += nbytes
+            counters['seconds'] += seconds
+            counters['retries'] += retries
+            counters['latency_histogram'][bisect.bisect_left(self.latency_buckets,seconds)] += 1
+            if error is not None:
+                counters['errors'] += 1
+            event = {'time':time.time(),'phase':self.current_phase,'endpoint':endpoint,'seconds':seconds,
+                     'bytes':nbytes,'retries':retries,'error':repr(error) if error is not None else None}
+            if self.event_log is not None:
+                self.event_log.write(json.dumps(event) + '\n')
+        for hook in self.hooks:
+            hook(event)
+
+    def record_cache_hit(self,endpoint,hits=1):
+        with self.lock:
+            self.counters(endpoint)['cache_hits'] += hits
+
+    @contextmanager
+    def timed(self,endpoint):
+        '''
+        Times the body as one request to endpoint. The body can set 'bytes' and 'retries'
+        on the yielded dictionary; an exception is recorded as an error and re-raised.
+        '''
+        event = {'bytes':0,'retries':0}
+        start = time.time()
+        try:
+            yield event
+        except Exception as e:
+            self.record(endpoint,time.time() - start,event['bytes'],event['retries'],e)
+            raise
+        self.record(endpoint,time.time() - start,event['bytes'],event['retries'])
+
+    @contextmanager
+    def phase(self,name):
+        # Attribute requests made inside the body to the named phase and time the phase itself
+        previous = self.current_phase
+        self.local.phase = name
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.local.phase = previous
+            with self.lock:
+                self.phases[name] = self.phases.get(name,0.) + time.time() - start
+
+    def summary(self):
+        '''
+        Output:
+        rows - a list of dictionaries, one per (phase, endpoint), with request, error, byte,
+            retry and cache hit counts, total and mean latency, and the latency histogram
+        '''
+        rows = list()
+        with self.lock:
+            for (phase,endpoint),counters in sorted(self.endpoints.items()):
+                row = dict(counters)
+                row['phase'] = phase
+                row['endpoint'] = endpoint
+                row['mean_seconds'] = counters['seconds'] / counters['requests'] if counters['requests'] else 0.
+                row['latency_histogram'] = list(counters['latency_histogram'])
+                rows.append(row)
+        return rows
+
+    def to_jsonl(self,path):
+        # Write the summary rows, then one row per phase with its wall-clock time
+        with open(path,'w') as f:
+            for row in self.summary():
+                f.write(json.dumps(row) + '\n')
+            for phase,seconds in sorted(self.phases.items()):
+                f.write(json.dumps({'phase':phase,'wall_seconds':seconds}) + '\n')
+
+    def __str__(self):
+        lines = [u'{0:<24} {1:<24} {2:>8} {3:>6} {4:>7} {5:>6} {6:>12} {7:>9}'.format(
+            'phase','endpoint','requests','errors','retries','hits','bytes','mean (s)')]
+        for row in self.summary():
+            lines.append(u'{0:<24} {1:<24} {2:>8} {3:>6} {4:>7} {5:>6} {6:>12} {7:>9.3f}'.format(
+                row['phase'],row['endpoint'],row['requests'],row['errors'],row['retries'],
+                row['cache_hits'],row['bytes'],row['mean_seconds']))
+        for phase,seconds in sorted(self.phases.items()):
+            lines.append(u'{0:<24} {1:.3f}s wall'.format(phase,seconds))
+        return u'\n'.join(lines)
+
+# The statistics every crawler in this repository records into
+request_stats = RequestStats()
+
+class TokenBucket(object):
+    '''
+    Allows rate requests per second on average with bursts of up to burst requests.
+    acquire() blocks until a token is available and any pause has passed.
+    '''
+    def __init__(self,rate,burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.paused_until = 0.
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst,self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now,(1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self,seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until,time.time() + seconds)
+
+class RateLimiter(object):
+    '''
+    A TokenBucket per host. Each host starts at its maximum rate, halves its rate on every failure
+    or lagged response, and recovers additively on every success, so sustained throughput settles
+    at what the server will accept instead of collapsing after errors.
+    '''
+    def __init__(self,rate=10.,min_rate=0.2,increase=0.1,max_rates=None):
+        self.default_rate = rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.max_rates = dict(max_rates or dict())
+        self.buckets = dict()
+        self.lock = threading.Lock()
+
+    def bucket(self,host):
+        with self.lock:
+            if host not in self.buckets:
+                rate = self.max_rates.get(host,self.default_rate)
+                self.buckets[host] = TokenBucket(rate,max(1.,rate))
+            return self.buckets[host]
+
+    def set_rate(self,host,rate):
+        # Set the maximum (and current) requests per second for host
+        self.max_rates[host] = rate
+        bucket = self.bucket(host)
+        with bucket.lock:
+            bucket.rate = float(rate)
+            bucket.burst = max(1.,rate)
+
+    def wait(self,host):
+        self.bucket(host).acquire()
+
+    def success(self,host):
+        bucket = self.bucket(host)
+        with bucket.lock:
+            bucket.rate = min(self.max_rates.get(host,self.default_rate),bucket.rate + self.increase)
+
+    def failure(self,host,retry_after=None):
+        bucket = self.bucket(host)
+        with bucket.lock:
+            bucket.rate = max(self.min_rate,bucket.rate / 2.)
+        if retry_after:
+            bucket.pause(retry_after)
+
+    def lagged(self,host,lag,maxlag,retry_after=None):
+        # Scale the rate down in proportion to how far replication lag exceeds maxlag
+        bucket = self.bucket(host)
+        with bucket.lock:
+            bucket.rate = max(self.min_rate,bucket.rate * min(0.5,float(maxlag) / max(lag,1e-9)))
+        bucket.pause(retry_after if retry_after else lag)
+
+# The rate limits every crawler in this repository shares. The dump server allows few
+# concurrent downloads, so it gets a lower rate than the API.
+rate_limiter = RateLimiter(max_rates={'dumps.wikimedia.org':2.})
+
+# The maxlag the client library sends when a request does not say
+default_maxlag = 5
+
+class ServerLagged(Exception):
+    '''
+    Raised when the API refuses a request because replication lag exceeds maxlag. lag is the
+    X-Database-Lag the server reported and maxlag the limit the request sent.
+    '''
+    def __init__(self,lag,retry_after=None,maxlag=default_maxlag):
+        Exception.__init__(self,'Server lagged by {0} seconds'.format(lag))
+        self.lag = lag
+        self.retry_after = retry_after
+        self.maxlag = maxlag
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if value is None:
+        return None
+    try:
+        return max(0.,float(value))
+    except ValueError:
+        parsed = email.utils.parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(0.,email.utils.mktime_tz(parsed) - time.time())
+
+# HTTP status codes that mean "try again later" rather than "this will never work"
+retryable_status_codes = set([408,429,500,502,503,504])
+
+def is_retryable_error(e):
+    '''
+    Input:
+    e - an exception raised by a request
+
+    Output:
+    retryable - whether the request should be tried again
+    retry_after - the number of seconds the server asked us to wait, or None
+    '''
+    if isinstance(e,ServerLagged):
+        # Without Retry-After, wait out the reported lag rather than a generic backoff
+        return True,e.retry_after if e.retry_after is not None else e.lag
+    if isinstance(e,urllib2.HTTPError):
+        return e.code in retryable_status_codes,parse_retry_after(e.info().get('Retry-After'))
+    if isinstance(e,(urllib2.URLError,socket.error,socket.timeout,httplib.HTTPException)):
+        return True,None
+    return False,None
+
+# The errors a request can still end with once retry_call gives up on it. Crawlers catch these
+# to report the page or article and carry on with the others.
+crawl_errors = (ServerLagged,urllib2.URLError,socket.error,httplib.HTTPException)
+
+def retry_call(func,host,is_retryable=is_retryable_error,retries=5,base_delay=1.,max_delay=120.,event=None):
+    '''
+    Input:
+    func - a function of no arguments that makes one request to host
+    host - the host name whose rate limit applies, e.g. 'en.wikipedia.org'
+    is_retryable - a function of an exception returning (retryable, retry_after) like is_retryable_error
+    retries - the maximum number of retries after the first attempt
+    base_delay, max_delay - the bounds in seconds of the exponential backoff
+    event - an optional dictionary from RequestStats.timed whose 'retries' is incremented
+
+    Output:
+    result - the return value of func
+
+    Notes:
+    Every attempt waits for the host's token bucket. A retryable failure halves the host's rate
+    (or scales it down by the server lag) and sleeps for the server's Retry-After if it sent one,
+    otherwise for base_delay * 2**attempt with +/-50% jitter.
+    '''
+    for attempt in range(retries + 1):
+        rate_limiter.wait(host)
+        try:
+            result = func()
+        except Exception as e:
+            retryable,retry_after = is_retryable(e)
+            if not retryable or attempt == retries:
+                raise
+            if isinstance(e,ServerLagged):
+                rate_limiter.lagged(host,e.lag,e.maxlag,retry_after)
+            else:
+                rate_limiter.failure(host,retry_after)
+            if event is not None:
+                event['retries'] += 1
+            if retry_after is None:
+                time.sleep(min(max_delay,base_delay * 2 ** attempt) * random.uniform(0.5,1.5))
+            continue
+        rate_limiter.success(host)
+        return result
+
+class CountingResponse(object):
+    # Wraps a urllib2 response so that the bytes read from it are added to event['bytes']
+    def __init__(self,response,event):
+        self.response = response
+        self.event = event
+
+    def read(self,*args):
+        data = self.response.read(*args)
+        self.event['bytes'] += len(data)
+        return data
+
+    def __getattr__(self,name):
+        return getattr(self.response,name)
+
+class CountingOpener(object):
+    '''
+    Wraps a urllib2 opener so that every response it opens is a CountingResponse. A response
+    carrying X-Database-Lag is the API refusing the request because of maxlag, and is raised
+    as ServerLagged so that retry_call, not the client library, decides when to try again.
+    maxlag is the limit the requests send, which sets how far retry_call slows down.
+    '''
+    def __init__(self,opener,event,maxlag=default_maxlag):
+        self.opener = opener
+        self.event = event
+        self.maxlag = maxlag
+
+    def open(self,*args,**kwargs):
+        response = self.opener.open(*args,**kwargs)
+        lag = response.info().get('X-Database-Lag')
+        if lag is not None:
+            response.read()
+            raise ServerLagged(float(lag),parse_retry_after(response.info().get('Retry-After')),self.maxlag)
+        return CountingResponse(response,self.event)
+
+class ConnectionPool(object):
+    '''
+    One keep-alive httplib connection per (thread, scheme, host), so that a thread pool fetching
+    many URLs from one server reuses its TCP connections instead of opening one per request as
+    urllib2 does. A connection that fails is dropped and reopened by the next request.
+    '''
+    def __init__(self,timeout=60):
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self,scheme,host):
+        if not hasattr(self.local,'connections'):
+            self.local.connections = dict()
+        key = (scheme,host)
+        if key not in self.local.connections:
+            connection_class = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+            self.local.connections[key] = connection_class(host,timeout=self.timeout)
+        return self.local.connections[key]
+
+    def get(self,url,event=None):
+        '''
+        Input:
+        url - an http or https URL, already quoted
+        event - an optional dictionary from RequestStats.timed whose 'bytes' is incremented
+
+        Output:
+        body - the body of a 200 response. Other statuses raise urllib2.HTTPError, so that
+            is_retryable_error treats them like urllib2's own errors.
+        '''
+        parts = urlparse.urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        connection = self.connection(parts.scheme,parts.netloc)
+        try:
+            connection.request('GET',path)
+            response = connection.getresponse()
+            body = response.read()
+        except (httplib.HTTPException,socket.error):
+            # The server may have closed an idle connection; reconnect on the next attempt
+            connection.close()
+            del self.local.connections[(parts.scheme,parts.netloc)]
+            raise
+        if event is not None:
+            event['bytes'] += len(body)
+        if response.status != 200:
+            raise urllib2.HTTPError(url,response.status,response.reason,response.msg,None)
+        return body
+
+    def close(self):
+        # Close the calling thread's connections
+        for connection in getattr(self.local,'connections',dict()).itervalues():
+            connection.close()
+        self.local.connections = dict()
+
+# The connections every crawler in this repository shares
+connection_pool = ConnectionPool()
+
+def journal_default(o):
+    # datetimes are the only non-JSON values the crawlers return
+    if isinstance(o,datetime.datetime):
+        return {'__datetime__':o.strftime('%Y-%m-%dT%H:%M:%S.%f')}
+    raise TypeError('{0!r} is not JSON serializable'.format(o))
+
+def journal_object_hook(d):
+    if len(d) == 1 and '__datetime__' in d:
+        return datetime.datetime.strptime(d['__datetime__'],'%Y-%m-%dT%H:%M:%S.%f')
+    return d
+
+def journal_key(key):
+    # Tuples and lists of the same items are the same key once written to JSON
+    return json.dumps(key,sort_keys=True)
+
+def read_journal(path):
+    '''
+    Input:
+    path - a journal file written by CrawlJournal
+
+    Output:
+    records - a list of (key, value) in the order they were written. Partial lines, left by
+        a crawl killed mid-write, are skipped.
+    '''
+    records = list()
+    if not os.path.exists(path):
+        return records
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line,object_hook=journal_object_hook)
+            except ValueError:
+                continue
+            records.append((record['key'],record['value']))
+    return records
+
+class CrawlJournal(object):
+    '''
+    Finished units of a crawl, keyed by any JSON-serializable key such as
+    ('contributions','Jimbo Wales'), appended to a JSON lines file as they finish.
+    Reopening the file after a crash or Ctrl-C reloads every finished unit, so fetch()
+    only repeats the work that never completed.
+    '''
+    def __init__(self,path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.values = dict((journal_key(key),value) for key,value in read_journal(path))
+        self.file = open(path,'a')
+        # Start a new line if the last crawl died in the middle of one
+        if self.file.tell() > 0:
+            with open(path,'rb') as f:
+                f.seek(-1,os.SEEK_END)
+                if f.read(1) != '\n':
+                    self.file.write('\n')
+
+    def __contains__(self,key):
+        return journal_key(key) in self.values
+
+    def __getitem__(self,key):
+        return self.values[journal_key(key)]
+
+    def __len__(self):
+        return len(self.values)
+
+    def record(self,key,value):
+        # Write and flush the unit before remembering it, so a unit is never lost once returned
+        line = json.dumps({'key':key,'value':value},default=journal_default) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.values[journal_key(key)] = value
+
+    def fetch(self,key,func):
+        '''
+        Input:
+        key - the key of the unit
+        func - a function of no arguments that does the unit of work
+
+        Output:
+        value - the journaled value of key, or the return value of func, which is journaled.
+            Units whose func raises are not journaled and will be tried again.
+        '''
+        if key in self:
+            request_stats.record_cache_hit('journal')
+            return self[key]
+        value = func()
+        self.record(key,value)
+        return value
+
+    def close(self):
+        self.file.close()
+
+def as_journal(journal):
+    # Functions that take a journal accept a CrawlJournal, a path, or None for no journal
+    if journal is None or isinstance(journal,CrawlJournal):
+        return journal
+    return CrawlJournal(journal)
+
+def merge_journals(paths,output_path):
+    '''
+    Input:
+    paths - a list of journal files, e.g. the shards of a crawl split across machines
+    output_path - the journal file to write
+
+    Output:
+    count - the number of units in the merged journal. When shards share a key, the
+        first shard in paths wins.
+    '''
+    seen = set()
+    with open(output_path,'w') as f:
+        for path in paths:
+            for key,value in read_journal(path):
+                k = journal_key(key)
+                if k not in seen:
+                    seen.add(k)
+                    f.write(json.dumps({'key':key,'value':value},default=journal_default) + '\n')
+    return len(seen)
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+'''
+wikipedia_dumps.py - revisions from MediaWiki XML history dumps instead of the live API
+
+Streams stub-meta-history (metadata only) and pages-meta-history (with text) dumps, plain or
+compressed with bz2 or gzip, in bounded memory: each revision element is cleared as soon as
+it has been read, and each page as soon as it ends. Revisions come out in the same shape as
+get_page_revisions, get_page_content and get_user_revisions in wikipedia_scraping.py, and a
+DumpIndex answers those same calls from a local dump at disk speed:
+
+    index = DumpIndex('enwiki-20150901-stub-meta-history1.xml.gz')
+    revisions = index.get_page_revisions(u'Hurricane Sandy',start,end)
+    dynamics = get_editing_dynamics(u'Hurricane Sandy',start,end,'en',backend=content_index)
+'''
+
+import bz2, gzip, datetime
+import xml.etree.cElementTree as etree
+import numpy as np
+from wikipedia_scraping import RevisionTable, convert_to_datetime64, convert_datetime_to_epoch, link_finder
+
+def open_dump(path):
+    # Dumps are distributed compressed; 7z archives have to be extracted first
+    if path.endswith('.bz2'):
+        return bz2.BZ2File(path)
+    if path.endswith('.gz'):
+        return gzip.open(path)
+    return open(path,'rb')
+
+def local_name(tag):
+    # Strip the export schema namespace, which changes with every dump version
+    return tag.rsplit('}',1)[-1]
+
+def read_contributor(elem):
+    # Registered users have a username and id, anonymous ones an ip, suppressed ones neither
+    user,userid = u'',0
+    for child in elem:
+        name = local_name(child.tag)
+        if name == 'username':
+            user = child.text or u''
+        elif name == 'id':
+            userid = int(child.text)
+        elif name == 'ip':
+            user = child.text or u''
+    return user,userid
+
+def read_revision(elem,page,content):
+    revision = {'pageid':page['pageid'],'title':page['title'],'ns':page['ns'],
+                'parentid':0,'user':u'','userid':0,'size':0}
+    text = None
+    for child in elem:
+        name = local_name(child.tag)
+        if name == 'id':
+            revision['revid'] = int(child.text)
+        elif name == 'parentid':
+            revision['parentid'] = int(child.text)
+        elif name == 'timestamp':
+            revision['timestamp'] = child.text
+        elif name == 'contributor':
+            revision['user'],revision['userid'] = read_contributor(child)
+        elif name == 'text':
+            text = child.text or u''
+            if child.get('bytes') is not None:
+                revision['size'] = int(child.get('bytes'))
+            elif text:
+                revision['size'] = len(text.encode('utf-8'))
+    revision['username'] = revision['user']
+    if content:
+        revision['content'] = text or u''
+        revision['links'] = link_finder(revision['content'])
+    return revision
+
+def iter_dump(path,content=False,titles=None,batch=1000,siteinfo=None):
+    '''
+    Input:
+    path - an XML dump, optionally .bz2 or .gz compressed
+    content - if True, include each revision's 'content' and 'links' as get_page_content does
+    titles - an optional set of titles; revisions of other pages are skipped
+    batch - how many revisions to convert timestamps for at a time
+    siteinfo - an optional dictionary that is filled in with 'namespaces', keyed by number, and
+        'redirects', keyed by title, as they are read
+
+    Output:
+    revisions - a generator of revision dictionaries with the keys of get_page_revisions
+        (revid, parentid, user, userid, username, timestamp as a datetime, size, pageid, title, ns)
+        and, with content, those of get_page_content
+
+    Notes:
+    Memory is bounded by one page's header and one batch of revisions: elements are cleared
+    once read and the root drops every finished page.
+    '''
+    if siteinfo is None:
+        siteinfo = dict()
+    namespaces = siteinfo.setdefault('namespaces',dict())
+    redirects = siteinfo.setdefault('redirects',dict())
+    pending = list()
+    page = None
+    root = None
+    with open_dump(path) as f:
+        for event,elem in etree.iterparse(f,events=('start','end')):
+            name = local_name(elem.tag)
+            if event == 'start':
+                if root is None:
+                    root = elem
+                elif name == 'page':
+                    page = {'title':None,'ns':0,'pageid':0,'revision':False}
+                elif name == 'revision' and page is not None:
+                    page['revision'] = True
+                continue
+            if name == 'namespace':
+                namespaces[int(elem.get('key'))] = elem.text or u''
+            elif page is None:
+                continue
+            elif name == 'revision':
+                page['revision'] = False
+                if titles is None or page['title'] in titles:
+                    pending.append(read_revision(elem,page,content))
+                    if len(pending) >= batch:
+                        for revision in convert_timestamps(pending):
+                            yield revision
+                        pending = list()
+                elem.clear()
+            elif page['revision']:
+                continue
+            elif name == 'title':
+                page['title'] = elem.text
+            elif name == 'ns':
+                page['ns'] = int(elem.text)
+            elif name == 'id':
+                page['pageid'] = int(elem.text)
+            elif name == 'redirect' and elem.get('title'):
+                # Older dumps mark redirects with a bare <redirect /> that names no target
+                redirects[page['title']] = elem.get('title')
+            elif name == 'page':
+                page = None
+                root.clear()
+    for revision in convert_timestamps(pending):
+        yield revision
+
+def convert_timestamps(revisions):
+    # Parse one batch of API-format timestamps in a single vectorized call
+    timestamps = convert_to_datetime64([revision['timestamp'] for revision in revisions]).tolist()
+    for revision,timestamp in zip(revisions,timestamps):
+        revision['timestamp'] = timestamp
+    return revisions
+
+def normalize_title(title):
+    return title.replace(u'_',u' ')
+
+class DumpIndex(object):
+    '''
+    Every revision in a dump as a RevisionTable sorted by page and time, with offsets by page
+    and an ordering by user, so that one page's or one user's revisions are a slice. It answers
+    get_page_revisions, get_page_content, get_user_revisions and talk_page_title with the
+    signatures of the functions in wikipedia_scraping.py, and can be passed as their backend.
+
+    Text is only kept with content=True, which is meant for pages-meta-history dumps limited
+    to a set of titles; stub dumps give the metadata of a whole wiki in a few bytes per revision.
+    '''
+    def __init__(self,path,content=False,titles=None,batch=10000):
+        '''
+        Input:
+        path - an XML dump, optionally .bz2 or .gz compressed
+        content - keep each revision's text and links for get_page_content
+        titles - an optional list of titles to index; other pages are skipped
+        batch - how many revisions to collect before packing them into the table
+        '''
+        self.content = content
+        self.siteinfo = dict()
+        titles = set(normalize_title(t) for t in titles) if titles is not None else None
+        tables,parents,contents,links,buf = list(),list(),list(),list(),list()
+        def flush():
+            tables.append(RevisionTable.from_revisions(buf))
+            parents.append(np.fromiter((r['parentid'] for r in buf),dtype=np.int64,count=len(buf)))
+            if content:
+                contents.extend(r['content'] for r in buf)
+                links.extend(r['links'] for r in buf)
+            del buf[:]
+        for revision in iter_dump(path,content,titles,siteinfo=self.siteinfo):
+            buf.append(revision)
+            if len(buf) >= batch:
+                flush()
+        flush()
+        table = RevisionTable.concat(tables)
+        parentid = np.concatenate(parents)
+
+        # Sort by page then time, so each page's history is one contiguous slice
+        order = np.lexsort((table.revid,table.timestamp,table.pageid))
+        self.table = table.take(order)
+        self.parentid = parentid[order]
+        self.contents = [contents[i] for i in order] if content else None
+        self.links = [links[i] for i in order] if content else None
+        self.sizediff = np.diff(np.concatenate([[0],self.table.size]))
+
+        pageid = self.table.pageid
+        starts = np.flatnonzero(np.concatenate([[True],pageid[1:] != pageid[:-1]])) if len(pageid) else np.array([],dtype=np.int64)
+        ends = np.concatenate([starts[1:],[len(pageid)]]).astype(np.int64)
+        self.sizediff[starts] = self.table.size[starts]
+        self.pages = dict((self.table.titles[self.table.title_codes[s]],(s,e)) for s,e in zip(starts,ends))
+
+        # Users sorted by code, keeping each user's revisions in page and time order
+        self.user_order = np.argsort(self.table.user_codes,kind='mergesort')
+        self.user_sorted_codes = self.table.user_codes[self.user_order]
+        self.user_codes = dict((user,code) for code,user in enumerate(self.table.users))
+
+    @property
+    def namespaces(self):
+        return self.siteinfo.get('namespaces',dict())
+
+    @property
+    def redirects(self):
+        return self.siteinfo.get('redirects',dict())
+
+    def __len__(self):
+        return len(self.table)
+
+    def resolve(self,title):
+        # Follow a redirect recorded in the dump, as rename_on_redirect does through the API
+        title = normalize_title(title)
+        return self.redirects.get(title,title)
+
+    def talk_page_title(self,article_title,lang=None):
+        return self.namespaces.get(1,u'Talk') + u':' + article_title
+
+    def page_rows(self,title,dt_start=None,dt_end=None):
+        '''
+        Output:
+        rows - the positions in the table of the page's revisions between dt_start and dt_end
+        '''
+        start,end = self.pages.get(self.resolve(title),(0,0))
+        rows = np.arange(start,end)
+        timestamps = self.table.timestamp[start:end]
+        mask = np.ones(len(rows),dtype=bool)
+        if dt_start is not None:
+            mask &= timestamps >= convert_datetime_to_epoch(dt_start)
+        if dt_end is not None:
+            mask &= timestamps <= convert_datetime_to_epoch(dt_end)
+        return rows[mask]
+
+    def user_rows(self,user,dt_end=None):
+        '''
+        Output:
+        rows - the positions in the table of the user's revisions since dt_end, oldest first
+        '''
+        code = self.user_codes.get(user)
+        if code is None:
+            return np.array([],dtype=np.int64)
+        start,end = np.searchsorted(self.user_sorted_codes,[code,code + 1])
+        rows = self.user_order[start:end]
+        if dt_end is not None:
+            rows = rows[self.table.timestamp[rows] >= convert_datetime_to_epoch(dt_end)]
+        return rows[np.argsort(self.table.timestamp[rows],kind='mergesort')]
+
+    def revisions(self,rows):
+        revisions = self.table.take(rows).to_revisions()
+        for revision,row in zip(revisions,rows):
+            revision['parentid'] = int(self.parentid[row])
+        return revisions
+
+    def get_page_revisions(self,article_title,dt_start,dt_end,lang=None,columnar=False):
+        # The dump counterpart of wikipedia_scraping.get_page_revisions
+        rows = self.page_rows(article_title,dt_start,dt_end)
+        if columnar:
+            return self.table.take(rows)
+        return self.revisions(rows)
+
+    def get_page_content(self,page_title,dt_start,dt_end,lang=None,parse_links=True):
+        # The dump counterpart of wikipedia_scraping.get_page_content, keyed by revid
+        if not self.content:
+            raise ValueError(u'This DumpIndex was built without content')
+        rows = self.page_rows(page_title,dt_start,dt_end)
+        revisions_dict = dict()
+        for revision,row in zip(self.revisions(rows),rows):
+            revision['content'] = self.contents[row]
+            if parse_links:
+                revision['links'] = self.links[row]
+            revisions_dict[revision['revid']] = revision
+        return revisions_dict
+
+    def get_user_revisions(self,user,dt_end,lang=None,columnar=False):
+        # The dump counterpart of wikipedia_scraping.get_user_revisions
+        rows = self.user_rows(user,dt_end)
+        if columnar:
+            return self.table.take(rows)
+        revisions = self.revisions(rows)
+        for revision,row in zip(revisions,rows):
+            revision['sizediff'] = int(self.sizediff[row])
+        return revisions
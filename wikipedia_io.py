@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+'''
+wikipedia_io.py - reading and writing the frames produced by wikipedia_scraping.py
+
+Frames are written with a writer chosen by file extension from a registry of formats: Parquet,
+Feather and HDF5 keep dtypes and load in a fraction of the time of CSV, which is kept for
+compatibility. Writes can append to an existing file and can be partitioned into a directory
+tree by columns such as lang and article, e.g. panel/lang=en/article=AC%2FDC/part.parquet, so
+that titles containing "/" never become paths. Parquet needs pyarrow or fastparquet, Feather
+needs pyarrow, and HDF5 needs PyTables; pandas raises an ImportError naming the missing
+package when a format is used without it.
+'''
+
+import os, urllib
+from wikipedia_lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+# Columns parsed as datetimes when reading formats that do not keep dtypes
+date_columns = ['date','timestamp','min_timestamp','max_timestamp']
+
+# Characters that cannot appear in a file name on some system, and "%" and "=" which
+# safe_filename and partition directory names use themselves
+unsafe_characters = set(u'/\\%=:*?"<>|')
+
+def safe_filename(name):
+    '''
+    Input:
+    name - a page title or other string
+
+    Output:
+    filename - name with "/" and the other unsafe_characters percent-encoded, so that any title
+        maps to a single file name and back with unsafe_filename. Other characters, including
+        non-ASCII ones, are kept so the files stay readable.
+    '''
+    if not isinstance(name,unicode):
+        name = name.decode('utf-8')
+    filename = u''.join(u'%{0:02X}'.format(ord(c)) if c in unsafe_characters or ord(c) < 32 else c
+                        for c in name)
+    # A leading dot would hide the file or, as "." or "..", name a directory
+    if filename.startswith(u'.'):
+        filename = u'%2E' + filename[1:]
+    return filename
+
+def unsafe_filename(filename):
+    if isinstance(filename,unicode):
+        filename = filename.encode('utf-8')
+    return urllib.unquote(filename).decode('utf-8')
+
+def write_parquet(df,path):
+    df.to_parquet(path,index=False)
+
+def read_parquet(path):
+    return pd.read_parquet(path)
+
+def write_feather(df,path):
+    df.to_feather(path)
+
+def read_feather(path):
+    return pd.read_feather(path)
+
+def encode_strings(df):
+    # PyTables stores bytes, so text columns are written as UTF-8 and decoded by read_hdf5
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].map(lambda v: v.encode('utf-8') if isinstance(v,unicode) else v)
+    return df
+
+def string_itemsizes(df):
+    # Room for the strings of each text column: the longest value rounded up to a power of two,
+    # so that later appends of slightly longer titles or usernames still fit
+    sizes = dict()
+    for column in df.columns:
+        if df[column].dtype == object:
+            longest = df[column].map(lambda v: len(v) if isinstance(v,str) else 0).max()
+            sizes[column] = max(32,1 << int(longest if longest == longest else 0).bit_length())
+    return sizes
+
+def write_hdf5(df,path,append=False):
+    '''
+    Notes:
+    A table's string columns are as wide as the first write made them, so appending a longer
+    string fails. Such an append rewrites the file with the old and new rows instead.
+    '''
+    encoded = encode_strings(df)
+    try:
+        encoded.to_hdf(path,'frame',format='table',append=append,
+                       min_itemsize=string_itemsizes(encoded) or None,index=False)
+    except ValueError:
+        if not append:
+            raise
+        write_hdf5(pd.concat([read_hdf5(path),df],ignore_index=True),path)
+
+def read_hdf5(path):
+    # Each append stored its own row numbers
+    df = pd.read_hdf(path,'frame').reset_index(drop=True)
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].map(lambda v: v.decode('utf-8') if isinstance(v,str) else v)
+    return df
+
+def write_csv(df,path,append=False):
+    '''
+    Notes:
+    Appended rows are reindexed to the columns of the file's header, so that a frame with its
+    columns in another order, or without some of them, lines up. A frame with columns the file
+    lacks rewrites the file with every column instead.
+    '''
+    if append and os.path.exists(path):
+        header = list(pd.read_csv(path,nrows=0,encoding='utf-8').columns)
+        if set(df.columns) - set(header):
+            df = pd.concat([read_csv(path),df],ignore_index=True,sort=False)
+        else:
+            df.reindex(columns=header).to_csv(path,mode='a',header=False,index=False,encoding='utf-8')
+            return
+    df.to_csv(path,mode='w',header=True,index=False,encoding='utf-8')
+
+def read_csv(path):
+    df = pd.read_csv(path,encoding='utf-8')
+    for column in date_columns:
+        # Only text columns: RevisionTable timestamps are written as integer seconds
+        if column in df.columns and df[column].dtype == object:
+            df[column] = pd.to_datetime(df[column])
+    return df
+
+# The registry of formats. Writers of formats that are not appendable are called with (df, path);
+# appending to them reads the existing file and rewrites it.
+formats = {'parquet': {'extensions':['.parquet','.pq'],'writer':write_parquet,'reader':read_parquet,'appendable':False},
+           'feather': {'extensions':['.feather'],'writer':write_feather,'reader':read_feather,'appendable':False},
+           'hdf5': {'extensions':['.h5','.hdf5'],'writer':write_hdf5,'reader':read_hdf5,'appendable':True},
+           'csv': {'extensions':['.csv'],'writer':write_csv,'reader':read_csv,'appendable':True}}
+
+def register_format(name,extensions,writer,reader,appendable=False):
+    # writer takes (df, path) and also append=True if appendable; reader takes path
+    formats[name] = {'extensions':list(extensions),'writer':writer,'reader':reader,'appendable':appendable}
+
+def format_of(path,format=None):
+    if format is not None:
+        if format not in formats:
+            raise ValueError(u'Unknown format {0}'.format(format))
+        return format
+    extension = os.path.splitext(path)[1].lower()
+    for name,spec in formats.iteritems():
+        if extension in spec['extensions']:
+            return name
+    raise ValueError(u'Cannot tell the format of {0}; pass format='.format(path))
+
+def frame_path(directory,name,format):
+    # The file for name (e.g. an article title) in directory with the extension of format
+    return os.path.join(directory,safe_filename(name) + formats[format]['extensions'][0])
+
+def write_file(df,path,format,append=False):
+    spec = formats[format]
+    if append and os.path.exists(path):
+        if spec['appendable']:
+            spec['writer'](df,path,append=True)
+            return
+        df = pd.concat([spec['reader'](path),df],ignore_index=True)
+    spec['writer'](df,path)
+
+def write_frame(df,path,format=None,partition_cols=None,append=False):
+    '''
+    Input:
+    df - a DataFrame. A named index or a DatetimeIndex is written as columns; any other index,
+        such as the row numbers of a filtered frame, is dropped.
+    path - the file to write, or with partition_cols the directory to write the partitions into
+    format - a key of formats; by default taken from the extension of path
+    partition_cols - a list of columns to partition by. Each distinct combination of their values
+        is written to path/col1=value1/col2=value2/part.<extension> without those columns.
+    append - add the rows to any existing file (or partition files) instead of replacing them
+
+    Output:
+    paths - a list of the files written
+    '''
+    if any(name is not None for name in df.index.names) or isinstance(df.index,pd.DatetimeIndex):
+        df = df.reset_index()
+    else:
+        df = df.reset_index(drop=True)
+    if not partition_cols:
+        format = format_of(path,format)
+        write_file(df,path,format,append)
+        return [path]
+    if format is None:
+        raise ValueError(u'Pass format= when writing partitions')
+    format = format_of(path,format)
+    paths = list()
+    for values,group in df.groupby(partition_cols,sort=False):
+        if not isinstance(values,tuple):
+            values = (values,)
+        directory = os.path.join(path,*[u'{0}={1}'.format(col,safe_filename(unicode(value)))
+                                        for col,value in zip(partition_cols,values)])
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        part = os.path.join(directory,'part' + formats[format]['extensions'][0])
+        write_file(group.drop(partition_cols,axis=1).reset_index(drop=True),part,format,append)
+        paths.append(part)
+    return paths
+
+def read_frame(path,format=None,index=None):
+    '''
+    Input:
+    path - a file written by write_frame, or a directory of partitions
+    format - a key of formats; by default taken from the extension of each file
+    index - a column or list of columns to set as the index of the result
+
+    Output:
+    df - the DataFrame, with partition columns restored from the directory names as strings
+    '''
+    if os.path.isdir(path):
+        frames = list()
+        for root,dirs,files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                try:
+                    file_format = format_of(name,format)
+                except ValueError:
+                    continue
+                df = formats[file_format]['reader'](os.path.join(root,name))
+                relative = os.path.relpath(root,path)
+                parts = [] if relative == '.' else relative.split(os.sep)
+                for position,part in enumerate(parts):
+                    col,value = part.split('=',1)
+                    df.insert(position,col,unsafe_filename(value))
+                frames.append(df)
+        df = pd.concat(frames,ignore_index=True) if frames else pd.DataFrame()
+    else:
+        df = formats[format_of(path,format)]['reader'](path)
+    if index is not None:
+        df = df.set_index(index)
+    return df
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+'''
+wikipedia_lazy.py - import the analysis and graph dependencies on first use
+
+Importing networkx, pandas and numpy takes most of a second, which cron jobs and worker processes
+that only crawl would pay every time they start. Modules bind those names with lazy_import instead:
+
+    pd = lazy_import('pandas')
+
+and the name stands in for the module until the first attribute is looked up on it, which imports
+the module. benchmarks.py --startup measures the import time of each entry point and checks that
+the crawl-only ones leave these dependencies unloaded.
+'''
+
+import sys, types, importlib
+
+# The modules loaded on first use, which crawl-only code paths should never load
+lazy_modules = ['numpy','pandas','networkx','bs4','dateutil']
+
+class LazyModule(types.ModuleType):
+    '''
+    A stand-in for a module that is imported when one of its attributes is first looked up.
+    The module's namespace is then copied into the stand-in, so later lookups cost the same
+    as on the module itself.
+    '''
+    def __getattr__(self,attribute):
+        # Only called for attributes the stand-in does not have yet
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module,attribute)
+
+def lazy_import(name):
+    '''
+    Input:
+    name - the dotted name of a module, e.g. 'pandas'
+
+    Output:
+    module - the module itself if it is already imported, otherwise a LazyModule
+    '''
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+def loaded_modules(names=None):
+    # Which of the given modules (by default lazy_modules) this process has imported
+    return [name for name in (names or lazy_modules) if name in sys.modules]
@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+'''
+wikipedia_links.py - hyperlinks, templates and categories from MediaWiki SQL dumps instead of the live API
+
+Streams the page, pagelinks, templatelinks and categorylinks tables of a wiki's SQL dumps
+(e.g. enwiki-20150901-pagelinks.sql.gz) into a directory of flat arrays: every title in a
+sorted table with its page id and namespace, and each kind of link in compressed sparse row
+(CSR) form in both directions. A LinkIndex memory-maps that directory, so opening it is
+instant, its size is not limited by RAM, and each lookup is a binary search and an array
+slice. It answers get_page_outlinks, get_page_inlinks, get_page_templates, get_page_categories
+and get_category_members with the signatures of the functions in wikipedia_scraping.py:
+
+    index = build_link_index('enwiki-links','enwiki-20150901-page.sql.gz',
+                             pagelinks='enwiki-20150901-pagelinks.sql.gz',
+                             categorylinks='enwiki-20150901-categorylinks.sql.gz')
+    index = LinkIndex('enwiki-links')
+    page_alters,templates_dict = two_step_outlinks(u'Hurricane Sandy',link_index=index)
+'''
+
+import os, re, mmap, array, json, hashlib, itertools
+import numpy as np
+from wikipedia_dumps import open_dump
+
+# Canonical English namespace names, used to prefix titles when no others are given
+default_namespaces = {0:u'',1:u'Talk',2:u'User',3:u'User talk',4:u'Wikipedia',5:u'Wikipedia talk',
+                      6:u'File',7:u'File talk',8:u'MediaWiki',9:u'MediaWiki talk',10:u'Template',
+                      11:u'Template talk',12:u'Help',13:u'Help talk',14:u'Category',15:u'Category talk',
+                      100:u'Portal',101:u'Portal talk'}
+
+# The source page id and target columns of each link table. Dumps since 2024 replace the
+# namespace and title of the target with an id into the linktarget table.
+link_tables = {'links':('pagelinks','pl_from','pl_namespace','pl_title','pl_target_id'),
+               'templates':('templatelinks','tl_from','tl_namespace','tl_title','tl_target_id'),
+               'categories':('categorylinks','cl_from',None,'cl_to','cl_target_id')}
+
+create_re = re.compile(r'^CREATE TABLE `(\w+)`')
+column_re = re.compile(r'^\s+`(\w+)`\s')
+row_re = re.compile(r"\(((?:'(?:[^'\\]|\\.)*'|[^'()])*)\)")
+field_re = re.compile(r"'((?:[^'\\]|\\.)*)'|([^,]+)")
+escape_re = re.compile(r'\\(.)')
+sql_escapes = {'0':'\x00','b':'\b','n':'\n','r':'\r','t':'\t','Z':'\x1a'}
+
+def unescape_sql(string):
+    if '\\' not in string:
+        return string
+    return escape_re.sub(lambda m: sql_escapes.get(m.group(1),m.group(1)),string)
+
+def sql_value(quoted,bare):
+    if bare:
+        bare = bare.strip()
+        if bare == 'NULL':
+            return None
+        return float(bare) if '.' in bare or 'e' in bare else int(bare)
+    return unescape_sql(quoted)
+
+def iter_sql_rows(path,columns):
+    '''
+    Input:
+    path - a mysqldump file of one table, optionally .gz or .bz2 compressed
+    columns - a list of column names to return
+
+    Output:
+    rows - a generator of tuples of the values of columns in each row. Strings are returned
+        as the raw UTF-8 bytes of the dump, numbers as ints and NULL as None.
+
+    Notes:
+    Column positions are read from the CREATE TABLE statement, so the dumps of any MediaWiki
+    version work as long as they have the requested columns.
+    '''
+    table_columns = list()
+    positions = None
+    with open_dump(path) as f:
+        for line in f:
+            if positions is None:
+                if create_re.match(line):
+                    table_columns = list()
+                elif column_re.match(line):
+                    table_columns.append(column_re.match(line).group(1))
+                elif line.startswith('INSERT INTO'):
+                    missing = [c for c in columns if c not in table_columns]
+                    if missing:
+                        raise ValueError(u'{0} has no column {1}'.format(path,missing[0]))
+                    positions = [table_columns.index(c) for c in columns]
+            if not line.startswith('INSERT INTO'):
+                continue
+            for row in row_re.finditer(line,line.index(' VALUES ')):
+                values = field_re.findall(row.group(1))
+                yield tuple(sql_value(*values[p]) for p in positions)
+
+def sql_columns(path):
+    # The column names of the table in a dump, read from its CREATE TABLE statement
+    columns = list()
+    with open_dump(path) as f:
+        for line in f:
+            if column_re.match(line):
+                columns.append(column_re.match(line).group(1))
+            elif line.startswith('INSERT INTO'):
+                break
+    return columns
+
+def full_title(namespaces,ns,title):
+    # The title with its namespace prefix and spaces, as the API returns it
+    title = title.decode('utf-8','replace').replace(u'_',u' ')
+    prefix = namespaces.get(ns)
+    if prefix is None:
+        prefix = u'Namespace {0}'.format(ns)
+    return prefix + u':' + title if prefix else title
+
+def csr(sources,targets,n):
+    # Adjacency in compressed sparse row form: row i is indices[indptr[i]:indptr[i+1]], sorted
+    order = np.lexsort((targets,sources))
+    indptr = np.zeros(n + 1,dtype=np.int64)
+    np.cumsum(np.bincount(sources,minlength=n),out=indptr[1:])
+    return indptr,targets[order].astype(np.int32)
+
+# Rows of a link table looked up at a time by build_link_index
+batch_size = 100000
+
+def title_hashes(keys):
+    # The first 64 bits of the MD5 of each key, which are stable across processes and platforms
+    if not keys:
+        return np.array([],dtype=np.uint64)
+    return np.frombuffer(''.join([hashlib.md5(key).digest()[:8] for key in keys]),dtype='<u8')
+
+def page_key(ns,title):
+    # The key of a page in the dumps: its namespace number and its title as raw bytes
+    return '{0}:{1}'.format(ns,title)
+
+class StringBuffer(object):
+    # Byte strings appended to one bytearray, with the end of each in an array, for tables of
+    # millions of titles that would take tens of bytes more each as a list of str
+    def __init__(self):
+        self.data = bytearray()
+        self.ends = array.array('l',[0])
+
+    def append(self,string):
+        self.data.extend(string)
+        self.ends.append(len(self.data))
+
+    def __len__(self):
+        return len(self.ends) - 1
+
+    def __getitem__(self,num):
+        return str(self.data[self.ends[num]:self.ends[num + 1]])
+
+def sorted_lookup(values,order,wanted):
+    # The positions in values (sorted by order) of each wanted value, and whether it is there
+    if not len(values):
+        return np.zeros(len(wanted),dtype=np.int64),np.zeros(len(wanted),dtype=bool)
+    positions = np.minimum(np.searchsorted(values[order],wanted),len(values) - 1)
+    positions = order[positions]
+    return positions,values[positions] == wanted
+
+def build_link_index(directory,page,pagelinks=None,templatelinks=None,categorylinks=None,
+                     linktarget=None,namespaces=None):
+    '''
+    Input:
+    directory - the directory to write the index to, created if needed
+    page - the page table dump, e.g. enwiki-20150901-page.sql.gz
+    pagelinks, templatelinks, categorylinks - the link table dumps to index; any can be left out
+    linktarget - the linktarget table dump, needed for link tables that only have target ids
+    namespaces - a dictionary keyed by namespace number of the local namespace names, such as
+        get_namespace_names(lang) or DumpIndex.namespaces; canonical English names by default
+
+    Output:
+    index - a LinkIndex of the directory
+
+    Notes:
+    Link targets without a page (red links, categories without a description page) are given
+    a title of their own with a page id of 0, as the API lists them too.
+
+    The page table is read first into arrays of page ids and 64-bit hashes of (namespace, title),
+    as RedirectIndex keeps titles, and the link tables are then streamed in batches of batch_size
+    rows, each batch looked up in those arrays with one searchsorted. No dictionary keyed by title
+    is built; only the titles themselves and the targets of links are kept until the end.
+    '''
+    namespaces = dict(default_namespaces if namespaces is None else namespaces)
+
+    # Every page: its id, namespace, title and whether it is a redirect, in the dump's order
+    page_ids,page_ns,page_redirect,page_titles = array.array('l'),array.array('l'),array.array('b'),StringBuffer()
+    for page_id,ns,title,is_redirect in iter_sql_rows(page,['page_id','page_namespace','page_title','page_is_redirect']):
+        page_ids.append(page_id)
+        page_ns.append(ns)
+        page_redirect.append(bool(is_redirect))
+        page_titles.append(title)
+    page_ids = np.array(page_ids,dtype=np.int64)
+    page_keys = title_hashes([page_key(ns,page_titles[num]) for num,ns in enumerate(page_ns)])
+    id_order,key_order = np.argsort(page_ids,kind='mergesort'),np.argsort(page_keys,kind='mergesort')
+
+    # Link targets without a page, kept once each per batch and made unique at the end
+    red_keys,red_ns,red_titles = list(),array.array('l'),StringBuffer()
+    def add_red_links(keys,ns,titles):
+        keys,first = np.unique(keys,return_index=True)
+        red_keys.append(keys)
+        for num in first:
+            red_ns.append(ns[num])
+            red_titles.append(titles[num])
+
+    targets = None
+    relations = dict()
+    for relation,path in (('links',pagelinks),('templates',templatelinks),('categories',categorylinks)):
+        if path is None:
+            continue
+        table,from_column,ns_column,title_column,target_column = link_tables[relation]
+        by_title = title_column in sql_columns(path)
+        if by_title:
+            columns = [from_column,title_column] + ([ns_column] if ns_column else [])
+        else:
+            if linktarget is None:
+                raise ValueError(u'{0} refers to link targets by id; pass linktarget='.format(path))
+            if targets is None:
+                target_ids,target_ns,target_titles = array.array('l'),array.array('l'),StringBuffer()
+                for lt_id,ns,title in iter_sql_rows(linktarget,['lt_id','lt_namespace','lt_title']):
+                    target_ids.append(lt_id)
+                    target_ns.append(ns)
+                    target_titles.append(title)
+                target_ids = np.array(target_ids,dtype=np.int64)
+                target_keys = title_hashes([page_key(ns,target_titles[num]) for num,ns in enumerate(target_ns)])
+                targets = (target_ids,np.argsort(target_ids,kind='mergesort'),target_keys)
+            columns = [from_column,target_column]
+        rows = iter_sql_rows(path,columns)
+        sources,destinations = list(),list()
+        while True:
+            batch = list(itertools.islice(rows,batch_size))
+            if not batch:
+                break
+            if by_title:
+                ns = [row[2] if ns_column else 14 for row in batch]
+                titles = [row[1] for row in batch]
+                keys = title_hashes([page_key(n,title) for n,title in zip(ns,titles)])
+                known = np.ones(len(batch),dtype=bool)
+            else:
+                target_ids,target_order,target_keys = targets
+                positions,known = sorted_lookup(target_ids,target_order,np.array([row[1] for row in batch],dtype=np.int64))
+                keys = target_keys[positions]
+            from_positions,found = sorted_lookup(page_ids,id_order,np.array([row[0] for row in batch],dtype=np.int64))
+            keep = found & known
+            page_positions,is_page = sorted_lookup(page_keys,key_order,keys)
+            red = np.flatnonzero(keep & ~is_page)
+            if len(red):
+                if by_title:
+                    add_red_links(keys[red],[ns[num] for num in red],[titles[num] for num in red])
+                else:
+                    add_red_links(keys[red],[target_ns[positions[num]] for num in red],
+                                  [target_titles[positions[num]] for num in red])
+            sources.append(from_positions[keep])
+            destinations.append(keys[keep])
+        relations[relation] = (np.concatenate(sources or [np.zeros(0,dtype=np.int64)]),
+                               np.concatenate(destinations or [np.zeros(0,dtype=np.uint64)]))
+
+    # Every title: the pages in dump order, then each red link once
+    red_keys,red_first = np.unique(np.concatenate(red_keys or [np.zeros(0,dtype=np.uint64)]),return_index=True)
+    keys = np.concatenate([page_keys,red_keys])
+    title_ns = np.concatenate([np.array(page_ns,dtype=np.int32),np.array(red_ns,dtype=np.int32)[red_first]])
+    raw_title = lambda num: page_titles[num] if num < len(page_ids) else red_titles[red_first[num - len(page_ids)]]
+
+    # Number titles in sorted order of their UTF-8 bytes, so a title's number is found by bisection
+    encoded = [full_title(namespaces,int(title_ns[num]),raw_title(num)).encode('utf-8') for num in xrange(len(keys))]
+    order = sorted(range(len(encoded)),key=encoded.__getitem__)
+    rank = np.empty(len(order),dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    n = len(order)
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(os.path.join(directory,'titles.bin'),'wb') as f:
+        for c in order:
+            f.write(encoded[c])
+    offsets = np.zeros(n + 1,dtype=np.int64)
+    np.cumsum([len(encoded[c]) for c in order],out=offsets[1:])
+    del encoded
+    np.save(os.path.join(directory,'title_offsets.npy'),offsets)
+    np.save(os.path.join(directory,'namespace.npy'),title_ns[order])
+    np.save(os.path.join(directory,'page_id.npy'),np.concatenate([page_ids,np.zeros(len(red_keys),dtype=np.int64)])[order])
+    np.save(os.path.join(directory,'redirect.npy'),np.concatenate([np.array(page_redirect,dtype=bool),
+                                                                    np.zeros(len(red_keys),dtype=bool)])[order])
+    key_order = np.argsort(keys,kind='mergesort')
+    for relation,(sources,destinations) in relations.iteritems():
+        sources,destinations = rank[sources],rank[sorted_lookup(keys,key_order,destinations)[0]]
+        for suffix,(rows,columns) in (('',(sources,destinations)),('.reverse',(destinations,sources))):
+            indptr,indices = csr(rows,columns,n)
+            np.save(os.path.join(directory,relation + suffix + '.indptr.npy'),indptr)
+            np.save(os.path.join(directory,relation + suffix + '.indices.npy'),indices)
+    with open(os.path.join(directory,'index.json'),'wb') as f:
+        json.dump({'relations':sorted(relations.keys()),'namespaces':namespaces,'titles':n},f)
+    return LinkIndex(directory)
+
+class LinkIndex(object):
+    '''
+    The titles, pages and links of a wiki written by build_link_index, memory-mapped from its
+    directory. Titles are numbered in sorted order; title and node convert between the two,
+    and neighbors gives the numbers linked from (or, with reverse, to) a number.
+    '''
+    def __init__(self,directory):
+        self.directory = directory
+        with open(os.path.join(directory,'index.json'),'rb') as f:
+            meta = json.load(f)
+        self.relations = meta['relations']
+        self.namespaces = dict((int(ns),name) for ns,name in meta['namespaces'].iteritems())
+        # Plain ndarray views of the maps skip np.memmap's per-slice bookkeeping
+        load = lambda name: np.load(os.path.join(directory,name),mmap_mode='r').view(np.ndarray)
+        self.offsets = load('title_offsets.npy')
+        self.namespace = load('namespace.npy')
+        self.page_id = load('page_id.npy')
+        self.redirect = load('redirect.npy')
+        self.adjacency = dict()
+        for relation in self.relations:
+            for suffix in ('','.reverse'):
+                self.adjacency[relation + suffix] = (load(relation + suffix + '.indptr.npy'),
+                                                     load(relation + suffix + '.indices.npy'))
+        with open(os.path.join(directory,'titles.bin'),'rb') as f:
+            self.blob = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else ''
+        self.hidden = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def title_bytes(self,node):
+        return self.blob[self.offsets[node]:self.offsets[node + 1]]
+
+    def title(self,node):
+        return self.title_bytes(node).decode('utf-8')
+
+    def titles(self,nodes):
+        nodes = np.asarray(nodes,dtype=np.int64)
+        starts,ends = self.offsets[nodes].tolist(),self.offsets[nodes + 1].tolist()
+        return [self.blob[start:end].decode('utf-8') for start,end in zip(starts,ends)]
+
+    def node(self,title):
+        '''
+        Output:
+        node - the number of title, or None if the dumps never mention it
+        '''
+        if isinstance(title,str):
+            title = title.decode('utf-8')
+        key = title.replace(u'_',u' ').strip().encode('utf-8')
+        low,high = 0,len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.title_bytes(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self) and self.title_bytes(low) == key:
+            return low
+        return None
+
+    def neighbors(self,relation,node,reverse=False):
+        if relation not in self.relations:
+            raise ValueError(u'This LinkIndex was built without {0}'.format(relation))
+        indptr,indices = self.adjacency[relation + ('.reverse' if reverse else '')]
+        return indices[indptr[node]:indptr[node + 1]]
+
+    def resolve(self,page_title):
+        # The node of a page, following a redirect to its target as rename_on_redirect does
+        node = self.node(page_title)
+        if node is None or self.page_id[node] == 0:
+            raise KeyError(page_title)
+        if self.redirect[node] and 'links' in self.relations:
+            targets = self.neighbors('links',node)
+            if len(targets):
+                node = int(targets[0])
+        return node
+
+    def category_title(self,name):
+        prefix = self.namespaces.get(14,u'Category') + u':'
+        return name if name.startswith(prefix) else prefix + name
+
+    def get_page_outlinks(self,page_title,lang=None):
+        # The index counterpart of wikipedia_scraping.get_page_outlinks: links to articles
+        targets = self.neighbors('links',self.resolve(page_title))
+        return self.titles(targets[self.namespace[targets] == 0])
+
+    def get_page_inlinks(self,page_title,lang=None):
+        # The index counterpart of wikipedia_scraping.get_page_inlinks: articles, not redirects
+        sources = self.neighbors('links',self.resolve(page_title),reverse=True)
+        sources = sources[(self.namespace[sources] == 0) & ~self.redirect[sources]]
+        return self.titles(sources)
+
+    def get_page_links(self,page_title,lang=None):
+        return {'in':self.get_page_inlinks(page_title,lang),'out':self.get_page_outlinks(page_title,lang)}
+
+    def get_page_templates(self,page_title,lang=None):
+        return self.titles(self.neighbors('templates',self.resolve(page_title)))
+
+    def hidden_categories(self):
+        # Categories tagged __HIDDENCAT__ are the members of the Hidden categories tracking category
+        if self.hidden is None:
+            node = self.node(self.category_title(u'Hidden categories'))
+            self.hidden = np.array(self.neighbors('categories',node,reverse=True) if node is not None else [],dtype=np.int32)
+        return self.hidden
+
+    def get_page_categories(self,page_title,lang=None):
+        # The index counterpart of wikipedia_scraping.get_page_categories, without hidden categories
+        categories = self.neighbors('categories',self.resolve(page_title))
+        categories = categories[~np.in1d(categories,self.hidden_categories())]
+        return [c for c in self.titles(categories) if c != self.category_title(u'Living people')]
+
+    def get_category_members(self,category_name,depth,lang=None):
+        '''
+        Input:
+        category_name - the name of a category, e.g. 'Category:2001_fires'
+        depth - the number of levels of sub-categories to descend
+
+        Output:
+        articles - the titles of the pages (not files or sub-categories) in the category and
+            its sub-categories, in the order wikipedia_scraping.get_category_members gives them
+        '''
+        if depth < 0:
+            return list()
+        node = self.node(self.category_title(category_name))
+        if node is None:
+            return list()
+        members = self.neighbors('categories',node,reverse=True)
+        namespace = self.namespace[members]
+        articles = self.titles(members[(namespace != 14) & (namespace != 6)])
+        for category in self.titles(members[namespace == 14]):
+            articles += self.get_category_members(category,depth - 1,lang)
+        return articles
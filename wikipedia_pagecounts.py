@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+'''
+wikipedia_pagecounts.py - daily article views from the hourly pagecounts-raw files
+
+pageview-scraper.py downloads the hourly pagecounts-raw files (pagecounts-20130410-000000.gz),
+in which every line counts the requests for one title of one project in that hour:
+
+    en Hurricane_Sandy 4215 98304821
+
+A redirect's views are counted under the redirect's own title, so an article's total is the sum
+over the article and every title redirecting to it. A RedirectIndex maps titles to their
+canonical articles and is applied while the files are parsed:
+
+    redirects = RedirectIndex(get_redirects(articles,'en'))
+    df = get_pagecount_views(pagecount_paths('Data/',start,end),articles,'en',redirects)
+
+It can also be built without any requests from the redirect and page SQL dumps with
+redirects_from_sql, and saved and loaded as a single .npz file. For hourly series, a
+HourlyStore keeps the hours of a set of articles in a memory-mapped titles x hours matrix.
+'''
+
+import os, re, glob, json, bisect, urllib, datetime
+import numpy as np
+import pandas as pd
+from wikipedia_dumps import open_dump
+from wikipedia_links import iter_sql_rows, full_title, default_namespaces, title_hashes
+
+pagecount_re = re.compile(r'pagecounts-(\d{8}-\d{6})')
+
+def title_key(title):
+    '''
+    Input:
+    title - a title from a pagecount file or the API, as UTF-8 bytes or unicode
+
+    Output:
+    key - the UTF-8 bytes that the title and every spelling of it in a requested URL share:
+        percent-escapes decoded, underscores as spaces and, as MediaWiki does, the first
+        letter in upper case (for ASCII letters)
+    '''
+    if isinstance(title,unicode):
+        title = title.encode('utf-8')
+    if '%' in title:
+        title = urllib.unquote(title)
+    title = title.replace('_',' ')
+    return title[:1].upper() + title[1:]
+
+class RedirectIndex(object):
+    '''
+    Titles mapped to their canonical articles, kept as two sorted arrays: the 64-bit hash of
+    every redirect and article title, and the number of the article each resolves to. A title
+    costs 12 bytes instead of a dictionary entry holding its string, and a whole file's titles
+    are resolved with one searchsorted. Only the canonical titles themselves are stored.
+    '''
+    def __init__(self,redirects=None,articles=None):
+        '''
+        Input:
+        redirects - a dictionary keyed by article of the titles redirecting to it, as returned
+            by get_redirects, or an iterable of (redirect, article) pairs such as redirects_from_sql
+        articles - further article titles to include, each resolving to itself
+        '''
+        if isinstance(redirects,dict):
+            redirects = ((redirect,article) for article,titles in redirects.iteritems() for redirect in titles)
+        targets = dict((title_key(redirect),title_key(article)) for redirect,article in (redirects or list()))
+        # Double redirects are not followed by MediaWiki, but resolve them here as far as they go
+        for redirect,article in targets.items():
+            seen = set([redirect])
+            while article in targets and article not in seen:
+                seen.add(article)
+                article = targets[article]
+            targets[redirect] = article
+        canonical = set(targets.itervalues()).difference(targets)
+        canonical.update(title_key(article) for article in (articles or list()) if title_key(article) not in targets)
+        titles = sorted(canonical)
+        numbers = dict((title,number) for number,title in enumerate(titles))
+        keys = titles + [redirect for redirect,article in targets.iteritems() if article in numbers]
+        codes = range(len(titles)) + [numbers[targets[key]] for key in keys[len(titles):]]
+        self.set_arrays(title_hashes(keys),np.array(codes,dtype=np.int32),titles)
+
+    def set_arrays(self,hashes,codes,titles):
+        order = np.argsort(hashes,kind='mergesort')
+        self.hashes = hashes[order]
+        self.codes = codes[order]
+        self.titles = titles
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def lookup_hashes(self,hashes):
+        # The number of the canonical article of each hash, or -1 for titles not in the index
+        if not len(self.hashes):
+            return np.zeros(len(hashes),dtype=np.int32) - 1
+        positions = np.minimum(np.searchsorted(self.hashes,hashes),len(self.hashes) - 1)
+        return np.where(self.hashes[positions] == hashes,self.codes[positions],-1)
+
+    def lookup(self,titles):
+        return self.lookup_hashes(title_hashes([title_key(title) for title in titles]))
+
+    def canonical(self,title):
+        # The article a title redirects to, or the title itself if the index does not know it
+        code = self.lookup([title])[0]
+        return self.titles[code].decode('utf-8') if code >= 0 else title
+
+    def save(self,path):
+        np.savez(path,hashes=self.hashes,codes=self.codes,
+                 titles=np.frombuffer('\n'.join(self.titles),dtype=np.uint8))
+
+    @classmethod
+    def load(cls,path):
+        arrays = np.load(path)
+        index = cls.__new__(cls)
+        titles = arrays['titles'].tostring()
+        index.set_arrays(arrays['hashes'],arrays['codes'],titles.split('\n') if titles else list())
+        return index
+
+def redirects_from_sql(redirect,page,namespaces=None,articles=None):
+    '''
+    Input:
+    redirect - the redirect table dump, e.g. enwiki-20150901-redirect.sql.gz
+    page - the page table dump, which names the redirect pages
+    namespaces - a dictionary keyed by namespace number of the local namespace names; canonical
+        English names by default
+    articles - an optional collection of article titles; only redirects to these are returned,
+        which keeps memory small when the articles of interest are known in advance
+
+    Output:
+    pairs - a generator of (redirect, article) title pairs, skipping interwiki redirects
+    '''
+    namespaces = dict(default_namespaces if namespaces is None else namespaces)
+    wanted = set(title_key(article) for article in articles) if articles is not None else None
+    targets = dict()
+    for rd_from,ns,title,interwiki in iter_sql_rows(redirect,['rd_from','rd_namespace','rd_title','rd_interwiki']):
+        if interwiki:
+            continue
+        target = full_title(namespaces,ns,title)
+        if wanted is None or title_key(target) in wanted:
+            targets[rd_from] = target
+    for page_id,ns,title in iter_sql_rows(page,['page_id','page_namespace','page_title']):
+        if page_id in targets:
+            yield full_title(namespaces,ns,title),targets[page_id]
+
+def pagecount_time(path):
+    # The hour a pagecounts-raw file covers, from its name
+    return datetime.datetime.strptime(pagecount_re.search(os.path.basename(path)).group(1),'%Y%m%d-%H%M%S')
+
+def pagecount_paths(datapath,start,end):
+    '''
+    Input:
+    datapath - the directory pageview-scraper.py downloaded into, with a year/month/ tree
+    start, end - datetimes; files for the hours from start up to end are returned
+
+    Output:
+    paths - the paths of the pagecount files in that range, in time order
+    '''
+    paths = glob.glob(os.path.join(datapath,'*','*','pagecounts-*.gz'))
+    return sorted((path for path in paths if start <= pagecount_time(path) < end),key=pagecount_time)
+
+def read_pagecounts(path,project):
+    '''
+    Input:
+    path - a pagecounts-raw file
+    project - the project code of the lines to keep, e.g. 'en' for the English Wikipedia
+
+    Output:
+    titles - a list of the titles in the file, as the raw bytes of the file
+    counts - an array of each title's requests in the hour
+    '''
+    prefix = project + ' '
+    titles,counts = list(),list()
+    with open_dump(path) as f:
+        for line in f:
+            if line.startswith(prefix):
+                fields = line.split(' ')
+                if len(fields) == 4:
+                    titles.append(fields[1])
+                    counts.append(fields[2])
+    return titles,np.array(counts,dtype=np.int64)
+
+def article_slots(article_list,redirect_index):
+    '''
+    Input:
+    article_list - a list of distinct article titles
+    redirect_index - a RedirectIndex, or None to count only the exact titles
+
+    Output:
+    hashes - the sorted hashes of every title that counts toward one of the articles
+    hash_slots - the slot of the article each hash counts toward; articles that resolve to the
+        same canonical article share a slot, and articles the index does not know are counted
+        under their own title
+    columns - the slot of each article in article_list
+    n_slots - the number of slots
+    '''
+    if redirect_index is None:
+        redirect_index = RedirectIndex(articles=article_list)
+    codes = redirect_index.lookup(article_list)
+    slot_key = lambda article,code: code if code >= 0 else title_key(article)
+    slots = dict()
+    for article,code in zip(article_list,codes):
+        slots.setdefault(slot_key(article,code),len(slots))
+    unknown = [title_key(article) for article,code in zip(article_list,codes) if code < 0]
+    wanted = np.flatnonzero(np.in1d(redirect_index.codes,codes[codes >= 0]))
+    hashes = np.concatenate([redirect_index.hashes[wanted],title_hashes(unknown)])
+    hash_slots = np.array([slots[code] for code in redirect_index.codes[wanted]] +
+                          [slots[key] for key in unknown],dtype=np.int64)
+    sorter = np.argsort(hashes,kind='mergesort')
+    columns = np.array([slots[slot_key(article,code)] for article,code in zip(article_list,codes)],dtype=np.int64)
+    return hashes[sorter],hash_slots[sorter],columns,len(slots)
+
+def count_pagecounts(path,lang,hashes,hash_slots,n_slots):
+    # The views in one pagecount file of each slot from article_slots
+    titles,counts = read_pagecounts(path,lang)
+    if not len(hashes) or not titles:
+        return np.zeros(n_slots,dtype=np.int64)
+    file_hashes = title_hashes([title_key(title) for title in titles])
+    positions = np.minimum(np.searchsorted(hashes,file_hashes),len(hashes) - 1)
+    found = hashes[positions] == file_hashes
+    return np.bincount(hash_slots[positions[found]],weights=counts[found],minlength=n_slots).astype(np.int64)
+
+def get_pagecount_views(paths,article_list,lang,redirect_index=None):
+    '''
+    Input:
+    paths - a list of pagecounts-raw files, e.g. from pagecount_paths
+    article_list - a list of article titles
+    lang - the language code, which is the project code of Wikipedia in the pagecount files
+    redirect_index - an optional RedirectIndex; the views of every title redirecting to an
+        article are added to the article's. Without one only the exact titles are counted.
+
+    Output:
+    df - a DataFrame of daily views (UTC days) with a column per article, as make_pageview_df
+    '''
+    seen = set()
+    order = [article for article in article_list if not (article in seen or seen.add(article))]
+    hashes,hash_slots,columns,n_slots = article_slots(order,redirect_index)
+
+    totals = dict()
+    for path in paths:
+        day = pagecount_time(path).date()
+        totals[day] = totals.get(day,0) + count_pagecounts(path,lang,hashes,hash_slots,n_slots)
+
+    days = sorted(totals)
+    df = pd.DataFrame(np.array([totals[day] for day in days],dtype=np.int64).reshape(len(days),n_slots),
+                      index=pd.DatetimeIndex(days,name='date'))
+    df = df[columns]
+    df.columns = order
+    if len(days):
+        df = df.asfreq('D')
+    return df
+
+class HourlyStore(object):
+    '''
+    Hourly views of a fixed set of articles over a fixed range of hours, as a titles x hours
+    int32 matrix in a .npy file that is memory-mapped rather than read. Rows are the articles in
+    sorted order, so a title's row is found by bisection; a title's hours are contiguous, and a
+    window of hours of a run of rows is a view into the file. Only the pages touched are read,
+    so months of hours for thousands of articles need no more memory than the slice used.
+
+        store = HourlyStore.create('hourly',articles,datetime(2012,10,1),datetime(2013,1,1),'en')
+        store.add(pagecount_paths('Data/',datetime(2012,10,1),datetime(2013,1,1)),redirects)
+        spike = HourlyStore('hourly').frame([u'Hurricane Sandy'],datetime(2012,10,28),datetime(2012,11,2))
+    '''
+    def __init__(self,directory,mode='r'):
+        '''
+        Input:
+        directory - a directory written by HourlyStore.create
+        mode - 'r' to read, or 'r+' to add hours with add
+        '''
+        self.directory = directory
+        with open(os.path.join(directory,'store.json'),'rb') as f:
+            meta = json.load(f)
+        self.lang = meta['lang']
+        self.start = datetime.datetime.strptime(meta['start'],'%Y%m%d%H')
+        with open(os.path.join(directory,'titles.txt'),'rb') as f:
+            self.titles = [line.rstrip('\n').decode('utf-8') for line in f]
+        self.views = np.load(os.path.join(directory,'views.npy'),mmap_mode=mode)
+        self.filled = np.load(os.path.join(directory,'filled.npy'),mmap_mode=mode)
+        self.hours = self.views.shape[1]
+
+    @classmethod
+    def create(cls,directory,article_list,start,end,lang):
+        '''
+        Input:
+        directory - the directory to create the store in
+        article_list - the article titles to keep
+        start, end - datetimes; the store has a column for every hour from start up to end
+        lang - the language code of the articles
+
+        Output:
+        store - the new HourlyStore, opened for adding hours
+        '''
+        start = start.replace(minute=0,second=0,microsecond=0)
+        hours = int((end - start).total_seconds() // 3600)
+        titles = sorted(set(article_list))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory,'titles.txt'),'wb') as f:
+            for title in titles:
+                f.write(title.encode('utf-8') + '\n')
+        np.lib.format.open_memmap(os.path.join(directory,'views.npy'),mode='w+',dtype=np.int32,shape=(len(titles),hours))
+        np.save(os.path.join(directory,'filled.npy'),np.zeros(hours,dtype=bool))
+        with open(os.path.join(directory,'store.json'),'wb') as f:
+            json.dump({'lang':lang,'start':start.strftime('%Y%m%d%H')},f)
+        return cls(directory,'r+')
+
+    def __len__(self):
+        return len(self.titles)
+
+    def row(self,title):
+        position = bisect.bisect_left(self.titles,title)
+        if position == len(self.titles) or self.titles[position] != title:
+            raise KeyError(title)
+        return position
+
+    def hour(self,dt):
+        # The column of the hour containing dt, clipped to the store
+        return min(max(int((dt - self.start).total_seconds() // 3600),0),self.hours)
+
+    def add(self,paths,redirect_index=None):
+        '''
+        Input:
+        paths - pagecounts-raw files; files outside the store's hours or already added are skipped
+        redirect_index - an optional RedirectIndex whose redirects are counted toward their articles
+
+        Output:
+        added - the number of files added
+        '''
+        hashes,hash_slots,columns,n_slots = article_slots(self.titles,redirect_index)
+        added = 0
+        for path in paths:
+            hour = int((pagecount_time(path) - self.start).total_seconds() // 3600)
+            if hour < 0 or hour >= self.hours or self.filled[hour]:
+                continue
+            self.views[:,hour] = count_pagecounts(path,self.lang,hashes,hash_slots,n_slots)[columns]
+            self.filled[hour] = True
+            added += 1
+        self.views.flush()
+        self.filled.flush()
+        return added
+
+    def rows(self,article_list=None):
+        '''
+        Output:
+        rows - the rows of the titles in article_list (every row if None): a slice when they are
+            consecutive rows in order, such as the whole store or a run of sorted titles, and a
+            list otherwise
+        '''
+        if article_list is None:
+            return slice(0,len(self.titles))
+        positions = [self.row(title) for title in article_list]
+        if positions and positions == range(positions[0],positions[0] + len(positions)):
+            return slice(positions[0],positions[0] + len(positions))
+        return positions
+
+    def columns(self,start=None,end=None):
+        return slice(self.hour(start) if start is not None else 0,self.hour(end) if end is not None else self.hours)
+
+    def window(self,article_list=None,start=None,end=None):
+        '''
+        Input:
+        article_list - titles to select, or None for every title
+        start, end - datetimes bounding the hours, or None for the whole store
+
+        Output:
+        views - an articles x hours array. It is a view into the file when the titles are
+            consecutive rows (see rows); other selections are copied into memory, and iter_window
+            reads them a row at a time instead.
+        '''
+        return self.views[self.rows(article_list),self.columns(start,end)]
+
+    def iter_window(self,article_list,start=None,end=None):
+        # (title, hours) of each title in turn, each a view into the file
+        columns = self.columns(start,end)
+        for title in article_list:
+            yield title,self.views[self.row(title),columns]
+
+    def frame(self,article_list=None,start=None,end=None):
+        '''
+        Output:
+        df - a DataFrame of hourly views with a column per article, indexed by the hour. Hours
+            whose pagecount file was never added are NaN.
+
+        Notes:
+        The frame's values are a view into the file when window's are and every hour was added;
+        NaN for missing hours needs a float copy.
+        '''
+        columns = self.columns(start,end)
+        views = self.window(article_list,start,end)
+        index = pd.date_range(self.start + datetime.timedelta(hours=columns.start),periods=views.shape[1],freq='H',name='date')
+        df = pd.DataFrame(views.T,index=index,columns=article_list if article_list is not None else self.titles)
+        missing = ~np.asarray(self.filled[columns])
+        if missing.any():
+            df = df.astype(np.float64)
+            df[missing] = np.nan
+        return df
+
+    def daily(self,article_list=None,start=None,end=None):
+        '''
+        Output:
+        df - int64 daily totals as get_pagecount_views gives them: a DataFrame with a column per
+            article indexed by the day, NaN for days none of whose hours were added
+
+        Notes:
+        Each day's hours are summed in the file with np.add.reduceat, so only the articles x days
+        totals are held in memory and no hourly frame is built.
+        '''
+        columns = self.columns(start,end)
+        titles = article_list if article_list is not None else self.titles
+        hours = pd.date_range(self.start + datetime.timedelta(hours=columns.start),
+                              periods=columns.stop - columns.start,freq='H')
+        if not len(hours):
+            return pd.DataFrame(columns=titles,index=pd.DatetimeIndex([],name='date',freq='D'),dtype=np.int64)
+        days = hours.floor('D')
+        edges = np.flatnonzero(np.concatenate([[True],days[1:] != days[:-1]]))
+        totals = np.add.reduceat(self.window(article_list,start,end),edges,axis=1,dtype=np.int64)
+        df = pd.DataFrame(totals.T,index=pd.DatetimeIndex(days[edges],name='date',freq='D'),columns=titles)
+        # Float whenever an hour is missing, as the hourly frame is
+        filled = np.asarray(self.filled[columns],dtype=np.int64)
+        if not filled.all():
+            df = df.astype(np.float64)
+            df[np.add.reduceat(filled,edges) == 0] = np.nan
+        return df
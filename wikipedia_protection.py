@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+'''
+wikipedia_protection.py - the periods each page was protected, from its protection log events
+
+The protection log records when a page was protected, modified or unprotected and when each
+protection was set to expire; whether a page was protected at some time depends on the events
+before it. A ProtectionIndex replays the events of many pages once into disjoint intervals,
+sorted per page, so that lookups need no events:
+
+    events = get_protection_events(articles,'en',datetime(2001,1,1),datetime(2014,1,1))
+    index = ProtectionIndex(events)
+    index.level_at(u'Barack Obama',datetime(2012,11,6))
+    monthly = index.protected_days(u'Barack Obama',datetime(2008,1,1),datetime(2014,1,1),freq='M')
+    panel = panel.merge(index.protection_panel(articles,min_date,max_date),on=['article','date'],how='left')
+
+Lookups at a time are a binary search among the page's intervals, and the protected days of
+every bucket come from two binary searches per bucket boundary. The index is saved and loaded
+as a single .npz file.
+'''
+
+import datetime
+from collections import Counter
+import numpy as np
+import pandas as pd
+
+epoch = datetime.datetime(1970,1,1)
+# The end of intervals of protections that never expire
+never = np.iinfo(np.int64).max
+
+def to_seconds(when):
+    # Seconds since the epoch of a datetime, or of each of a sequence of datetimes
+    if isinstance(when,datetime.datetime):
+        return int((when - epoch).total_seconds())
+    return pd.DatetimeIndex(when).values.astype('datetime64[s]').astype(np.int64)
+
+def protection_intervals(events,kind='edit'):
+    '''
+    Input:
+    events - protection log events from get_protection_events, of any number of pages
+    kind - the protection type to follow: edit, move, create or upload
+
+    Output:
+    intervals - a list of (title, start, end, level) with start and end in seconds since the epoch,
+        end being never for protections that do not expire, disjoint for each title
+
+    Notes:
+    Events are replayed in time order. A protect or modify event lists every protection the page
+    has from then on, so it ends the page's current protection and starts the one it sets, if
+    any; unprotect ends it; move_prot moves it from the old title to the event's title. A
+    protection ends at its expiry or at the next event that changes it, whichever is first.
+    Protections whose expiry could not be read (see parse_protections) are left out rather than
+    taken to never expire, and counted in a warning.
+    '''
+    current = dict()
+    intervals = list()
+    skipped = 0
+    def close(title,when):
+        if title in current:
+            start,end,level = current.pop(title)
+            if min(end,when) > start:
+                intervals.append((title,start,min(end,when),level))
+    for event in sorted(events,key=lambda e: (e['timestamp'],e.get('logid'))):
+        if event.get('type',u'protect') != u'protect':
+            continue
+        title,when = event['title'],to_seconds(event['timestamp'])
+        action = event.get('action')
+        if action in (u'protect',u'modify'):
+            close(title,when)
+            for protection in event.get('protections',list()):
+                if protection['type'] == kind and 'invalid_expiry' in protection:
+                    skipped += 1
+                elif protection['type'] == kind:
+                    end = to_seconds(protection['expiry']) if protection['expiry'] is not None else never
+                    current[title] = (when,end,protection['level'])
+        elif action == u'unprotect':
+            close(title,when)
+        elif action == u'move_prot' and event.get('oldtitle') in current:
+            close(title,when)
+            start,end,level = current[event['oldtitle']]
+            close(event['oldtitle'],when)
+            current[title] = (when,end,level)
+    for title in current.keys():
+        close(title,never)
+    if skipped:
+        print u'WARNING! Left out {0} {1} protections with unreadable expiries'.format(skipped,kind)
+    return intervals
+
+class ProtectionIndex(object):
+    '''
+    The protection periods of many pages as sorted arrays: the titles, the offset of each title's
+    intervals, and the start, end and level of every interval in time order. A page's intervals
+    are disjoint, so the interval covering a time is found by bisecting their starts.
+    '''
+    def __init__(self,events=None,kind='edit'):
+        '''
+        Input:
+        events - protection log events from get_protection_events
+        kind - the protection type to index: edit, move, create or upload
+        '''
+        intervals = sorted(protection_intervals(events or list(),kind))
+        counts = Counter(interval[0] for interval in intervals)
+        titles = sorted(counts)
+        levels = sorted(set(interval[3] for interval in intervals))
+        numbers = dict((level,num) for num,level in enumerate(levels))
+        self.set_arrays(kind,titles,np.cumsum([0] + [counts[title] for title in titles]).astype(np.int64),
+                        np.array([interval[1] for interval in intervals],dtype=np.int64),
+                        np.array([interval[2] for interval in intervals],dtype=np.int64),
+                        np.array([numbers[interval[3]] for interval in intervals],dtype=np.int16),levels)
+
+    def set_arrays(self,kind,titles,offsets,starts,ends,level_codes,levels):
+        self.kind = kind
+        self.titles = titles
+        self.numbers = dict((title,num) for num,title in enumerate(titles))
+        self.offsets = offsets
+        self.starts = starts
+        self.ends = ends
+        self.level_codes = level_codes
+        self.levels = levels
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __contains__(self,title):
+        return title in self.numbers
+
+    def span(self,title):
+        # The slice of the title's intervals, empty for titles never protected
+        num = self.numbers.get(title)
+        if num is None:
+            return slice(0,0)
+        return slice(self.offsets[num],self.offsets[num + 1])
+
+    def periods(self,title):
+        '''
+        Output:
+        periods - a list of (start, end, level) of every protection of the title in time order,
+            with end None for a protection that never expires
+        '''
+        span = self.span(title)
+        return [(epoch + datetime.timedelta(seconds=int(start)),
+                 epoch + datetime.timedelta(seconds=int(end)) if end != never else None,self.levels[code])
+                for start,end,code in zip(self.starts[span],self.ends[span],self.level_codes[span])]
+
+    def covering(self,title,seconds):
+        # The position among all intervals of the one covering each time, or -1
+        span = self.span(title)
+        positions = np.searchsorted(self.starts[span],seconds,side='right') - 1
+        if span.stop == span.start:
+            return positions
+        positions = np.where(positions >= 0,positions + span.start,-1)
+        return np.where((positions >= 0) & (seconds < self.ends[positions]),positions,-1)
+
+    def level_at(self,title,when):
+        '''
+        Input:
+        title - a page title
+        when - a datetime
+
+        Output:
+        level - the protection level of the title at that time (e.g. u'autoconfirmed' or
+            u'sysop'), or None if it was not protected
+        '''
+        position = self.covering(title,np.array([to_seconds(when)]))[0]
+        return self.levels[self.level_codes[position]] if position >= 0 else None
+
+    def protected_at(self,title,times,level=None):
+        '''
+        Input:
+        title - a page title
+        times - a sequence of datetimes, e.g. the timestamps of the page's revisions
+        level - count only protections of this level
+
+        Output:
+        protected - a boolean array of whether the title was protected at each time
+        '''
+        positions = self.covering(title,to_seconds(times))
+        protected = positions >= 0
+        if level is not None and protected.any():
+            code = self.levels.index(level) if level in self.levels else -1
+            protected &= self.level_codes[positions] == code
+        return protected
+
+    def protected_days(self,title,min_date,max_date,freq='D'):
+        '''
+        Input:
+        title - a page title
+        min_date, max_date - datetimes bounding the buckets
+        freq - a pandas frequency of the buckets, e.g. 'D' or 'M'
+
+        Output:
+        ts - a Series indexed by the start of each bucket of how many days of it the title was
+            protected; a fraction of a day for daily buckets
+        '''
+        periods = pd.period_range(min_date,max_date,freq=freq)
+        index = periods.to_timestamp()
+        bounds = to_seconds(index.append(pd.DatetimeIndex([(periods[-1] + 1).to_timestamp()])))
+        # With the intervals clipped to the buckets, the time protected before a boundary is
+        # that of every interval starting before it, less what the last of them runs on past it
+        span = self.span(title)
+        starts = np.clip(self.starts[span],bounds[0],bounds[-1])
+        ends = np.clip(self.ends[span],bounds[0],bounds[-1])
+        cumulative = np.concatenate([[0],np.cumsum(ends - starts)])
+        positions = np.searchsorted(starts,bounds,side='right')
+        protected = cumulative[positions] - np.maximum(np.concatenate([[0],ends])[positions] - bounds,0)
+        ts = pd.Series(np.diff(protected) / 86400.,index=index)
+        ts.index.name = 'date'
+        return ts
+
+    def protection_panel(self,article_list,min_date,max_date,freq='D'):
+        '''
+        Output:
+        panel - a long DataFrame with one row per (article, date) and the days each article was
+            protected in each bucket (see protected_days), to merge with get_editing_dynamics_panel
+        '''
+        frames = list()
+        for article in article_list:
+            ts = self.protected_days(article,min_date,max_date,freq)
+            frames.append(pd.DataFrame({'article':article,'date':ts.index,'protected':ts.values},
+                                       columns=['article','date','protected']))
+        if not frames:
+            return pd.DataFrame(columns=['article','date','protected'])
+        return pd.concat(frames,ignore_index=True)
+
+    def save(self,path):
+        np.savez(path,offsets=self.offsets,starts=self.starts,ends=self.ends,level_codes=self.level_codes,
+                 kind=np.frombuffer(self.kind.encode('utf-8'),dtype=np.uint8),
+                 titles=np.frombuffer(u'\n'.join(self.titles).encode('utf-8'),dtype=np.uint8),
+                 levels=np.frombuffer(u'\n'.join(self.levels).encode('utf-8'),dtype=np.uint8))
+
+    @classmethod
+    def load(cls,path):
+        arrays = np.load(path)
+        index = cls.__new__(cls)
+        strings = lambda key: [s for s in arrays[key].tostring().decode('utf-8').split(u'\n') if s]
+        index.set_arrays(arrays['kind'].tostring().decode('utf-8'),strings('titles'),arrays['offsets'],arrays['starts'],
+                         arrays['ends'],arrays['level_codes'],strings('levels'))
+        return index
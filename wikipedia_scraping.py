@@ -13,13 +13,19 @@ This code was primarily authored by Brian Keegan (bkeegan@gmail.com) in 2012 and
 '''
 
 from wikitools import wiki, api
-import networkx as nx
-import numpy as np
 from operator import itemgetter
-from collections import Counter
-import re, random, datetime, urlparse, urllib2, simplejson, copy
-import pandas as pd
-from bs4 import BeautifulSoup
+from collections import Counter, OrderedDict
+from multiprocessing.pool import ThreadPool
+import os, re, random, datetime, urlparse, urllib2, httplib, simplejson, copy, itertools, socket, threading, multiprocessing
+from wikipedia_lazy import lazy_import
+from wikipedia_crawl import request_stats, rate_limiter, retry_call, is_retryable_error, crawl_errors, CountingOpener, default_maxlag, as_journal, connection_pool
+from wikipedia_io import write_frame, read_frame, frame_path, safe_filename
+
+# Crawling needs only wikitools and the standard library; the analysis and graph dependencies
+# are imported on first use (see wikipedia_lazy)
+nx = lazy_import('networkx')
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 def is_ip(ip_string, masked=False):
 	# '''
@@ -43,6 +49,34 @@ def convert_to_datetime(string):
     dt = datetime.datetime.strptime(string,'%Y-%m-%dT%H:%M:%SZ')
     return dt
     
+def convert_to_datetime64(strings):
+    '''
+    Input:
+    strings - a sequence of API timestamp strings in the '%Y-%m-%dT%H:%M:%SZ' format
+
+    Output:
+    timestamps - a NumPy datetime64[s] array parsed in one vectorized step rather than
+        calling strptime once per string
+    '''
+    n = len(strings)
+    if n == 0:
+        return np.zeros(0,dtype='datetime64[s]')
+    chars = np.array(strings,dtype='S20').view(np.uint8).reshape(n,20).astype(np.int64)
+    if (chars[:,[4,7,10,13,16,19]] != np.array([ord(c) for c in '--T::Z'])).any():
+        raise ValueError("Timestamps must be in the '%Y-%m-%dT%H:%M:%SZ' format")
+    digits = chars - ord('0')
+    number = lambda start,width: np.sum(digits[:,start:start+width] * 10**np.arange(width-1,-1,-1),axis=1)
+    year,month,day = number(0,4),number(5,2),number(8,2)
+    # Days since 1970-01-01 from the proleptic Gregorian calendar, counting years from March
+    # so the leap day falls at the end of the year
+    y = year - (month <= 2)
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * (month + np.where(month > 2,-3,9)) + 2) // 5 + day - 1
+    days = era * 146097 + yoe * 365 + yoe // 4 - yoe // 100 + doy - 719468
+    seconds = days * 86400 + number(11,2) * 3600 + number(14,2) * 60 + number(17,2)
+    return seconds.astype('datetime64[s]')
+
 def convert_from_datetime(dt):
     string = dt.strftime('%Y%m%d%H%M%S')
     return string
@@ -51,17 +85,114 @@ def convert_datetime_to_epoch(dt):
     epochtime = (dt - datetime.datetime(1970,1,1)).total_seconds()
     return epochtime
 
+# The API endpoint for each language edition, e.g. pointed at fake_mediawiki.py when benchmarking
+api_url = u'http://{0}.wikipedia.org/w/api.php'
+
+# wikitools fetches siteinfo whenever a Wiki is made, so keep one per API URL
+sites = dict()
+# One lock per API URL, made by the atomic dict.setdefault, so that a slow siteinfo request
+# to one wiki does not hold up threads starting on another
+site_locks = dict()
+
+def get_site(lang):
+	url = api_url.format(lang)
+	if url not in sites:
+		# Threads crawling the same wiki wait for one siteinfo request instead of each making one
+		with site_locks.setdefault(url,threading.Lock()):
+			if url not in sites:
+				with request_stats.timed('api:siteinfo') as event:
+					site = retry_call(lambda: wiki.Wiki(url=url), urlparse.urlsplit(url).netloc, event=event)
+				# Let retry_call handle failed requests instead of wikitools' own retry loop
+				site.maxwaittime = 0
+				sites[url] = site
+	return sites[url]
+
+def get_namespace_names(lang):
+    '''
+    Input:
+    lang - a string (typically two characters) indicating the language version of Wikipedia
+
+    Output:
+    namespaces - a dictionary keyed by namespace number returning the local name of the namespace,
+        e.g. {1: u'Discussão', ...} for 'pt'. These come from the siteinfo request made once per
+        wiki by get_site, so no further requests are made.
+    '''
+    return dict((nsid,info['*']) for nsid,info in get_site(lang).namespaces.iteritems())
+
+def talk_page_title(article_title,lang):
+    # The title of an article's talk page in the local name of the Talk namespace
+    return get_namespace_names(lang)[1] + u':' + article_title
+
+# API error codes that mean the request should be tried again later
+retryable_api_errors = set(['maxlag','ratelimited','readonly'])
+
+def is_retryable_api_error(e):
+	if isinstance(e, api.APIError):
+		code = e.args[0] if e.args else ''
+		return code in retryable_api_errors or code.startswith('internal_api_error'), None
+	return is_retryable_error(e)
+
+# What a crawl of one page can fail with: crawl_errors, API errors, and responses missing what
+# the parsing expects
+api_crawl_errors = crawl_errors + (api.APIError, ValueError, KeyError, IndexError)
+
+def api_endpoint(query_params):
+	module = query_params.get('list') or query_params.get('prop') or query_params.get('meta') or query_params['action']
+	return u'api:' + module
+
+def api_request(query_params,lang='en'):
+	'''
+	Input:
+	query_params - a dictionary of API parameters
+	lang - a string (typically two characters) indicating the language version of Wikipedia to query
+
+	Output:
+	result - the decoded JSON of a single API request, without following query-continue
+
+	Notes:
+	The request waits for the host's rate limit and is retried with backoff on network errors,
+	5xx responses, and maxlag, ratelimited or readonly API errors.
+	'''
+	site = get_site(lang)
+	def attempt():
+		request = api.APIRequest(site, query_params)
+		request.opener = CountingOpener(request.opener, event, request.data.get('maxlag', default_maxlag))
+		return request.query(querycontinue=False)
+	with request_stats.timed(api_endpoint(query_params)) as event:
+		result = retry_call(attempt, urlparse.urlsplit(site.apibase).netloc, is_retryable_api_error, event=event)
+	return result
+
+def merge_query_results(total, new):
+	# Extend the lists in total (e.g. usercontribs, or the revisions of each page) with those in new
+	for key, value in new.iteritems():
+		if key not in total:
+			total[key] = value
+		elif isinstance(value, list):
+			total[key].extend(value)
+		elif isinstance(value, dict):
+			merge_query_results(total[key], value)
+		else:
+			total[key] = value
+	return total
+
 def wikipedia_query(query_params,lang='en'):
-	site = wiki.Wiki(url='http://'+lang+'.wikipedia.org/w/api.php')
-	request = api.APIRequest(site, query_params)
-	result = request.query()
+	params = dict(query_params)
+	result = api_request(params,lang)
+	# Follow query-continue one request at a time so every request is counted and timed
+	while 'query-continue' in result:
+		for continue_params in result['query-continue'].values():
+			params.update(continue_params)
+		new_result = api_request(params,lang)
+		merge_query_results(result.get(query_params['action'], dict()), new_result.get(query_params['action'], dict()))
+		if 'query-continue' in new_result:
+			result['query-continue'] = new_result['query-continue']
+		else:
+			del result['query-continue']
 	return result[query_params['action']]
 
 def short_wikipedia_query(query_params,lang='en'):
-	site = wiki.Wiki(url='http://'+lang+'.wikipedia.org/w/api.php')
-	request = api.APIRequest(site, query_params)
 	# Don't do multiple requests
-	result = request.query(querycontinue=False)
+	result = api_request(query_params,lang)
 	return result[query_params['action']]
 
 def random_string(le, letters=True, numerals=False):
@@ -137,13 +268,177 @@ def chunk_maker(a_list,size):
     chunk_num = len(a_list)/size
     chunks = list()
     for c in range(chunk_num + 1):
-        start = c * (size + 1)
-        end = (c + 1) * (size + 1)
+        start = c * size
+        end = (c + 1) * size
         elements = list(itertools.islice(a_list,start,end))
         if len(elements) > 0:
             chunks.append(elements)
     return chunks
 
+def intern_strings(strings):
+    '''
+    Input:
+    strings - an iterable of strings such as titles or usernames
+
+    Output:
+    codes - an int32 NumPy array where each string is replaced by its position in uniques
+    uniques - a list of the distinct strings in order of first appearance
+    '''
+    index = dict()
+    codes = np.fromiter((index.setdefault(s,len(index)) for s in strings),dtype=np.int32)
+    uniques = [None] * len(index)
+    for s,code in index.iteritems():
+        uniques[code] = s
+    return codes,uniques
+
+def revision_userid(revision):
+    # Hidden, anonymous, and malformed revisions may have no numeric userid
+    try:
+        return int(revision.get('userid',0))
+    except (TypeError,ValueError):
+        return 0
+
+def revision_user(revision,default=None):
+    '''
+    Input:
+    revision - a revision dictionary from the API ('user'), get_page_content or a dump ('username')
+    default - the username of revisions that carry none, e.g. those of list=usercontribs
+
+    Output:
+    user - the revision's username; u'' for revisions whose user is hidden. A revision with no
+        username and no default raises ValueError rather than being counted as one blank user.
+    '''
+    user = revision.get('user',revision.get('username',default))
+    if user is None:
+        if 'userhidden' in revision:
+            return u''
+        raise ValueError(u'Revision {0} has no user or username'.format(revision.get('revid')))
+    return user
+
+class RevisionTable(object):
+    '''
+    A columnar collection of revisions. The numeric attributes (revid, pageid, ns, timestamp as
+    seconds since the epoch, size, and userid) are rows of a single int64 NumPy array and titles
+    and usernames are int32 codes into lists of unique strings, so millions of revisions take
+    tens of bytes each instead of a dictionary per revision.
+    '''
+    columns = ['revid','pageid','ns','timestamp','size','userid']
+
+    def __init__(self,values,title_codes,titles,user_codes,users):
+        self.values = values
+        self.title_codes = title_codes
+        self.titles = titles
+        self.user_codes = user_codes
+        self.users = users
+
+    revid = property(lambda self: self.values[0])
+    pageid = property(lambda self: self.values[1])
+    ns = property(lambda self: self.values[2])
+    timestamp = property(lambda self: self.values[3])
+    size = property(lambda self: self.values[4])
+    userid = property(lambda self: self.values[5])
+
+    def __len__(self):
+        return self.values.shape[1]
+
+    @classmethod
+    def from_revisions(cls,revisions,title=None,pageid=0,ns=0,user=None):
+        '''
+        Input:
+        revisions - a list of revision dictionaries as returned by the API or by get_page_revisions,
+            get_user_revisions or get_page_content. Timestamps may be API strings or datetime objects.
+        title, pageid, ns - defaults for revisions that do not carry their page, e.g. prop=revisions
+        user - a default username for revisions that do not carry one, e.g. list=usercontribs
+
+        Output:
+        table - a RevisionTable
+        '''
+        n = len(revisions)
+        values = np.zeros((len(cls.columns),n),dtype=np.int64)
+        values[0] = np.fromiter((r['revid'] for r in revisions),dtype=np.int64,count=n)
+        values[1] = np.fromiter((int(r.get('pageid',pageid)) for r in revisions),dtype=np.int64,count=n)
+        values[2] = np.fromiter((int(r.get('ns',ns)) for r in revisions),dtype=np.int64,count=n)
+        if n and isinstance(revisions[0]['timestamp'],datetime.datetime):
+            values[3] = np.fromiter((convert_datetime_to_epoch(r['timestamp']) for r in revisions),dtype=np.int64,count=n)
+        else:
+            values[3] = convert_to_datetime64([r['timestamp'] for r in revisions]).astype(np.int64)
+        values[4] = np.fromiter((r.get('size',0) for r in revisions),dtype=np.int64,count=n)
+        values[5] = np.fromiter((revision_userid(r) for r in revisions),dtype=np.int64,count=n)
+        title_codes,titles = intern_strings(r.get('title',title) or u'' for r in revisions)
+        user_codes,users = intern_strings(revision_user(r,user) for r in revisions)
+        return cls(values,title_codes,titles,user_codes,users)
+
+    @classmethod
+    def concat(cls,tables):
+        '''
+        Input:
+        tables - a list of RevisionTables
+
+        Output:
+        table - a single RevisionTable with the revisions of every table, re-coding titles and users
+        '''
+        values = np.concatenate([t.values for t in tables],axis=1) if tables else np.zeros((len(cls.columns),0),dtype=np.int64)
+        title_codes,titles = intern_strings(t.titles[c] for t in tables for c in t.title_codes)
+        user_codes,users = intern_strings(t.users[c] for t in tables for c in t.user_codes)
+        return cls(values,title_codes,titles,user_codes,users)
+
+    def take(self,indices):
+        '''
+        Input:
+        indices - an integer or boolean NumPy array selecting revisions
+
+        Output:
+        table - a RevisionTable with the selected revisions, sharing the title and user lists
+        '''
+        return RevisionTable(self.values[:,indices],self.title_codes[indices],self.titles,
+                             self.user_codes[indices],self.users)
+
+    def to_dataframe(self):
+        '''
+        Output:
+        df - a DataFrame with one row per revision. The numeric columns are a view on the table's
+            values array rather than a copy, and title and user are Categoricals over the same codes.
+        '''
+        df = pd.DataFrame(self.values.T,columns=self.columns,copy=False)
+        df['title'] = pd.Categorical.from_codes(self.title_codes,self.titles)
+        df['user'] = pd.Categorical.from_codes(self.user_codes,self.users)
+        return df
+
+    @classmethod
+    def from_dataframe(cls,df):
+        '''
+        Input:
+        df - a DataFrame from to_dataframe, e.g. reloaded with wikipedia_io.read_frame
+
+        Output:
+        table - a RevisionTable
+        '''
+        values = np.zeros((len(cls.columns),len(df)),dtype=np.int64)
+        for num,column in enumerate(cls.columns):
+            values[num] = df[column].values.astype(np.int64)
+        # Formats without dtypes may have parsed the epoch seconds back as datetimes
+        if df['timestamp'].dtype.kind == 'M':
+            values[3] = df['timestamp'].values.astype('datetime64[s]').astype(np.int64)
+        title_codes,titles = intern_strings(df['title'].astype(unicode))
+        user_codes,users = intern_strings(df['user'].astype(unicode))
+        return cls(values,title_codes,titles,user_codes,users)
+
+    def to_revisions(self):
+        '''
+        Output:
+        revisions - a list of revision dictionaries in the shape returned by get_page_revisions, for
+            functions that still work on one dictionary per revision
+        '''
+        revisions = list()
+        for num in xrange(len(self)):
+            rev = dict(zip(self.columns,self.values[:,num].tolist()))
+            rev['timestamp'] = datetime.datetime.utcfromtimestamp(rev['timestamp'])
+            rev['title'] = self.titles[self.title_codes[num]]
+            rev['user'] = self.users[self.user_codes[num]]
+            rev['username'] = rev['user']
+            revisions.append(rev)
+        return revisions
+
 def get_single_revision(article_list,lang):
     chunks = chunk_maker(article_list,50)
     revisions = dict()
@@ -180,12 +475,13 @@ def get_single_revision(article_list,lang):
             pass
 	return revisions
 
-def get_user_revisions(user,dt_end,lang):
+def get_user_revisions(user,dt_end,lang,columnar=False):
     '''
     Input: 
     user - The name of a wikipedia user with no "User:" prefix, e.g. 'Madcoverboy' 
     dt_end - a datetime object indicating the maximum datetime to return for revisions
     lang - a string (typically two characters) indicating the language version of Wikipedia to crawl
+    columnar - if True, return a RevisionTable instead of a list of dictionaries
 
     Output:
     revisions - A list of revisions for the given article, each given as a dictionary. This will
@@ -198,17 +494,20 @@ def get_user_revisions(user,dt_end,lang):
     result = wikipedia_query({'action':'query',
                               'list': 'usercontribs',
                               'ucuser': u"User:"+user,
-                              'ucprop': 'ids|title|timestamp|sizediff',
+                              'ucprop': 'ids|title|timestamp|size|sizediff',
                               #'ucnamespace':'0',
                               'uclimit': '500',
                               'ucend':dt_end_string},lang)
+    if columnar:
+        return RevisionTable.from_revisions(result.get('usercontribs',list()) if result else list(),user=user)
     if result and 'usercontribs' in result.keys():
             r = result['usercontribs']
             r = sorted(r, key=lambda revision: revision['timestamp'])
-            for revision in r:
+            timestamps = convert_to_datetime64([revision['timestamp'] for revision in r]).tolist()
+            for revision,timestamp in zip(r,timestamps):
                     # Sometimes the size key is not present, so we'll set it to 0 in those cases
                     revision['sizediff'] = revision.get('sizediff', 0)
-                    revision['timestamp'] = convert_to_datetime(revision['timestamp'])
+                    revision['timestamp'] = timestamp
                     revisions.append(revision)
     return revisions
 
@@ -227,11 +526,120 @@ def get_user_properties(user,lang):
                                 'usprop':'blockinfo|groups|editcount|registration|gender',
                                 'ususers':user},lang)
     return result
+
+# Properties already retrieved by get_users_properties, keyed by (lang,username)
+user_properties_cache = dict()
+
+def normalize_username(user):
+    '''
+    Input:
+    user - a string with no "User:" prefix corresponding to the username
+
+    Output:
+    user - the username as the API reports it: underscores replaced by spaces and
+        the first letter capitalized
+    '''
+    user = cast_to_unicode(user).replace(u'_',u' ').strip()
+    return user[:1].upper() + user[1:]
+
+def get_users_properties(user_list,lang='en',cache=None):
+    '''
+    Input:
+    user_list - a list of strings with no "User:" prefix corresponding to usernames
+    lang - a string (usually two digits) for the language version of Wikipedia to query
+    cache - a dictionary keyed by (lang,username) holding properties from earlier calls,
+        defaults to the module-level user_properties_cache
+
+    Output:
+    df - a DataFrame indexed by username with the blockinfo, groups, editcount, registration
+        and gender of each user. Users that do not exist are kept with 'missing' or 'invalid' set.
+
+    Notes:
+    The API accepts up to 50 names per list=users request, so users are queried in chunks of 50
+    and only the users not already in the cache are requested.
+    '''
+    if cache is None:
+        cache = user_properties_cache
+    users = OrderedDict.fromkeys(normalize_username(user) for user in user_list).keys()
+    
+    uncached = [u for u in users if (lang,u) not in cache]
+    request_stats.record_cache_hit('api:users',len(users) - len(uncached))
+    for chunk in chunk_maker(uncached,50):
+        result = wikipedia_query({'action':'query',
+                                  'list':'users',
+                                  'usprop':'blockinfo|groups|editcount|registration|gender',
+                                  'ususers':u'|'.join(chunk)},lang)
+        found = dict()
+        for user in result.get('users',list()):
+            properties = dict()
+            properties['userid'] = user.get('userid',0)
+            properties['editcount'] = user.get('editcount',0)
+            properties['registration'] = user.get('registration')
+            properties['gender'] = user.get('gender',u'unknown')
+            properties['groups'] = user.get('groups',list())
+            properties['blockedby'] = user.get('blockedby')
+            properties['blockexpiry'] = user.get('blockexpiry')
+            properties['blockreason'] = user.get('blockreason')
+            properties['missing'] = 'missing' in user
+            properties['invalid'] = 'invalid' in user
+            found[user['name']] = properties
+        # The API answers under its canonical name, so map each requested name through the
+        # normalizations it reports before deciding what it did not echo back
+        canonical = dict((n['from'],n['to']) for n in result.get('normalized',list()))
+        for user in chunk:
+            name = canonical.get(user,user)
+            if name in found:
+                cache[(lang,user)] = found[name]
+                cache[(lang,name)] = found[name]
+            else:
+                # Not echoed back under any name, so missing rather than queried again
+                cache[(lang,user)] = {'missing':True,'invalid':False,'groups':list()}
+    
+    records = list()
+    for user in users:
+        record = cache[(lang,user)].copy()
+        record['name'] = user
+        records.append(record)
+    columns = ['name','userid','editcount','registration','gender','groups',
+               'blockedby','blockexpiry','blockreason','missing','invalid']
+    df = pd.DataFrame(records,columns=columns).set_index('name')
+    df['registration'] = pd.to_datetime(df['registration'],format='%Y-%m-%dT%H:%M:%SZ',errors='coerce')
+    return df
     
-def make_user_alters(revisions):
+def alter_frame(revisions,key):
+    '''
+    Input:
+    revisions - a RevisionTable or a list of revisions generated by get_page_revisions or get_user_revisions
+    key - 'title' to summarize a user's revisions by page, 'user' to summarize a page's revisions by user
+
+    Output:
+    df - a DataFrame indexed by alter with the count of revisions, the earliest and latest timestamps,
+        and the namespace of the page. The revisions do not need to be sorted.
+    '''
+    if not isinstance(revisions,RevisionTable):
+        revisions = RevisionTable.from_revisions(revisions)
+    grouped = revisions.to_dataframe().groupby(key,observed=True)
+    df = pd.DataFrame({'count':grouped.size(),
+                       'min_timestamp':pd.to_datetime(grouped['timestamp'].min(),unit='s'),
+                       'max_timestamp':pd.to_datetime(grouped['timestamp'].max(),unit='s'),
+                       'ns':grouped['ns'].first()},
+                      columns=['count','min_timestamp','max_timestamp','ns'])
+    df.index = df.index.astype(object)
+    return df
+
+def alter_frame_to_dict(df):
+    # The nested dictionary shape that make_user_alters and make_page_alters have always returned
+    alters = dict()
+    for alter,count,min_ts,max_ts,ns in zip(df.index,df['count'],df['min_timestamp'].dt.to_pydatetime(),
+                                            df['max_timestamp'].dt.to_pydatetime(),df['ns']):
+        alters[alter] = {'count':int(count),'min_timestamp':min_ts,'max_timestamp':max_ts,'ns':int(ns)}
+    return alters
+
+def make_user_alters(revisions,as_frame=False):
     '''
     Input:
-    revisions - a list of revisions generated by get_user_revisions
+    revisions - a list of revisions or a RevisionTable generated by get_user_revisions
+    as_frame - if True, return the DataFrame from alter_frame instead of a dictionary
 
     Output:
     alters - a dictionary keyed by page name that returns a dictionary containing
@@ -239,18 +647,10 @@ def make_user_alters(revisions):
         earliest edit to the page, the timestamp the user's latest edit to the page, and 
         the namespace of the page itself
     '''
-    alters = dict()
-    for rev in revisions:
-        if rev['title'] not in alters.keys():
-            alters[rev['title']] = dict()
-            alters[rev['title']]['count'] = 1
-            alters[rev['title']]['min_timestamp'] = rev['timestamp']
-            alters[rev['title']]['max_timestamp'] = rev['timestamp']
-            alters[rev['title']]['ns'] = rev['ns']
-        else:
-            alters[rev['title']]['count'] += 1
-            alters[rev['title']]['max_timestamp'] = rev['timestamp']
-    return alters
+    df = alter_frame(revisions,'title')
+    if as_frame:
+        return df
+    return alter_frame_to_dict(df)
 
 def rename_on_redirect(article_title,lang='en'):
     '''
@@ -269,13 +669,64 @@ def rename_on_redirect(article_title,lang='en'):
         article_title = result['redirects'][0]['to']
     return article_title
 
-def get_page_revisions(article_title,dt_start,dt_end,lang):
+def get_redirects(article_list,lang='en'):
+    '''
+    Input:
+    article_list - a list of article titles
+    lang - a string (typically two characters) indicating the language version of Wikipedia to crawl
+
+    Output:
+    redirects - a dictionary keyed by the canonical title of each article with a list of the titles
+        that redirect to it. Articles that are themselves redirects are resolved first, as
+        rename_on_redirect does, so they appear among their target's redirects.
+
+    Notes:
+    Articles are queried 50 titles to a request, so resolving a list of articles costs one
+    request per 50 of them rather than one per title.
+    '''
+    redirects = dict()
+    for chunk in chunk_maker(list(article_list),50):
+        result = wikipedia_query({'titles': u'|'.join(chunk),
+                                  'prop': 'redirects',
+                                  'rdlimit': '500',
+                                  'redirects': 'True',
+                                  'action': 'query'},lang)
+        for page in result.get('pages',dict()).itervalues():
+            if 'missing' in page or 'invalid' in page:
+                continue
+            redirects.setdefault(page['title'],list()).extend(r['title'] for r in page.get('redirects',list()))
+    return redirects
+
+def get_language_titles(article_title,lang='en'):
+    '''
+    Input:
+    article_title - a string with the name of the article
+    lang - the language version of Wikipedia the title is from
+
+    Output:
+    titles - a dictionary keyed by language returning the title of the same article in that
+        language version, including lang itself, from the article's interlanguage links
+    '''
+    article_title = rename_on_redirect(article_title,lang=lang)
+    titles = {lang:article_title}
+    result = wikipedia_query({'titles': article_title,
+                              'prop': 'langlinks',
+                              'lllimit': 'max',
+                              'action': 'query'},lang)
+    if result and 'pages' in result:
+        for page in result['pages'].itervalues():
+            for link in page.get('langlinks',[]):
+                titles[link['lang']] = link['*']
+    return titles
+
+def get_page_revisions(article_title,dt_start,dt_end,lang,columnar=False):
     '''
     Input: 
     article - A string with the name of the article or page to crawl
     dt_start - A datetime object indicating the minimum datetime to return for revisions
     dt_end - a datetime object indicating the maximum datetime to return for revisions
     lang - a string (typically two characters) indicating the language version of Wikipedia to crawl
+    columnar - if True, return a RevisionTable instead of a list of dictionaries
     
     Output:
     revisions - A list of revisions for the given article, each given as a dictionary. This will
@@ -294,26 +745,34 @@ def get_page_revisions(article_title,dt_start,dt_end,lang):
                               'rvend': dt_end_string,
                               'rvdir': 'newer',
                               'action': 'query'},lang)
+    if columnar:
+        tables = [RevisionTable.from_revisions(page.get('revisions',list()),title=page['title'],
+                                               pageid=page_number,ns=page.get('ns',0))
+                  for page_number,page in (result.get('pages',dict()) if result else dict()).iteritems()]
+        return RevisionTable.concat(tables)
     if result and 'pages' in result.keys():
             page_number = result['pages'].keys()[0]
             try:
                 r = result['pages'][page_number]['revisions']
-                for revision in r:
+                timestamps = convert_to_datetime64([revision['timestamp'] for revision in r]).tolist()
+                for revision,timestamp in zip(r,timestamps):
                         revision['pageid'] = page_number
                         revision['title'] = result['pages'][page_number]['title']
+                        revision['ns'] = result['pages'][page_number].get('ns',0)
                         # Sometimes the size key is not present, so we'll set it to 0 in those cases
                         revision['username'] = revision['user']
                         revision['size'] = revision.get('size', 0)
-                        revision['timestamp'] = convert_to_datetime(revision['timestamp'])
+                        revision['timestamp'] = timestamp
                         revisions.append(revision)
             except KeyError:
                 revisions = list()
     return revisions
 
-def make_page_alters(revisions):
+def make_page_alters(revisions,as_frame=False):
     '''
     Input:
-    revisions - a list of revisions generated by get_page_revisions
+    revisions - a list of revisions or a RevisionTable generated by get_page_revisions
+    as_frame - if True, return the DataFrame from alter_frame instead of a dictionary
 
     Output:
     alters - a dictionary keyed by user name that returns a dictionary containing
@@ -321,23 +780,18 @@ def make_page_alters(revisions):
     earliest edit to the page, the timestamp the user's latest edit to the page, and 
     the namespace of the page itself
     '''
-    alters = dict()
-    for rev in revisions:
-        if rev['user'] not in alters.keys():
-            alters[rev['user']] = dict()
-            alters[rev['user']]['count'] = 1
-            alters[rev['user']]['min_timestamp'] = rev['timestamp']
-            alters[rev['user']]['max_timestamp'] = rev['timestamp']
-        else:
-            alters[rev['user']]['count'] += 1
-            alters[rev['user']]['max_timestamp'] = rev['timestamp']
-    return alters
+    df = alter_frame(revisions,'user')
+    if as_frame:
+        return df
+    return alter_frame_to_dict(df)
 
-def get_page_content(page_title,dt_start,dt_end,lang):
+def get_page_content(page_title,dt_start,dt_end,lang,parse_links=True):
     '''
     Input: 
     page_title - A string with the name of the article or page to crawl
     lang - A string (typically two characters) indicating the language version of Wikipedia to crawl
+    parse_links - if False, leave out the 'links' of each revision so that link_finder can be run
+            elsewhere, e.g. in a worker process, with parse_revision_links
 
     Output:
     revisions_dict - A dictionary of revisions for the given article keyed by revision ID returning a 
@@ -360,14 +814,16 @@ def get_page_content(page_title,dt_start,dt_end,lang):
         page_number = result['pages'].keys()[0]
         try:
             revisions = result['pages'][page_number]['revisions']
-            for revision in revisions:
+            timestamps = convert_to_datetime64([revision['timestamp'] for revision in revisions]).tolist()
+            for revision,timestamp in zip(revisions,timestamps):
                 rev = dict()
                 rev['pageid'] = page_number
                 rev['title'] = result['pages'][page_number]['title']
                 rev['size'] = revision.get('size', 0) # Sometimes the size key is not present, so we'll set it to 0 in those cases
-                rev['timestamp'] = convert_to_datetime(revision['timestamp'])
+                rev['timestamp'] = timestamp
                 rev['content'] = revision.get('*',unicode()) # Sometimes content hidden, return with empty unicode string
-                rev['links'] = link_finder(rev['content'])
+                if parse_links:
+                    rev['links'] = link_finder(rev['content'])
                 rev['username'] = revision['user']
                 rev['revid'] = revision['revid']
                 revisions_dict[revision['revid']] = rev
@@ -375,24 +831,37 @@ def get_page_content(page_title,dt_start,dt_end,lang):
             pass
     return revisions_dict
 
-def adjacency_calcs(revisions):
+def adjacency_calcs(revisions,prior_users=None,approximate=False):
+    # prior_users are the editors of earlier revisions that were not fetched, so that
+    # unique_users_count stays cumulative when only recent revisions are passed in. With
+    # approximate, unique_users_count is a HyperLogLog estimate and revisions carry no
+    # unique_users lists, which grow with revisions times editors on large histories
     revisions = sorted(revisions,key=itemgetter('pageid','timestamp'))
+    if approximate:
+        # Imported here since wikipedia_sketches depends on this module through wikipedia_dumps
+        from wikipedia_sketches import HyperLogLog, item_hashes
+        sketch = HyperLogLog().add(item_hashes(prior_users or []))
+        counts = sketch.cumulative_counts(item_hashes([rev['username'] for rev in revisions]))
+        for rev,count in zip(revisions,counts.tolist()):
+            rev['unique_users_count'] = int(round(count))
     revisions[0]['position'] = 0
     revisions[0]['edit_lag'] = datetime.timedelta(0)
     revisions[0]['bytes_added'] = revisions[0]['size']
-    revisions[0]['unique_users'] = [revisions[0]['username']]
-    revisions[0]['unique_users_count'] = 1
+    if not approximate:
+        revisions[0]['unique_users'] = list(set(prior_users or []) | set([revisions[0]['username']]))
+        revisions[0]['unique_users_count'] = len(revisions[0]['unique_users'])
     revisions[0]['article_age'] = 0
     for num,rev in enumerate(revisions[:-1]):
         revisions[num+1]['position'] = rev['position'] + 1
         revisions[num+1]['edit_lag'] = revisions[num+1]['timestamp'] - rev['timestamp']
         revisions[num+1]['bytes_added'] = revisions[num+1]['size'] - rev['size']
         
-        revisions[num+1]['unique_users'] = rev['unique_users']
-        revisions[num+1]['unique_users'].append(revisions[num+1]['username'])
-        revisions[num+1]['unique_users'] = list(set(revisions[num+1]['unique_users']))
-        
-        revisions[num+1]['unique_users_count'] = len(revisions[num+1]['unique_users'])
+        if not approximate:
+            revisions[num+1]['unique_users'] = rev['unique_users']
+            revisions[num+1]['unique_users'].append(revisions[num+1]['username'])
+            revisions[num+1]['unique_users'] = list(set(revisions[num+1]['unique_users']))
+            
+            revisions[num+1]['unique_users_count'] = len(revisions[num+1]['unique_users'])
         revisions[num+1]['article_age'] = revisions[num+1]['timestamp'] - revisions[0]['timestamp']
     return revisions
 
@@ -436,7 +905,7 @@ def get_category_members(category_name, depth, lang='en'):
             cat_title = category['title']
             subcategories.append(cat_title)
     for category in subcategories:
-        articles += get_category_members(category,depth-1)      
+        articles += get_category_members(category,depth-1,lang)
     return articles
 
 def get_page_categories(page_title,lang='en'):
@@ -463,53 +932,175 @@ def get_page_categories(page_title,lang='en'):
         print u"{0} not found in category results".format(page_title)
     return categories
 
+# Protection descriptions in log events before MediaWiki 1.25, e.g.
+# "[edit=autoconfirmed] (expires 03:45, 1 May 2013 (UTC))[move=sysop] (indefinite)", or
+# "[edit=autoconfirmed:move=autoconfirmed]" in the oldest entries, which never expire
+protection_description_re = re.compile(r'\[([^\]]+)\](?:\s*\((?:expires (.+?) \(UTC\)|indefinite|infinite)\))?',re.UNICODE)
+expiry_re = re.compile(r'(\d{1,2}):(\d{2}), (\d{1,2}) (\w+) (\d{4})',re.UNICODE)
+month_numbers = dict((name,num + 1) for num,name in enumerate([u'January',u'February',u'March',u'April',u'May',u'June',u'July',
+                                                                u'August',u'September',u'October',u'November',u'December']))
+
+def parse_expiry(string):
+    '''
+    Input:
+    string - an expiry from a log event: an API timestamp, "infinite"/"indefinite", or the
+        "03:45, 1 May 2013" of a protection description. The oldest descriptions have none.
+
+    Output:
+    expiry - a datetime, or None for protections that never expire
+
+    Notes:
+    Raises ValueError for an expiry in any other form, e.g. with a localized month name, so that
+    it is never mistaken for an indefinite protection.
+    '''
+    if not string or string in (u'infinite',u'indefinite',u'infinity'):
+        return None
+    if u'T' in string and string.endswith(u'Z'):
+        return convert_to_datetime(string)
+    match = expiry_re.match(string)
+    if match is None or match.group(4) not in month_numbers:
+        raise ValueError(u'Cannot read the protection expiry {0!r}'.format(string))
+    hour,minute,day,month,year = match.groups()
+    return datetime.datetime(int(year),month_numbers[month],int(day),int(hour),int(minute))
+
+def protection_record(kind,level,expiry,event):
+    # One protection an event sets; an expiry that cannot be read is kept as 'invalid_expiry'
+    try:
+        return {'type':kind,'level':level,'expiry':parse_expiry(expiry)}
+    except ValueError:
+        print u'WARNING! Unreadable expiry {0!r} in log event {1} of {2}'.format(expiry,event.get('logid'),event.get('title'))
+        return {'type':kind,'level':level,'expiry':None,'invalid_expiry':expiry}
+
+def parse_protections(event):
+    '''
+    Input:
+    event - a protect or modify log event from list=logevents with leprop=details
+
+    Output:
+    protections - a list of dictionaries with the 'type' (edit, move, ...), 'level' (autoconfirmed,
+        sysop, ...) and 'expiry' (see parse_expiry) of each protection the event sets. Protections
+        whose expiry cannot be read have expiry None and the raw string as 'invalid_expiry'.
+    '''
+    details = event.get('params',dict()).get('details')
+    if details is not None:
+        # MediaWiki 1.25 and later
+        return [protection_record(d['type'],d['level'],d.get('expiry'),event) for d in details]
+    protections = list()
+    for levels,expiry in protection_description_re.findall(event.get('0',event.get('comment',unicode()))):
+        for pair in levels.split(u':'):
+            if u'=' in pair:
+                kind,level = pair.split(u'=',1)
+                protections.append(protection_record(kind,level,expiry,event))
+    return protections
+
+def parse_log_event(event):
+    # A log event from list=logevents with its timestamp parsed and, for protections, what they set
+    record = {'logid':event.get('logid'),
+              'title':event.get('title'),
+              'ns':event.get('ns'),
+              'pageid':event.get('pageid'),
+              'type':event.get('type'),
+              'action':event.get('action'),
+              'timestamp':convert_to_datetime(event['timestamp']),
+              'user':event.get('user'),
+              'comment':event.get('comment',unicode())}
+    if record['type'] == 'protect':
+        if record['action'] in ('protect','modify'):
+            record['protections'] = parse_protections(event)
+        elif record['action'] == 'move_prot':
+            # The title the protections were moved from, which names the log entry before 1.25
+            record['oldtitle'] = event.get('params',dict()).get('oldtitle_title',event.get('0'))
+    return record
+
 def get_article_logevents(article_name,lang,start_timestamp):
     '''
-    Given a string article_name, two-digit language string (lang) and
-    datetime timestamps is the start date of the range
-    '''
-    log_events = list()
-    results = do_query({'action':'query',
-                            'list':'logevents',
-                            'letitle':article_name,
-                            'ledir':'newer',
-                            'leprop':'ids|title|type|user|userid|timestamp|comment|details|tags',
-                            'lestart':start_timestamp.strftime("%Y%m%d%H%M%S")},
-                            lang)
-    events = results['logevents']
-    
-    if len(events) > 0:
-        for event in events:
-            new_event = dict()
-            new_event['action'] = event['action']
-            new_event['type'] = event['type']
-            new_event['start_timestamp'] = convert_datetime(event['timestamp'])
-            
-            new_event['comment1'] = event.get('comment',unicode())
-            new_event['comment2'] = event.get('0',unicode())
-            
-            # Loop to get if there are defined expiry dates on page protections
-            if 'expires' in new_event['comment1']:
-                new_event['expiry'] = event['comment']
-            elif 'expires' in new_event['comment2']:
-                new_event['expiry'] = event['0']
-                
-            # Assume protection is indefinite unless changed below
-            new_event['end_timestamp'] = u'indefinite'
-            
-            # Extract end timestamps from comment fields
-            try:
-                date_string = re.findall(r'\(expires\s?([^\)]*)\s\(UTC\)\)',new_event['expiry'])[0]
-                end_timestamp = datetime.datetime.strptime(date_string,"%H:%M, %d %B %Y")
-                new_event['end_timestamp'] = end_timestamp
-            except:
-                pass
-            
-            log_events.append(new_event)
+    Input:
+    article_name - a string with the title of the article
+    lang - a string (typically two characters) indicating the language version of Wikipedia to crawl
+    start_timestamp - a datetime; only events from then on are returned
+
+    Output:
+    log_events - a list of every log event of the article in time order (see parse_log_event).
+        Protection events carry a list of 'protections', each with its 'expiry'.
+    '''
+    result = wikipedia_query({'action':'query',
+                              'list':'logevents',
+                              'letitle':article_name,
+                              'ledir':'newer',
+                              'lelimit':'500',
+                              'leprop':'ids|title|type|user|userid|timestamp|comment|details|tags',
+                              'lestart':start_timestamp.strftime("%Y%m%d%H%M%S")},lang)
+    log_events = [parse_log_event(event) for event in result.get('logevents',list())]
+    if not log_events:
+        print u"WARNING! {0} HAS NO LOG EVENTS!".format(article_name)
+    return log_events
+
+def protection_log_query(lang,dt_start=None,dt_end=None,title=None):
+    # Every protection event of one title, or of the wiki, between two datetimes in time order
+    params = {'action':'query',
+              'list':'logevents',
+              'letype':'protect',
+              'ledir':'newer',
+              'lelimit':'500',
+              'leprop':'ids|title|type|user|timestamp|comment|details'}
+    if title is not None:
+        params['letitle'] = title
+    if dt_start is not None:
+        params['lestart'] = convert_from_datetime(dt_start)
+    if dt_end is not None:
+        params['leend'] = convert_from_datetime(dt_end)
+    return [parse_log_event(event) for event in wikipedia_query(params,lang).get('logevents',list())]
+
+def get_protection_events(article_list,lang='en',dt_start=None,dt_end=None,threads=8,whole_log=False):
+    '''
+    Input:
+    article_list - a list of article titles, or None with whole_log for every page
+    lang - a string (typically two characters) indicating the language version of Wikipedia to crawl
+    dt_start, dt_end - optional datetimes bounding the events
+    threads - how many queries to have in flight at once
+    whole_log - crawl the wiki's whole protection log and keep the events of article_list
+
+    Output:
+    events - a list of protection events (see parse_log_event) in time order, for building a
+        wikipedia_protection.ProtectionIndex. Queries that fail are reported and left out.
+
+    Notes:
+    list=logevents filters on a single title, so each article is its own query, following
+    query-continue, with threads of them in flight at once. When there are more articles than
+    the log has pages of 500 events, the whole log is cheaper; dt_start and dt_end are then
+    required and split into threads slices that are crawled at once.
+    '''
+    if whole_log:
+        if dt_start is None or dt_end is None:
+            raise ValueError('Crawling the whole protection log needs both dt_start and dt_end')
+        slices = max(1,threads)
+        bounds = [dt_start + (dt_end - dt_start) * num / slices for num in range(slices + 1)]
+        # leend is inclusive, so every slice but the last stops a second before the next starts
+        jobs = [(None,bounds[num],bounds[num + 1] - datetime.timedelta(seconds=1 if num + 1 < slices else 0))
+                for num in range(slices)]
     else:
-         print u"WARNING! {0} HAS NO LOG EVENTS!".format(article_name)
+        jobs = [(article,dt_start,dt_end) for article in article_list]
+    def fetch(job):
+        try:
+            return job,protection_log_query(lang,job[1],job[2],job[0]),None
+        except api_crawl_errors as e:
+            return job,None,e
     
-    return log_events
+    pool = ThreadPool(max(1,min(threads,len(jobs))))
+    events = list()
+    try:
+        for job,result,error in pool.imap_unordered(fetch,jobs):
+            if error is not None:
+                print u'Something happened to {0}: {1}'.format(job[0] or u'{0} - {1}'.format(job[1],job[2]),repr(error))
+            else:
+                events.extend(result)
+    finally:
+        pool.close()
+    if whole_log and article_list is not None:
+        articles = set(article_list)
+        events = [e for e in events if e['title'] in articles or e.get('oldtitle') in articles]
+    events.sort(key=itemgetter('timestamp','logid'))
+    return events
 
 def get_page_outlinks(page_title,lang='en'):
     '''
@@ -565,7 +1156,7 @@ def get_page_inlinks(page_title,lang='en'):
 
 # Links inside templates are included which results in completely-connected components
 # Remove links from templates by getting a list of templates used across all pages
-def get_page_templates(page_title,lang):
+def get_page_templates(page_title,lang='en'):
     '''
     Input:
     page_title - A string with the name of the article or page to crawl
@@ -680,7 +1271,7 @@ def get_user_outdiscussion(user_name,dt_end,lang='en'):
         r = result['usercontribs']
         for rev in r:
             alter = rev['title'][10:] # Ignore "User talk:"
-            if alter not in users.keys():
+            if alter not in users:
                 users[alter] = dict()
                 users[alter]['count'] = 1
                 users[alter]['min_timestamp'] = rev['timestamp']
@@ -715,7 +1306,7 @@ def get_user_indiscussion(user_name,dt_end,lang='en'):
         try:
             r = result['pages'][page_number]['revisions']
             for rev in r:
-                if rev['user'] not in users.keys():
+                if rev['user'] not in users:
                     users[rev['user']] = dict()
                     users[rev['user']]['count'] = 1
                     users[rev['user']]['min_timestamp'] = rev['timestamp']
@@ -743,52 +1334,161 @@ def get_user_discussion(user_name,dt_end,lang='en'):
     users['in'] = get_user_indiscussion(user_name,dt_end,lang)
     return users
 
-def make_article_trajectory(revisions):
+def get_user_talk_posts(user_name,direction,dt_end,lang='en'):
     '''
     Input:
-    revisions - A list of revisions generated by get_page_revisions
+    user_name - The name of a "ego" wikipedia user with no "User:" prefix, e.g. 'Madcoverboy' 
+    direction - 'out' for the ego's posts to other user talk pages, 'in' for other users' posts
+        to the ego's user talk page
+    dt_end - a datetime object indicating the maximum datetime to return for revisions
+    lang - a string (typically two characters) indicating the language version of Wikipedia to crawl
 
     Output:
-    g - A NetworkX DiGraph object corresponding to the trajectory of an article moving between users
-        Nodes are users and links from i to j exist when user i made a revision immediately following user j
+    posts - A list of (revid, source, target, timestamp) tuples, one per user talk revision
+    '''
+    user_name = normalize_username(user_name)
+    dt_end_string = convert_from_datetime(dt_end)
+    posts = list()
+    if direction == 'out':
+        result = wikipedia_query({'action':'query',
+                                  'list': 'usercontribs',
+                                  'ucuser': user_name,
+                                  'ucprop': 'ids|title|timestamp',
+                                  'ucnamespace':'3',
+                                  'uclimit': '500',
+                                  'ucend':dt_end_string},lang)
+        for rev in result.get('usercontribs',list()):
+            # Strip the localized "User talk:" prefix and any archive subpage
+            alter = rev['title'].split(u':',1)[-1].split(u'/')[0]
+            posts.append((rev['revid'],user_name,alter,rev['timestamp']))
+    else:
+        result = wikipedia_query({'titles': u'User talk:'+user_name,
+                                  'prop': 'revisions',
+                                  'rvprop': 'ids|timestamp|user',
+                                  'rvlimit': '5000',
+                                  'rvend': dt_end_string,
+                                  'action': 'query'},lang)
+        for page in result.get('pages',dict()).values():
+            for rev in page.get('revisions',list()):
+                posts.append((rev['revid'],rev.get('user',u''),user_name,rev['timestamp']))
+    return posts
+
+def get_discussion_edges(user_list,dt_end,lang='en',threads=8):
+    '''
+    Input:
+    user_list - A list of "ego" wikipedia users with no "User:" prefix
+    dt_end - a datetime object indicating the maximum datetime to return for revisions
+    lang - a string (typically two characters) indicating the language version of Wikipedia to crawl
+    threads - the number of user talk queries to run concurrently
+
+    Output:
+    edges - A DataFrame with one row per (source,target) pair of users where source posted to
+        target's user talk page, with the count of posts and the earliest and latest timestamps
+    
+    Notes:
+    The outgoing and incoming user talk activity of every user is fetched concurrently. A post between
+    two users in user_list is seen from both sides, so posts are counted once per revision ID.
+    '''
+    tasks = [(user,direction) for user in user_list for direction in ['out','in']]
+    pool = ThreadPool(threads)
+    try:
+        results = pool.map(lambda task: get_user_talk_posts(task[0],task[1],dt_end,lang),tasks)
+    finally:
+        pool.close()
+    
+    posts = list(itertools.chain.from_iterable(results))
+    df = pd.DataFrame(posts,columns=['revid','source','target','timestamp'])
+    df = df.drop_duplicates('revid')
+    df = df[(df['source'] != df['target']) & (df['source'] != u'')]
+    df['timestamp'] = pd.to_datetime(df['timestamp'],format='%Y-%m-%dT%H:%M:%SZ')
+    
+    grouped = df.groupby(['source','target'])['timestamp']
+    edges = pd.DataFrame({'count':grouped.size(),
+                          'min_timestamp':grouped.min(),
+                          'max_timestamp':grouped.max()},
+                         columns=['count','min_timestamp','max_timestamp'])
+    return edges.reset_index()
+
+def make_discussion_network(edges):
+    '''
+    Input:
+    edges - A DataFrame of discussion edges generated by get_discussion_edges
+
+    Output:
+    g - A NetworkX DiGraph object where links from i to j exist when user i posted to user j's
+        talk page, weighted by the number of posts
     '''
     g = nx.DiGraph()
-    # Sort revisions on ascending timestamp
-    sorted_revisions = sorted(revisions,key=lambda k:k['timestamp'])
-
-    # Don't use the last revision
-    for num,rev in enumerate(sorted_revisions[:-1]):
-        # Edge exists between user and user in next revision
-        edge = (rev['user'],revisions[num+1]['user'])
-        if g.has_edge(*edge):
-            g[edge[0]][edge[1]]['weight'] += 1
-        else:
-            g.add_edge(*edge,weight=1)
+    g.add_edges_from((source,target,{'weight':count,'min_timestamp':min_ts,'max_timestamp':max_ts})
+                     for source,target,count,min_ts,max_ts in zip(edges['source'],edges['target'],edges['count'],
+                                                                  edges['min_timestamp'],edges['max_timestamp']))
     return g
 
-def make_editor_trajectory(revisions):
+def trajectory_edges(revisions,by='page'):
     '''
     Input:
-    revisions - A list of revisions generated by get_user_revisions
+    revisions - a RevisionTable (e.g. RevisionTable.concat of many pages' or users' tables) or a
+        list of revision dictionaries
+    by - 'page' for the trajectories of articles between their editors, 'user' for the
+        trajectories of editors between the pages they edit
 
     Output:
-    g - A NetworkX DiGraph object corresponding to the trajectory of a user moving between articles
-        Nodes are pages and links from i to j exist when page i was edited by the user immediately following page j
+    edges - a DataFrame with one row per (title or user, source, target) and the weight, how many
+        times target's revision immediately followed source's in the page's (or user's) history
+
+    Notes:
+    Revisions are sorted once by page (or user), timestamp and revid, and every consecutive
+    pair within a group is a transition, found by comparing the sorted codes with themselves
+    shifted by one. Weights come from a single groupby over every group at once.
     '''
+    if not isinstance(revisions,RevisionTable):
+        revisions = RevisionTable.from_revisions(revisions)
+    if by == 'page':
+        group,groups,node,nodes = revisions.title_codes,revisions.titles,revisions.user_codes,revisions.users
+    elif by == 'user':
+        group,groups,node,nodes = revisions.user_codes,revisions.users,revisions.title_codes,revisions.titles
+    else:
+        raise ValueError("by must be 'page' or 'user', not {0!r}".format(by))
+    name = 'title' if by == 'page' else 'user'
+    order = np.lexsort((revisions.revid,revisions.timestamp,group))
+    group,node = group[order],node[order]
+    same = group[1:] == group[:-1]
+    transitions = pd.DataFrame({name:group[1:][same],'source':node[:-1][same],'target':node[1:][same]})
+    edges = transitions.groupby([name,'source','target']).size().reset_index(name='weight')
+    edges[name] = np.array(groups,dtype=object)[edges[name].values.astype(np.int64)]
+    for column in ('source','target'):
+        edges[column] = np.array(nodes,dtype=object)[edges[column].values.astype(np.int64)]
+    return edges[[name,'source','target','weight']]
+
+def trajectory_graph(edges):
+    # A weighted DiGraph of the transitions in an edge table from trajectory_edges, summed over its groups
     g = nx.DiGraph()
-    # Sort revisions on ascending timestamp
-    sorted_revisions = sorted(revisions,key=lambda k:k['timestamp'])
-
-    # Don't use the last revision
-    for num,rev in enumerate(sorted_revisions[:-1]):
-        # Edge exists between user and user in next revision
-        edge = (rev['title'],revisions[num+1]['user'])
-        if g.has_edge(*edge):
-            g[rev['title']][revisions[num+1]['user']]['weight'] += 1
-        else:
-            g.add_edge(*edge,weight=1)
+    weights = edges.groupby(['source','target'])['weight'].sum()
+    g.add_weighted_edges_from((source,target,int(weight)) for (source,target),weight in weights.iteritems())
     return g
 
+def make_article_trajectory(revisions):
+    '''
+    Input:
+    revisions - A list of revisions generated by get_page_revisions, or a RevisionTable
+
+    Output:
+    g - A NetworkX DiGraph object corresponding to the trajectory of an article moving between users
+        Nodes are users and links from i to j exist when user j made a revision immediately following user i
+    '''
+    return trajectory_graph(trajectory_edges(revisions,'page'))
+
+def make_editor_trajectory(revisions):
+    '''
+    Input:
+    revisions - A list of revisions generated by get_user_revisions, or a RevisionTable
+
+    Output:
+    g - A NetworkX DiGraph object corresponding to the trajectory of a user moving between articles
+        Nodes are pages and links from i to j exist when the user edited page j immediately after page i
+    '''
+    return trajectory_graph(trajectory_edges(revisions,'user'))
+
 def fixurl(url):
     # turn string into unicode
     if not isinstance(url,unicode):
@@ -829,58 +1529,166 @@ def convert_months_to_strings(m):
 		new_m = u'0'+unicode(m)
 	return new_m
 
+# The monthly daily pageview JSON, formatted with the language, YYYYMM and the article title
+pageviews_url = u"http://stats.grok.se/json/{0}/{1}/{2}"
+
 def get_url(article_name,lang,month,year):
-    url = u"http://stats.grok.se/json/" + lang + u"/" + unicode(year) + convert_months_to_strings(month) + u"/" + article_name
+    url = pageviews_url.format(lang,unicode(year) + convert_months_to_strings(month),article_name)
     fixed_url = fixurl(url)
     return fixed_url
 
+def pageview_urls(article_name,lang,min_date,max_date):
+    # One URL per month ending between min_date and max_date
+    return [get_url(article_name,lang,i.month,i.year) for i in pd.date_range(min_date,max_date,freq='M')]
+
+def request_daily_views(url):
+    # The daily_views dictionary of one month of stats.grok.se JSON, keyed by 'YYYY-MM-DD'
+    with request_stats.timed('pageviews') as event:
+        raw = retry_call(lambda: connection_pool.get(url,event), urlparse.urlsplit(url).netloc, event=event)
+    r = simplejson.loads(raw)
+    return r['daily_views']
+
 def requester(url):
-    opener = urllib2.build_opener()
-    req = urllib2.Request(url)
-    f = opener.open(req)
-    r = simplejson.load(f)
-    result = pd.Series(r['daily_views'])
+    result = pd.Series(request_daily_views(url))
     return result
 
 def clean_timestamps(df):
-    to_drop = list()
-    for d in df.index:
-        try:
-            datetime.date(int(d[0:4]),int(d[5:7]),int(d[8:10]))
-        except ValueError:
-            to_drop.append(d)
-    df2 = df.drop(to_drop,axis=0)
-    df2.index = pd.to_datetime(df2.index)
+    # stats.grok.se returns days 01-31 for every month, so drop the ones like 2013-02-30
+    index = pd.to_datetime(df.index,format='%Y-%m-%d',errors='coerce')
+    valid = np.asarray(index.notnull())
+    df2 = df[valid]
+    df2.index = index[valid]
     return df2
 
 def get_pageviews(article,lang,min_date,max_date):
     article = rename_on_redirect(article,lang=lang)
-    rng = pd.date_range(min_date,max_date,freq='M')
-    rng2 = [(i.month,i.year) for i in rng]
-    ts = pd.Series()
-    for i in rng2:
-        url = get_url(article,lang,i[0],i[1])
-        result = requester(url)
-        ts = pd.Series.append(result,ts)
-    ts = ts.sort_index()
+    months = [request_daily_views(url) for url in pageview_urls(article,lang,min_date,max_date)]
+    return assemble_pageviews(months)
+
+def assemble_pageviews(months):
+    # Build one Series from every month's days instead of growing a Series month by month
+    dates = list(itertools.chain.from_iterable(months))
+    views = np.fromiter(itertools.chain.from_iterable(month.itervalues() for month in months),
+                        dtype=np.float64,count=len(dates))
+    ts = pd.Series(views,index=dates)
     ts = clean_timestamps(ts)
+    ts = ts.sort_index()
     ts = ts.asfreq('D')
     return ts
 
-def make_pageview_df(article_list,lang,min_date,max_date):
-    df = pd.DataFrame(index=pd.date_range(start=min_date,end=max_date))
-    l = len(article_list)
-    for num,article in enumerate(article_list):
-        try:
-            print u"{0} / {1} : {2}".format(num+1,l,article)
-            ts = get_pageviews(article,lang,min_date,max_date)
-            df[article] = ts
-        except:
-            print u'Something happened to {0}'.format(unicode(article))
-            pass
+def fetch_pageviews(article_list,lang,min_date,max_date,threads=16):
+    '''
+    Input:
+    article_list - a list of article titles
+    lang - the language edition
+    min_date, max_date - the datetimes bounding the daily pageviews
+    threads - how many requests to have in flight at once
+
+    Output:
+    pageviews - a dictionary keyed by article of its daily pageview Series. Articles whose
+        redirect could not be resolved are reported and left out.
+    failed - a dictionary keyed by article of the month URLs that could not be fetched; their
+        days are missing from the article's Series
+
+    Notes:
+    Every month of every article is a separate job in one thread pool, so many articles' months
+    are in flight at once. Each month is retried on its own by request_daily_views, and the
+    threads reuse keep-alive connections from connection_pool.
+    '''
+    pool = ThreadPool(max(1,threads))
+    try:
+        def resolve(article):
+            try:
+                return rename_on_redirect(article,lang=lang)
+            except api_crawl_errors as e:
+                print u'Something happened to {0}: {1}'.format(unicode(article),repr(e))
+                return None
+        titles = pool.map(resolve,article_list,chunksize=1)
+        resolved = [article for article,title in zip(article_list,titles) if title is not None]
+        jobs = [(article,url) for article,title in zip(article_list,titles) if title is not None
+                for url in pageview_urls(title,lang,min_date,max_date)]
+        def fetch(job):
+            try:
+                return request_daily_views(job[1])
+            except crawl_errors + (ValueError, KeyError) as e:
+                print u'Could not get {0}: {1}'.format(job[1],repr(e))
+                return None
+        results = pool.map(fetch,jobs,chunksize=1)
+    finally:
+        pool.close()
+    months = dict((article,list()) for article in resolved)
+    failed = dict()
+    for (article,url),result in zip(jobs,results):
+        if result is None:
+            failed.setdefault(article,list()).append(url)
+        else:
+            months[article].append(result)
+    pageviews = dict((article,assemble_pageviews(months[article])) for article in resolved)
+    return pageviews,failed
+
+def pageviews_to_dict(ts):
+    # A JSON-serializable form of a daily pageview series for the crawl journal
+    return dict(zip(ts.index.strftime('%Y-%m-%d'),ts.values.tolist()))
+
+def pageviews_from_dict(d):
+    ts = pd.Series(d)
+    ts.index = pd.to_datetime(ts.index)
+    return ts.sort_index()
+
+def make_pageview_df(article_list,lang,min_date,max_date,journal=None,path=None,threads=16):
+    '''
+    Input:
+    article_list - a list of article titles
+    lang - the language edition
+    min_date, max_date - the datetimes bounding the daily pageviews
+    journal - an optional CrawlJournal or path; articles already in it are not fetched again
+    path - if given, where to write the frame, in the format given by its extension (see write_frame)
+    threads - how many month requests to have in flight at once (see fetch_pageviews)
+
+    Output:
+    df - a DataFrame of daily pageviews with a column per article. Months that could not be
+        fetched after retries are left empty rather than dropping the article.
+    '''
+    journal = as_journal(journal)
+    seen = set()
+    order = [article for article in article_list if not (article in seen or seen.add(article))]
+    key = lambda article: ('pageviews',lang,article,unicode(min_date),unicode(max_date))
+    
+    columns = dict()
+    if journal is not None:
+        for article in order:
+            if key(article) in journal:
+                request_stats.record_cache_hit('journal')
+                columns[article] = pageviews_from_dict(journal[key(article)])
+    todo = [article for article in order if article not in columns]
+    print u"Fetching pageviews for {0} of {1} articles".format(len(todo),len(order))
+    
+    pageviews,failed = fetch_pageviews(todo,lang,min_date,max_date,threads)
+    for article,ts in pageviews.iteritems():
+        columns[article] = ts
+        # Only complete articles are journaled, so a rerun tries the failed months again
+        if journal is not None and article not in failed:
+            journal.record(key(article),pageviews_to_dict(ts))
+    for article,urls in failed.iteritems():
+        print u'{0}: {1} months could not be fetched'.format(unicode(article),len(urls))
+    
+    # Build the wide frame once, aligning every article's series to the date range in one pass
+    order = [article for article in order if article in columns]
+    df = pd.DataFrame(columns,index=pd.date_range(start=min_date,end=max_date),columns=order)
+    df.index.name = 'date'
+    if path is not None:
+        write_frame(df,path)
     return df
 
+def revision_days(table):
+    # The calendar day of each revision in a RevisionTable
+    return (table.timestamp // 86400).astype('datetime64[D]')
+
 def revision_counter(revisions,min_date,max_date):
+    if isinstance(revisions,RevisionTable):
+        ts = pd.Series(1,index=revision_days(revisions)).groupby(level=0).sum()
+        ts = ts.reindex(pd.date_range(ts.index.min(),ts.index.max()),fill_value=0)
+        return ts[min_date:max_date]
     dd = dict()
     for r in revisions:
         d = r['timestamp'].date()
@@ -889,11 +1697,16 @@ def revision_counter(revisions,min_date,max_date):
         except KeyError:
             dd[d] = 1
     di = [datetime.datetime.combine(i,datetime.time()) for i in dd.keys()]
-    ts = pd.TimeSeries(dd.values(),index=di)
+    ts = pd.Series(dd.values(),index=di)
     ts = ts.reindex(pd.date_range(np.min(list(ts.index)),np.max(list(ts.index))),fill_value=0)
     return ts[min_date:max_date]
 
 def size_counter(revisions,min_date,max_date):
+    if isinstance(revisions,RevisionTable):
+        ts = pd.Series(revisions.size,index=revision_days(revisions)).groupby(level=0).median()
+        ts = ts.reindex(pd.date_range(ts.index.min(),ts.index.max()))
+        ts = ts.fillna(method='ffill')
+        return ts[min_date:max_date]
     dd = dict()
     dd2 = dict()
     for r in revisions:
@@ -905,7 +1718,7 @@ def size_counter(revisions,min_date,max_date):
     for k,v in dd.items():
         dd2[k] = np.median(v)
     di = [datetime.datetime.combine(i,datetime.time()) for i in dd2.keys()]
-    ts = pd.TimeSeries(dd2.values(),index=di)
+    ts = pd.Series(dd2.values(),index=di)
     ts = ts.reindex(pd.date_range(np.min(list(ts.index)),np.max(list(ts.index))))
     ts = ts.fillna(method='ffill')
     return ts[min_date:max_date]
@@ -926,7 +1739,7 @@ def link_counter(revisions,min_date,max_date):
     for k,v in ld.items():
         ld2[k] = len(set(ld[k]))
     di = [datetime.datetime.combine(i,datetime.time()) for i in ld2.keys()]
-    ts = pd.TimeSeries(ld2.values(),index=di)
+    ts = pd.Series(ld2.values(),index=di)
     ts = ts.reindex(pd.date_range(np.min(list(ts.index)),np.max(list(ts.index))))
     ts = ts.fillna(method='ffill')
     return ts[min_date:max_date]
@@ -945,12 +1758,29 @@ def word_counter(revisions,min_date,max_date):
     for k,v in ld.items():
         ld2[k] = np.median(v)
     di = [datetime.datetime.combine(i,datetime.time()) for i in ld2.keys()]
-    ts = pd.TimeSeries(ld2.values(),index=di)
+    ts = pd.Series(ld2.values(),index=di)
     ts = ts.reindex(pd.date_range(np.min(list(ts.index)),np.max(list(ts.index))))
     ts = ts.fillna(method='ffill')
     return ts[min_date:max_date]
     
-def user_counter(revisions,min_date,max_date):
+def user_counter(revisions,min_date,max_date,approximate=False):
+    # Revision dictionaries carry their unique_users_count from adjacency_calcs, exact or
+    # approximate; a RevisionTable is counted here, with a HyperLogLog if approximate
+    if isinstance(revisions,RevisionTable):
+        order = np.argsort(revisions.timestamp,kind='mergesort')
+        if approximate:
+            from wikipedia_sketches import HyperLogLog, item_hashes
+            counts = np.round(HyperLogLog().cumulative_counts(item_hashes(revisions.users)[revisions.user_codes[order]]))
+        else:
+            # Cumulative count of distinct users, incremented at each user's first revision
+            first = np.zeros(len(revisions),dtype=np.int64)
+            first[np.unique(revisions.user_codes[order],return_index=True)[1]] = 1
+            counts = np.cumsum(first)
+        days = revision_days(revisions)[order]
+        ts = pd.Series(counts,index=days).groupby(level=0).max()
+        ts = ts.reindex(pd.date_range(ts.index.min(),ts.index.max()))
+        ts = ts.fillna(method='ffill')
+        return ts[min_date:max_date]
     dd = dict()
     dd2 = dict()
     for r in revisions:
@@ -962,47 +1792,329 @@ def user_counter(revisions,min_date,max_date):
     for k,v in dd.items():
         dd2[k] = np.max(v)
     di = [datetime.datetime.combine(i,datetime.time()) for i in dd2.keys()]
-    ts = pd.TimeSeries(dd2.values(),index=di)
+    ts = pd.Series(dd2.values(),index=di)
     ts = ts.reindex(pd.date_range(np.min(list(ts.index)),np.max(list(ts.index))))
     ts = ts.fillna(method='ffill')
     return ts[min_date:max_date]
 
-talk_dict = {'en':u"Talk:",'pt':"Discussão:".decode('utf-8'),'es':"Discusión:".decode('utf-8')}
+def editor_sketches(revisions,freq='D',precision=12):
+    '''
+    Input:
+    revisions - a RevisionTable or a list of revision dictionaries, of any number of pages
+    freq - a pandas frequency for the time buckets, e.g. 'D' for days or 'M' for months
+    precision - the precision of each HyperLogLog (see wikipedia_sketches)
+
+    Output:
+    sketches - a dictionary of HyperLogLog sketches of each bucket's editors keyed by the
+        Timestamp starting the bucket. Sketches of other pages, languages or worker processes
+        combine with merge_editor_sketches, and distinct_editors counts them.
+    '''
+    from wikipedia_sketches import HyperLogLog, item_hashes
+    if isinstance(revisions,RevisionTable):
+        timestamps = pd.to_datetime(revisions.timestamp,unit='s')
+        hashes = item_hashes(revisions.users)[revisions.user_codes]
+    else:
+        timestamps = pd.to_datetime([r['timestamp'] for r in revisions])
+        hashes = item_hashes([r['username'] for r in revisions])
+    buckets,inverse = np.unique(pd.DatetimeIndex(timestamps).to_period(freq).to_timestamp().values,return_inverse=True)
+    order = np.argsort(inverse,kind='mergesort')
+    bounds = np.searchsorted(inverse[order],np.arange(len(buckets) + 1))
+    sketches = dict()
+    for num,bucket in enumerate(pd.DatetimeIndex(buckets)):
+        sketches[bucket] = HyperLogLog(precision).add(hashes[order[bounds[num]:bounds[num + 1]]])
+    return sketches
+
+def merge_editor_sketches(sketch_dicts,freq=None):
+    '''
+    Input:
+    sketch_dicts - dictionaries from editor_sketches, e.g. one per page or per worker process
+    freq - a coarser frequency to merge the buckets into, e.g. 'M' to turn days into months
+
+    Output:
+    sketches - a dictionary of the union of the editors of each bucket
+    '''
+    merged = dict()
+    for sketches in sketch_dicts:
+        for bucket,sketch in sketches.items():
+            if freq is not None:
+                bucket = bucket.to_period(freq).to_timestamp()
+            if bucket in merged:
+                merged[bucket].update(sketch)
+            else:
+                merged[bucket] = sketch.copy()
+    return merged
+
+def distinct_editors(sketches):
+    # A Series of the approximate number of distinct editors of each bucket from editor_sketches
+    buckets = sorted(sketches)
+    ts = pd.Series([sketches[bucket].count() for bucket in buckets],index=pd.DatetimeIndex(buckets),dtype=float)
+    ts.index.name = 'date'
+    return ts
+
+editing_dynamics_columns = [u"Article",u"Talk",u"Users",u"Size",u"Outlinks",u"Words"]
+
+def article_dynamics(article_revisions,min_date,max_date,prior_users=None,approximate=False):
+    # The columns of the editing dynamics that come from the article's own revisions
+    r1 = adjacency_calcs(article_revisions.values(),prior_users,approximate)
+    
+    ts1 = revision_counter(r1,min_date,max_date)
+    ts3 = user_counter(r1,min_date,max_date)
+    ts4 = size_counter(r1,min_date,max_date)
+    ts5 = link_counter(r1,min_date,max_date)
+    ts6 = word_counter(r1,min_date,max_date)
+    
+    dft = pd.concat([ts1,ts3,ts4,ts5,ts6],axis=1)
+    dft.columns = [u"Article",u"Users",u"Size",u"Outlinks",u"Words"]
+    return dft
+
+def talk_dynamics(talk_revisions,min_date,max_date):
+    if not talk_revisions:
+        return pd.DataFrame({u"Talk":pd.Series([],index=pd.DatetimeIndex([]),dtype=float)})
+    return pd.DataFrame({u"Talk":revision_counter(talk_revisions.values(),min_date,max_date)})
+
+def compute_editing_dynamics(article_revisions,talk_revisions,min_date,max_date):
+    '''
+    Input:
+    article_revisions - a dictionary of an article's revisions from get_page_content
+    talk_revisions - a dictionary of its talk page's revisions from get_page_content
+    min_date, max_date - the datetimes bounding the daily series
+
+    Output:
+    dft - a DataFrame indexed by day of the article and talk revisions, cumulative unique users,
+        size, outlinks and words
+    '''
+    dft = pd.concat([article_dynamics(article_revisions,min_date,max_date),
+                     talk_dynamics(talk_revisions,min_date,max_date)],axis=1)
+    dft.index.name = 'date'
+    return dft[editing_dynamics_columns]
+
+def revisions_state(revisions,prior_users=None):
+    '''
+    Input:
+    revisions - a list of revisions from get_page_content
+    prior_users - the editors of revisions before these
+
+    Output:
+    state - a dictionary with the day of the last revision, the editors of every revision before
+        that day, and the revid and timestamp of the last revision. Without revisions, e.g. for
+        a missing talk page, the day and timestamp are None and the revid is 0.
+    '''
+    if not revisions:
+        return {'day':None,'users':sorted(set(prior_users or [])),'revid':0,'timestamp':None}
+    last = max(revisions,key=itemgetter('timestamp'))
+    day = datetime.datetime.combine(last['timestamp'].date(),datetime.time())
+    users = set(prior_users or []) | set(r['username'] for r in revisions if r['timestamp'] < day)
+    return {'day':day.strftime('%Y-%m-%d'),
+            'users':sorted(users),
+            'revid':last['revid'],
+            'timestamp':last['timestamp'].strftime('%Y-%m-%dT%H:%M:%S')}
+
+def refresh_editing_dynamics(article_name,min_date,max_date,lang,format='csv'):
+    '''
+    Input:
+    article_name - the article to refresh
+    min_date, max_date - the datetimes bounding the daily series
+    lang - the language edition
+    format - the format of the saved frame, a key of wikipedia_io.formats
+
+    Output:
+    dft - the same DataFrame get_editing_dynamics returns, also written to <article_name>.<format>
+
+    Notes:
+    The first run crawls the full histories and saves <article_name>.state.json next to the frame.
+    It records, for the article and its talk page, the day of the last revision, the last revid,
+    and for the article the editors before that day. Later runs fetch only revisions from the
+    midnight starting that day, recompute the rows from that day on, and keep the earlier rows.
+    The last day is refetched whole because it may have been incomplete at the last run.
+    If neither page has a revision newer than the saved revids, nothing is recomputed.
+    '''
+    frame_file = frame_path(u'.',article_name,format)
+    state_path = safe_filename(article_name)+u'.state.json'
+    talk_title = talk_page_title(article_name,lang)
+    
+    if not (os.path.exists(frame_file) and os.path.exists(state_path)):
+        r1 = get_page_content(article_name,datetime.datetime(2001,1,1),max_date,lang)
+        r2 = get_page_content(talk_title,datetime.datetime(2001,1,1),max_date,lang)
+        dft = compute_editing_dynamics(r1,r2,min_date,max_date)
+        state = {'article':revisions_state(r1.values()),'talk':revisions_state(r2.values())}
+    else:
+        old = read_frame(frame_file,format,index='date')
+        with open(state_path) as f:
+            state = simplejson.load(f)
+        # A page without revisions at the last run is fetched again from min_date
+        day = lambda page: datetime.datetime.strptime(state[page]['day'],'%Y-%m-%d') if state[page]['day'] else min_date
+        article_day = day('article')
+        talk_day = day('talk')
+        r1 = get_page_content(article_name,article_day,max_date,lang)
+        r2 = get_page_content(talk_title,talk_day,max_date,lang)
+        if max(r1.keys() + [0]) <= state['article']['revid'] and max(r2.keys() + [0]) <= state['talk']['revid']:
+            return old
+        
+        article = old[[c for c in editing_dynamics_columns if c != u"Talk"]]
+        if r1:
+            article = pd.concat([article[article.index < article_day],
+                                 article_dynamics(r1,min_date,max_date,state['article']['users'])])
+            state['article'] = revisions_state(r1.values(),state['article']['users'])
+        talk = old[[u"Talk"]]
+        if r2:
+            talk = pd.concat([talk[talk.index < talk_day],talk_dynamics(r2,min_date,max_date)])
+            state['talk'] = revisions_state(r2.values())
+        dft = pd.concat([article,talk],axis=1)[editing_dynamics_columns]
+        # Rows only the old frame had on or after the refetched days are empty on both sides now
+        dft = dft.dropna(how='all')
+        dft.index.name = 'date'
+    
+    write_frame(dft,frame_file,format)
+    with open(state_path,'w') as f:
+        simplejson.dump(state,f)
+    return dft
 
-def get_editing_dynamics(article_name,min_date,max_date,lang):
+def fetch_editing_dynamics(article_name,min_date,max_date,lang,backend=None):
+    # Crawl an article and its talk page from the start of Wikipedia and compute their daily dynamics.
+    # backend is an object with the same get_page_content and talk_page_title, e.g. a
+    # wikipedia_dumps.DumpIndex, to read the revisions from instead of the API.
+    if backend is None:
+        r1 = get_page_content(article_name,datetime.datetime(2001,1,1),max_date,lang)
+        r2 = get_page_content(talk_page_title(article_name,lang),datetime.datetime(2001,1,1),max_date,lang)
+    else:
+        r1 = backend.get_page_content(article_name,datetime.datetime(2001,1,1),max_date,lang)
+        r2 = backend.get_page_content(backend.talk_page_title(article_name,lang),datetime.datetime(2001,1,1),max_date,lang)
+    return compute_editing_dynamics(r1,r2,min_date,max_date)
+
+def get_editing_dynamics(article_name,min_date,max_date,lang,incremental=False,format='csv',backend=None):
     if type(article_name) == str:
         try:
             article_name = article_name.decode('utf-8')
         except UnicodeDecodeError:
             print 'Cannot decode article name into Unicode using UTF8'
-            
-    talk_dict = {'en':u"Talk:",'pt':"Discussão:".decode('utf-8'),'es':"Discusión:".decode('utf-8')}
     
-    r1 = get_page_content(article_name,datetime.datetime(2001,1,1),max_date,lang)
-    r2 = get_page_content(talk_dict[lang]+article_name,datetime.datetime(2001,1,1),max_date,lang)
+    if incremental:
+        return refresh_editing_dynamics(article_name,min_date,max_date,lang,format)
+    dft = fetch_editing_dynamics(article_name,min_date,max_date,lang,backend)
+    write_frame(dft,frame_path(u'.',article_name,format),format)
+    return dft
+
+def parse_revision_links(revisions):
+    # Fill in the links of revisions fetched with get_page_content(..., parse_links=False)
+    for rev in revisions.itervalues():
+        if 'links' not in rev:
+            rev['links'] = link_finder(rev['content'])
+    return revisions
+
+def panel_dynamics(task):
+    # Runs in a worker process: parse the links and compute one article's rows of the panel
+    lang,article,article_revisions,talk_revisions,min_date,max_date = task
+    dft = compute_editing_dynamics(parse_revision_links(article_revisions),talk_revisions,min_date,max_date)
+    dft.index.name = 'date'
+    dft = dft.reset_index()
+    dft.insert(0,'article',article)
+    dft.insert(0,'lang',lang)
+    return dft
+
+def get_editing_dynamics_panel(article_list,min_date,max_date,lang,path=None,threads=8,processes=None,
+                               format=None,partition_cols=None,append=False):
+    '''
+    Input:
+    article_list - a list of article titles
+    min_date, max_date - the datetimes bounding the daily series
+    lang - the language edition
+    path - if given, where to write the panel
+    format, partition_cols, append - passed to write_frame, e.g. partition_cols=['lang'] and
+        append=True to add each language's panel to one directory
+    threads - how many articles to crawl at once
+    processes - how many worker processes parse links and compute counters, by default one per CPU
+
+    Output:
+    panel - a long-format DataFrame with one row per (lang, article, date) and the columns of
+        get_editing_dynamics. Articles whose crawl fails are reported and left out.
+
+    Notes:
+    Crawling runs in a thread pool and hands each article to a process pool as soon as its
+    revisions arrive, so link_finder and the counters use every core while other articles are
+    still downloading. Talk pages are crawled without their content, which only the article needs.
+    '''
+    def fetch(article):
+        try:
+            article_revisions = get_page_content(article,datetime.datetime(2001,1,1),max_date,lang,parse_links=False)
+            talk_revisions = get_page_revisions(talk_page_title(article,lang),datetime.datetime(2001,1,1),max_date,lang)
+            return article,article_revisions,dict((r['revid'],r) for r in talk_revisions),None
+        except api_crawl_errors as e:
+            return article,None,None,e
     
-    r1 = adjacency_calcs(r1.values())
+    thread_pool = ThreadPool(max(1,min(threads,len(article_list))))
+    process_pool = multiprocessing.Pool(processes)
+    pending = list()
+    try:
+        l = len(article_list)
+        for num,(article,article_revisions,talk_revisions,error) in enumerate(thread_pool.imap_unordered(fetch,article_list)):
+            print u"{0} / {1} : {2}".format(num+1,l,article)
+            if error is not None:
+                print u'Something happened to {0}: {1}'.format(article,repr(error))
+            elif not article_revisions:
+                print u"...{0} doesn't exist".format(article)
+            else:
+                task = (lang,article,article_revisions,talk_revisions,min_date,max_date)
+                pending.append((article,process_pool.apply_async(panel_dynamics,(task,))))
+        frames = list()
+        for article,result in pending:
+            try:
+                frames.append(result.get())
+            except Exception as e:
+                # Whatever one worker raised, keep the articles that finished
+                print u'Something happened to {0}: {1}'.format(article,repr(e))
+    finally:
+        thread_pool.close()
+        process_pool.close()
+        process_pool.join()
     
-    ts1 = revision_counter(r1,min_date,max_date)
-    ts2 = revision_counter(r2.values(),min_date,max_date)
-    ts3 = user_counter(r1,min_date,max_date)
-    ts4 = size_counter(r1,min_date,max_date)
-    ts5 = link_counter(r1,min_date,max_date)
-    ts6 = word_counter(r1,min_date,max_date)
+    if frames:
+        panel = pd.concat(frames,ignore_index=True).sort_values(['lang','article','date'])
+        panel = panel.reset_index(drop=True)
+    else:
+        panel = pd.DataFrame(columns=['lang','article','date'] + editing_dynamics_columns)
+    if path is not None:
+        write_frame(panel,path,format,partition_cols,append)
+    return panel
+
+def get_multilanguage_editing_dynamics(articles,min_date,max_date,threads=8):
+    '''
+    Input:
+    articles - a dictionary keyed by language returning the article title in that language, as
+        returned by get_language_titles, or a list of (lang, title) pairs
+    min_date, max_date - the datetimes bounding the daily series
+    threads - how many languages to crawl at once
+
+    Output:
+    panel - a DataFrame of the columns of get_editing_dynamics indexed by (lang, article, date).
+        Languages whose crawl fails are reported and left out.
+
+    Notes:
+    Each language version is a separate host with its own rate limit in rate_limiter, so the
+    crawls run in parallel without one wiki's backoff slowing down the others.
+    '''
+    if isinstance(articles,dict):
+        articles = sorted(articles.items())
     
-    ts1_name = u"Article"
-    ts2_name = u"Talk"
-    ts3_name = u"Users"
-    ts4_name = u"Size"
-    ts5_name = u"Outlinks"
-    ts6_name = u"Words"
+    def crawl(pair):
+        lang,title = pair
+        try:
+            return fetch_editing_dynamics(title,min_date,max_date,lang)
+        except api_crawl_errors as e:
+            print u'Something happened to {0}:{1}: {2}'.format(lang,title,repr(e))
+            return None
     
-    dft = pd.concat([ts1,ts2,ts3,ts4,ts5,ts6],axis=1)
-    dft.columns = [ts1_name,ts2_name,ts3_name,ts4_name,ts5_name,ts6_name]
-    dft.to_csv(article_name+u'.csv')
-    return dft
+    pool = ThreadPool(max(1,min(threads,len(articles))))
+    try:
+        frames = pool.map(crawl,articles)
+    finally:
+        pool.close()
+    keys = [pair for pair,frame in zip(articles,frames) if frame is not None]
+    frames = [frame for frame in frames if frame is not None]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames,keys=keys,names=['lang','article','date'])
     
-def get_editing_dynamics2(article_name,min_date,max_date,lang):
+def get_editing_dynamics2(article_name,min_date,max_date,lang,format='csv'):
     if type(article_name) == str:
         try:
             article_name = article_name.decode('utf-8')
@@ -1023,18 +2135,48 @@ def get_editing_dynamics2(article_name,min_date,max_date,lang):
     
     dft = pd.concat([ts1,ts3,ts4],axis=1)
     dft.columns = [ts1_name,ts3_name,ts4_name]
-    dft.to_csv(article_name+u'.csv')
+    dft.index.name = 'date'
+    write_frame(dft,frame_path(u'.',article_name,format),format)
     return dft
 
-def editors_other_activity(article_title,dt_start,dt_end,ignorelist,lang):
-    revisions = get_page_revisions(article_title,dt_start,dt_end,lang)
-    revision_alters = make_page_alters(revisions)
+def journaled(journal,key,func):
+    # Run func, or return its result from the journal if an earlier run finished it
+    if journal is None:
+        return func()
+    return journal.fetch(key,func)
+
+def editors_other_activity(article_title,dt_start,dt_end,ignorelist,lang,journal=None,backend=None):
+    '''
+    Input:
+    article_title - the article whose editors are crawled
+    dt_start, dt_end - the datetimes bounding the article's revisions; editors' contributions
+        are crawled back to dt_start
+    ignorelist - editors not to crawl
+    lang - the language edition
+    journal - an optional CrawlJournal or path; the article's revisions and every editor's
+        contributions are journaled as they finish, and a rerun skips them
+    backend - an optional object with get_page_revisions and get_user_revisions, e.g. a
+        wikipedia_dumps.DumpIndex, to read revisions from instead of the API
+
+    Output:
+    revisions - the article's revisions
+    alter_contributions - a dictionary keyed by editor of their revisions
+    '''
+    journal = as_journal(journal)
+    page_revisions = backend.get_page_revisions if backend is not None else get_page_revisions
+    user_revisions = backend.get_user_revisions if backend is not None else get_user_revisions
+    with request_stats.phase('page revisions'):
+        revisions = journaled(journal,('page revisions',lang,article_title,unicode(dt_start),unicode(dt_end)),
+                              lambda: page_revisions(article_title,dt_start,dt_end,lang))
+        revision_alters = make_page_alters(revisions)
     revision_alters2 = {k:v for k,v in revision_alters.iteritems() if k not in ignorelist}
     
     alter_contributions = dict()
-    for num,editor_alter in enumerate(revision_alters2.keys()):
-        print u"{0} / {1}: {2}".format(num+1,len(revision_alters2.keys()),editor_alter)
-        alter_contributions[editor_alter] = get_user_revisions(editor_alter,dt_start,lang)
+    with request_stats.phase('alter contributions'):
+        for num,editor_alter in enumerate(revision_alters2.keys()):
+            print u"{0} / {1}: {2}".format(num+1,len(revision_alters2.keys()),editor_alter)
+            alter_contributions[editor_alter] = journaled(journal,('contributions',lang,editor_alter,unicode(dt_start)),
+                                                          lambda: user_revisions(editor_alter,dt_start,lang))
         
     #el = directed_dict_to_edgelist(alter_discussions)
     return revisions,alter_contributions
@@ -1044,12 +2186,8 @@ def editing_primary_discussion_secondary(article_title,dt_start,dt_end,ignorelis
     revision_alters = make_page_alters(revisions)
     revision_alters2 = {k:v for k,v in revision_alters.iteritems() if k not in ignorelist}
     
-    alter_discussions = dict()
-    for num,editor_alter in enumerate(revision_alters2.keys()):
-        print u"{0} / {1}: {2}".format(num+1,len(revision_alters2.keys()),editor_alter)
-        alter_discussions[editor_alter] = get_user_discussion(editor_alter,dt)
-        
-    #el = directed_dict_to_edgelist(alter_discussions)
+    print u"Crawling user talk activity for {0} editors".format(len(revision_alters2))
+    alter_discussions = get_discussion_edges(revision_alters2.keys(),dt_start,lang)
     return revisions,alter_discussions
 
 def editing_primary_hyperlink_secondary(article_title,dt_start,dt_end,ignorelist):
@@ -1076,23 +2214,36 @@ def two_step_editing(article_title,dt,ignorelist):
         alter_revisions[editor_alter] = get_user_revisions(editor_alter,dt)
     return revisions, alter_revisions
 
-def two_step_outlinks(page_title):
+def two_step_outlinks(page_title,journal=None,link_index=None):
+    '''
+    Input:
+    page_title - the page whose outlinks, and their outlinks, are crawled
+    journal - an optional CrawlJournal or path; every page's links and templates are journaled
+        as they finish, and a rerun skips them
+    link_index - an optional wikipedia_links.LinkIndex to read links and templates from instead
+        of the API, in which case no requests are made
+
+    Output:
+    page_alters - a dictionary keyed by page of its outlinks
+    templates_dict - a dictionary keyed by page of its templates
+    '''
+    journal = as_journal(journal)
     page_alters = dict()
     templates_dict = dict()
     
-    links = get_page_outlinks(page_title)
+    page_outlinks = link_index.get_page_outlinks if link_index is not None else get_page_outlinks
+    page_templates = link_index.get_page_templates if link_index is not None else get_page_templates
+    fetch_page = lambda page: [page_outlinks(page),page_templates(page)]
+    links,templates = journaled(journal,('outlinks',page_title),lambda: fetch_page(page_title))
     page_alters[unicode(page_title)] = links
-    
-    templates = get_page_templates(page_title)
     templates_dict[page_title] = templates
     
     l = len(links)
     for num,link in enumerate(links):
         print u"{0} / {1} : {2}".format(num+1,l,link)
         try:
-            page_alters[link] = get_page_outlinks(link)
-            templates_dict[link] = get_page_templates(link)
-        except:
+            page_alters[link],templates_dict[link] = journaled(journal,('outlinks',link),lambda: fetch_page(link))
+        except Exception:
             print u"...{0} doesn't exist".format(link)
             pass
     return page_alters,templates_dict
@@ -1135,17 +2286,17 @@ def make_shared_user_editing_network(alter_revisions_dict,threshold):
                 net.add_edge(article,articles[num+1],weight=1)
                 
     # If edge is below threshold, remove it            
-    for i,j,d in net.edges_iter(data=True):
+    for i,j,d in list(net.edges(data=True)):
         if d['weight'] < threshold:
             net.remove_edge(i,j)
             
     # Remove self-loops
-    for i,j,d in net.edges_iter(data=True):
+    for i,j,d in list(net.edges(data=True)):
         if i == j:
             net.remove_edge(i,j)
     
     # Remove resulting isolates
-    isolates = nx.isolates(net)
+    isolates = list(nx.isolates(net))
     for isolate in isolates:
         net.remove_node(isolate)
     
@@ -1188,26 +2339,30 @@ def make_shared_page_editing_network(alter_revisions_dict,threshold):
                 g.add_edge(user,next_user,weight=1)
                 
     # If edge is below threshold, remove it            
-    for i,j,d in g.edges_iter(data=True):
+    for i,j,d in list(g.edges(data=True)):
         if d['weight'] < threshold:
             g.remove_edge(i,j)
             
     # Remove self-loops
-    for i,j,d in g.edges_iter(data=True):
+    for i,j,d in list(g.edges(data=True)):
         if i == j:
             g.remove_edge(i,j)
     
     # Remove resulting isolates
-    isolates = nx.isolates(g)
+    isolates = list(nx.isolates(g))
     for isolate in isolates:
         g.remove_node(isolate)
     
     return g
 
-def make_category_network(categories_dict):
+def make_category_network(categories_dict,link_index=None):
     '''Takes a dictionary keyed by page name with list of categories as values
     Returns a two-mode (enforced by DiGraph) page-category
+    With a wikipedia_links.LinkIndex, categories_dict can instead be a list of page names
+    whose categories are read from the index, e.g. the result of its get_category_members
     '''
+    if link_index is not None and not isinstance(categories_dict,dict):
+        categories_dict = dict((page,link_index.get_page_categories(page)) for page in categories_dict)
     g_categories=nx.DiGraph()
 
     for page,categories in categories_dict.iteritems():
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+'''
+wikipedia_sketches.py - trending articles from the hourly pagecount files in fixed memory
+
+Finding the articles whose views spike does not need a table of every title and hour. Each
+hourly pagecounts-raw file is read once, and every title's views are folded into count-min
+sketches: one for the current day, and exponentially weighted moving averages of past hours and
+days that serve as each title's baseline. A sketch has the same size however many titles pass
+through it, and since it is linear, the moving average of the hourly sketches is a sketch of
+the moving averages. The articles with the most views of each hour, and the candidates tracked
+through each day, are ranked by their ratio to the baseline:
+
+    hourly,daily = detect_trends(pagecount_paths('Data/',start,end),'en',k=25)
+    articles = trending_articles(daily,min_ratio=5)
+    dynamics = dict((a,get_editing_dynamics(a,start,end,'en')) for a in articles)
+
+HyperLogLog counts distinct items the same way, e.g. the editors behind the approximate modes of
+adjacency_calcs, user_counter and editor_sketches in wikipedia_scraping.
+'''
+
+import numpy as np
+import pandas as pd
+from wikipedia_pagecounts import read_pagecounts, pagecount_time, title_key, title_hashes
+from wikipedia_links import default_namespaces
+
+# Titles in namespaces other than articles, and the pages every visitor passes through
+non_article_prefixes = tuple(name + u':' for name in default_namespaces.values() if name) + (u'Special:',u'Media:')
+non_articles = set([u'Main Page',u'-',u'Undefined',u'Index.html',u'Favicon.ico',u'Robots.txt'])
+
+class CountMinSketch(object):
+    '''
+    Approximate counts of items identified by 64-bit hashes, in a depth x width table. Each row
+    adds an item's count to one column chosen by its own multiply-shift hash of the item, and
+    an item's estimate is the smallest of its columns: never below its true count, and above
+    it by at most a 2/width share of the total with probability 1 - 2**-depth.
+    '''
+    def __init__(self,width=2**19,depth=4,seed=0,dtype=np.int64):
+        '''
+        Input:
+        width - the number of columns, rounded up to a power of two
+        depth - the number of rows
+        seed - sketches with the same seed, width and depth can be combined with blend
+        dtype - the type of the table; a float type for moving averages
+        '''
+        self.bits = max(1,int(np.ceil(np.log2(width))))
+        self.width = 2 ** self.bits
+        self.depth = depth
+        rng = np.random.RandomState(seed)
+        # Odd multipliers make multiply-shift a universal hash family
+        self.multipliers = rng.randint(0,2 ** 62,size=depth).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+        self.table = np.zeros((depth,self.width),dtype=dtype)
+
+    def columns(self,hashes):
+        shift = np.uint64(64 - self.bits)
+        return [(hashes * multiplier) >> shift for multiplier in self.multipliers]
+
+    def add(self,hashes,counts):
+        for row,columns in enumerate(self.columns(hashes)):
+            self.table[row] += np.bincount(columns.astype(np.int64),weights=counts,minlength=self.width).astype(self.table.dtype)
+
+    def query(self,hashes):
+        estimates = [self.table[row][columns.astype(np.int64)] for row,columns in enumerate(self.columns(hashes))]
+        return np.min(estimates,axis=0) if len(estimates) else np.zeros(len(hashes))
+
+    def blend(self,other,weight):
+        # The moving average step self = (1 - weight) * self + weight * other, for a sketch like self
+        self.table *= 1 - weight
+        self.table += weight * other.table
+
+    def clear(self):
+        self.table[:] = 0
+
+class HeavyHitters(object):
+    '''
+    The items with the largest counts in a stream, tracked with a count-min sketch of every
+    item and a bounded set of candidates. After each batch, the batch's largest items join the
+    candidates, every candidate is estimated from the sketch, and only the capacity largest are
+    kept; an item is missed only if it never ranks among a batch's largest.
+    '''
+    def __init__(self,capacity=1000,width=2**19,depth=4,seed=0):
+        self.capacity = capacity
+        self.sketch = CountMinSketch(width,depth,seed)
+        self.candidates = dict()
+
+    def add(self,hashes,counts,titles):
+        self.sketch.add(hashes,counts)
+        for position in largest(counts,self.capacity):
+            self.candidates.setdefault(hashes[position],titles[position])
+        if len(self.candidates) > self.capacity:
+            keys = np.array(self.candidates.keys(),dtype=np.uint64)
+            drop = keys[np.argsort(-self.sketch.query(keys),kind='mergesort')[self.capacity:]]
+            for key in drop:
+                del self.candidates[key]
+
+    def top(self,k):
+        '''
+        Output:
+        top - a list of (hash, title, estimate) of the k largest candidates, largest first
+        '''
+        if not self.candidates:
+            return list()
+        keys = np.array(self.candidates.keys(),dtype=np.uint64)
+        estimates = self.sketch.query(keys)
+        order = np.argsort(-estimates,kind='mergesort')[:k]
+        return [(keys[i],self.candidates[keys[i]],estimates[i]) for i in order]
+
+    def clear(self):
+        self.sketch.clear()
+        self.candidates = dict()
+
+def item_hashes(items):
+    # 64-bit hashes of usernames or titles, unicode or UTF-8 bytes
+    return title_hashes([item.encode('utf-8') if isinstance(item,unicode) else item for item in items])
+
+def bit_length(values):
+    # The number of significant bits of each uint64, exactly: a float64 holds 32 bits without rounding
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xffffffff)).astype(np.float64)
+    return np.where(high > 0,32 + np.frexp(high)[1],np.frexp(low)[1])
+
+class HyperLogLog(object):
+    '''
+    An approximate count of distinct items in 2**precision one-byte registers. The top precision
+    bits of an item's 64-bit hash choose a register, which keeps the longest run of leading zeros
+    seen in the other bits. The count has a relative standard error of about 1.04/sqrt(2**precision),
+    1.6% at the default precision, and small counts are nearly exact. Sketches of the same
+    precision merge into the count of the union by taking the larger of each register, so
+    sketches of pages, days or worker processes (they pickle) are combined with update.
+    '''
+    def __init__(self,precision=12):
+        if not 4 <= precision <= 18:
+            raise ValueError('precision must be between 4 and 18, not %r' % (precision,))
+        self.precision = precision
+        self.registers = np.zeros(2 ** precision,dtype=np.uint8)
+
+    def positions(self,hashes):
+        # Each hash's register and rank, one more than the leading zeros after the register bits
+        hashes = np.asarray(hashes,dtype=np.uint64)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        rank = np.minimum(65 - bit_length(hashes << np.uint64(self.precision)),65 - self.precision)
+        return index,rank.astype(np.uint8)
+
+    def add(self,hashes):
+        index,rank = self.positions(hashes)
+        np.maximum.at(self.registers,index,rank)
+        return self
+
+    def update(self,other):
+        if other.precision != self.precision:
+            raise ValueError('cannot merge sketches of precision %d and %d' % (self.precision,other.precision))
+        np.maximum(self.registers,other.registers,out=self.registers)
+        return self
+
+    def copy(self):
+        sketch = HyperLogLog(self.precision)
+        sketch.registers[:] = self.registers
+        return sketch
+
+    def estimate(self,total,zeros):
+        # Linear counting of the empty registers while the count is small, otherwise the
+        # harmonic-mean estimate from the sum of 2**-register
+        m = len(self.registers)
+        if zeros:
+            estimate = m * np.log(float(m) / zeros)
+            if estimate <= 2.5 * m:
+                return estimate
+        return 0.7213 / (1 + 1.079 / m) * m * m / total
+
+    def count(self):
+        return self.estimate(np.sum(np.ldexp(1.,-self.registers.astype(np.int64))),int(np.sum(self.registers == 0)))
+
+    def cumulative_counts(self,hashes):
+        '''
+        Input:
+        hashes - the hashes of a stream of items, in order, e.g. from item_hashes
+
+        Output:
+        counts - an array of the count of distinct items after each is added, including the
+            items already in the sketch, which keeps them all afterwards
+        '''
+        index,rank = self.positions(hashes)
+        registers = self.registers.tolist()
+        total = sum(2. ** -r for r in registers)
+        zeros = registers.count(0)
+        counts = np.empty(len(index))
+        for position,(i,r) in enumerate(zip(index.tolist(),rank.tolist())):
+            if r > registers[i]:
+                total += 2. ** -r - 2. ** -registers[i]
+                zeros -= registers[i] == 0
+                registers[i] = r
+            counts[position] = self.estimate(total,zeros)
+        self.registers[:] = registers
+        return counts
+
+def largest(values,n):
+    # The positions of the n largest values, largest first, without sorting all of them
+    if len(values) > n:
+        positions = np.argpartition(-values,n)[:n]
+    else:
+        positions = np.arange(len(values))
+    return positions[np.argsort(-values[positions],kind='mergesort')]
+
+def is_article(title):
+    return not (title in non_articles or title.startswith(non_article_prefixes))
+
+class TrendDetector(object):
+    '''
+    Reports the top articles of each hour and each day, with moving-average baselines of every
+    title kept in count-min sketches. Feed it one hour at a time with update, in time order.
+    '''
+    def __init__(self,k=20,halflife=24,daily_halflife=7,min_views=100,capacity=1000,width=2**19,depth=4,seed=0,rank_by='ratio'):
+        '''
+        Input:
+        k - how many articles to report per hour and per day
+        rank_by - 'ratio' to report the articles with the largest ratio of views to baseline,
+            among the capacity most viewed, or 'views' to report the most viewed
+        halflife - the half-life in hours of the hourly baseline
+        daily_halflife - the half-life in days of the daily baseline
+        min_views - hours and days with fewer views are not reported, so that rarely viewed
+            titles with a near-zero baseline do not dominate the ratios
+        capacity - how many candidates to track through each day (see HeavyHitters)
+        width, depth, seed - the size of every sketch (see CountMinSketch); three float sketches
+            and one integer sketch of depth x width 8-byte cells are kept
+        '''
+        if rank_by not in ('ratio','views'):
+            raise ValueError('rank_by must be ratio or views, not %r' % (rank_by,))
+        self.k = k
+        self.rank_by = rank_by
+        self.capacity = capacity
+        self.min_views = min_views
+        self.hour_weight = 1 - 0.5 ** (1. / halflife)
+        self.day_weight = 1 - 0.5 ** (1. / daily_halflife)
+        self.hour_sketch = CountMinSketch(width,depth,seed,np.float64)
+        self.hour_baseline = CountMinSketch(width,depth,seed,np.float64)
+        self.day_baseline = CountMinSketch(width,depth,seed,np.float64)
+        self.day = HeavyHitters(capacity,width,depth,seed)
+        self.current_day = None
+        self.hours_seen = 0
+        self.days_seen = 0
+        self.daily_reports = list()
+
+    def report(self,when,titles,views,baseline):
+        # Candidates come most viewed first; before any baseline exists the ratio is NaN and the
+        # stable sort leaves them in that order
+        ratio = views / np.maximum(baseline,1.)
+        if self.rank_by == 'ratio':
+            order = np.argsort(-np.nan_to_num(ratio),kind='mergesort')
+        else:
+            order = np.arange(len(titles))
+        order = order[:self.k]
+        titles,views,baseline,ratio = [titles[i] for i in order],views[order],baseline[order],ratio[order]
+        return pd.DataFrame({'date':when,'rank':np.arange(1,len(titles) + 1),'title':titles,
+                             'views':views,'baseline':baseline,'ratio':ratio},
+                            columns=['date','rank','title','views','baseline','ratio'])
+
+    def end_day(self):
+        # Report the day's top candidates against the daily baseline, then fold the day into it
+        if self.current_day is None:
+            return None
+        top = [(h,t,v) for h,t,v in self.day.top(self.day.capacity) if is_article(t) and v >= self.min_views]
+        hashes = np.array([h for h,t,v in top],dtype=np.uint64)
+        baseline = self.day_baseline.query(hashes) if self.days_seen else np.repeat(np.nan,len(top))
+        report = self.report(pd.Timestamp(self.current_day),[t for h,t,v in top],
+                             np.array([v for h,t,v in top],dtype=np.float64),baseline)
+        if self.days_seen:
+            self.day_baseline.blend(self.day.sketch,self.day_weight)
+        else:
+            self.day_baseline.table[:] = self.day.sketch.table
+        self.days_seen += 1
+        self.day.clear()
+        self.daily_reports.append(report)
+        return report
+
+    def update(self,when,titles,counts):
+        '''
+        Input:
+        when - the datetime of the hour
+        titles - the unicode titles viewed in the hour
+        counts - an array of their views
+
+        Output:
+        report - a DataFrame of the hour's top k articles with columns date, rank, title, views,
+            baseline (the moving average of the title's hourly views before this hour, NaN in
+            the first hour) and ratio
+        '''
+        if self.current_day is not None and when.date() != self.current_day:
+            self.end_day()
+        self.current_day = when.date()
+        hashes = title_hashes([title.encode('utf-8') for title in titles])
+        counts = np.asarray(counts,dtype=np.float64)
+        self.day.add(hashes,counts,titles)
+
+        top = [i for i in largest(counts,self.capacity) if counts[i] >= self.min_views and is_article(titles[i])]
+        top = np.array(top,dtype=np.int64)
+        baseline = self.hour_baseline.query(hashes[top]) if self.hours_seen else np.repeat(np.nan,len(top))
+        report = self.report(pd.Timestamp(when),[titles[i] for i in top],counts[top],baseline)
+
+        self.hour_sketch.clear()
+        self.hour_sketch.add(hashes,counts)
+        if self.hours_seen:
+            self.hour_baseline.blend(self.hour_sketch,self.hour_weight)
+        else:
+            self.hour_baseline.table[:] = self.hour_sketch.table
+        self.hours_seen += 1
+        return report
+
+def hour_views(path,lang,redirect_index=None):
+    '''
+    Output:
+    titles - the distinct titles of lang in one pagecount file, with their spellings merged and,
+        given a RedirectIndex, redirects merged into their articles
+    counts - an array of each title's views in the hour
+    '''
+    raw,raw_counts = read_pagecounts(path,lang)
+    keys = [title_key(title) for title in raw]
+    if redirect_index is not None and keys:
+        codes = redirect_index.lookup_hashes(title_hashes(keys))
+        keys = [redirect_index.titles[code] if code >= 0 else key for key,code in zip(keys,codes)]
+    totals = dict()
+    for key,count in zip(keys,raw_counts.tolist()):
+        totals[key] = totals.get(key,0) + count
+    titles = [key.decode('utf-8','replace') for key in totals]
+    return titles,np.array(totals.values(),dtype=np.float64)
+
+def detect_trends(paths,lang,k=20,redirect_index=None,detector=None,**kwargs):
+    '''
+    Input:
+    paths - pagecounts-raw files, e.g. from pagecount_paths
+    lang - the project code of the lines to read, e.g. 'en'
+    k - how many articles to report per hour and per day
+    redirect_index - an optional RedirectIndex whose redirects are counted toward their articles
+    detector - an optional TrendDetector to continue with, e.g. one that has seen earlier files
+    kwargs - the other parameters of TrendDetector
+
+    Output:
+    hourly - a DataFrame of each hour's top k articles (see TrendDetector.update)
+    daily - a DataFrame of each day's top k articles, against the daily baseline; the last day
+        is reported with the hours it has
+    '''
+    if detector is None:
+        detector = TrendDetector(k,**kwargs)
+    hourly = list()
+    for path in sorted(paths,key=pagecount_time):
+        titles,counts = hour_views(path,lang,redirect_index)
+        hourly.append(detector.update(pagecount_time(path),titles,counts))
+    detector.end_day()
+    hourly = pd.concat(hourly,ignore_index=True) if hourly else pd.DataFrame()
+    daily = pd.concat(detector.daily_reports,ignore_index=True) if detector.daily_reports else pd.DataFrame()
+    return hourly,daily
+
+def trending_articles(report,min_ratio=3.,min_views=0):
+    '''
+    Input:
+    report - an hourly or daily report from detect_trends
+    min_ratio - the smallest ratio of views to baseline to count as a spike
+    min_views - the fewest views to count as a spike
+
+    Output:
+    articles - the distinct titles that spiked, most views first, as candidates for
+        get_editing_dynamics
+    '''
+    # Rows without a baseline yet have a NaN ratio and never count
+    spikes = report[(report['ratio'] >= min_ratio) & (report['views'] >= min_views)]
+    spikes = spikes.sort_values('views',ascending=False)
+    return list(spikes['title'].drop_duplicates())